@@ -1,7 +1,7 @@
 from rest_framework.permissions import BasePermission
 from rest_framework_api_key.permissions import BaseHasAPIKey
 from rest_framework_api_key.models import APIKey
-from ...models import Application
+from ...models import Application, ApplicationKey
 
 
 class IsStaffUser(BasePermission):
@@ -29,7 +29,13 @@ class IsOwner(BasePermission):
         # must be the owner to view the object
         owner = getattr(obj, "user", None)
         user = getattr(obj, "owner", None)
-        return (owner == request.user) or (user == request.user)
+        # The id is compared, loading the recipient costs a query per object
+        recipient_id = getattr(obj, "recipient_id", None)
+        return (
+            (owner == request.user)
+            or (user == request.user)
+            or (recipient_id is not None and str(recipient_id) == str(request.user.pk))
+        )
 
 
 class HasApplicationKey(BasePermission):
@@ -51,19 +57,7 @@ class HasApplicationAPIKey(BaseHasAPIKey):
         key = self.get_key(request)
         if key is None:
             return False
-
-        try:
-            apikey = self.model.objects.get_from_key(key)
-            valid_key = self.model.objects.is_valid(key)
-        except APIKey.DoesNotExist:
-            return False
-
-        # Check API Key linked with application
-        if not apikey or not valid_key:
-            return False
-
-        aplication_api_key = application.apikeys.filter(id=apikey.id).first()
-        return bool(aplication_api_key)
+        return ApplicationKey.is_authorized(application, key)
 
     def has_object_permission(self, request, view, obj) -> bool:
         return self.has_permission(request, view)
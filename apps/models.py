@@ -1,15 +1,40 @@
+import copy
+import hashlib
 import uuid
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.mail import send_mass_mail
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _  # NOQA
 from rest_framework_api_key.models import APIKey
 
+from .caches import TTLCache
 
 User = get_user_model()
 
+APPLICATION_CACHE_SIZE = getattr(settings, "APPS_APPLICATION_CACHE_SIZE", 1024)
+APPLICATION_CACHE_TTL = getattr(settings, "APPS_APPLICATION_CACHE_TTL", 60)
+
+API_KEY_CACHE_SIZE = getattr(settings, "APPS_API_KEY_CACHE_SIZE", 4096)
+API_KEY_CACHE_TTL = getattr(settings, "APPS_API_KEY_CACHE_TTL", 300)
+
+application_cache = TTLCache(APPLICATION_CACHE_SIZE, APPLICATION_CACHE_TTL)
+# (application id, key digest) -> (api key id, generation, expiry date)
+api_key_cache = TTLCache(API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL)
+
+
+def get_api_key_generation_key(prefix):
+    return "apps:apikey:generation:%s" % prefix
+
+
+def get_api_key_prefix(key):
+    """Return the prefix of a raw key or of an ``APIKey`` id, unverified."""
+    return key.partition(".")[0]
+
 
 class Application(models.Model):
     created = models.DateTimeField(
@@ -45,13 +70,34 @@ class Application(models.Model):
     def __str__(self):
         return f"{self.name}"
 
+    @classmethod
+    def get_cached(cls, application_id):
+        """
+        Return the application from the process cache, loading it on a
+        miss. Every caller gets its own copy of the cached instance.
+        """
+        if application_id is None:
+            return None
+        application_id = str(application_id)
+        application = application_cache.get(application_id)
+        if application is None:
+            application = cls.objects.filter(id=application_id).first()
+            if application is None:
+                return None
+            application_cache.set(application_id, application)
+        return copy.copy(application)
+
     @classmethod
     def get_from_request_headers(cls, request):
         application_id = request.META.get("HTTP_X_APPLICATION", None)
         if application_id is None:
             application_id = request.headers.get("X-Application", None)
-        application = cls.objects.filter(id=application_id).first()
-        return application
+        # Resolved once per request, the permissions and the view share it
+        request = getattr(request, "_request", request)
+        memo = request.__dict__.setdefault("_applications", {})
+        if application_id not in memo:
+            memo[application_id] = cls.get_cached(application_id)
+        return memo[application_id]
 
 
 class ApplicationKey(models.Model):
@@ -73,3 +119,90 @@ class ApplicationKey(models.Model):
 
     def __str__(self) -> str:
         return f"{self.application}: {self.key}"
+
+    @classmethod
+    def is_authorized(cls, application, key):
+        """
+        Return whether ``key`` is a valid API key linked to ``application``.
+
+        Checking a key runs the slow password hasher, so verified keys are
+        remembered by the sha256 digest of the key for at most
+        ``APPS_API_KEY_CACHE_TTL`` seconds, and never past their expiry date.
+        A cached key is trusted while its generation in the shared cache did
+        not change, revoking or unlinking a key bumps the generation. The
+        generation is read before the key is verified, so a revocation landing
+        meanwhile is never cached as valid.
+        """
+        cache_key = (str(application.pk), hashlib.sha256(key.encode()).hexdigest())
+        generation = cache.get(get_api_key_generation_key(get_api_key_prefix(key)))
+        cached = api_key_cache.get(cache_key)
+        if cached is not None:
+            apikey_id, cached_generation, expiry_date = cached
+            if (
+                expiry_date is None or expiry_date > timezone.now()
+            ) and cached_generation == generation:
+                return True
+            api_key_cache.delete(cache_key)
+
+        try:
+            apikey = APIKey.objects.get_from_key(key)
+        except APIKey.DoesNotExist:
+            return False
+        if apikey.has_expired:
+            return False
+        if not cls.objects.filter(application=application, key=apikey).exists():
+            return False
+
+        api_key_cache.set(cache_key, (apikey.pk, generation, apikey.expiry_date))
+        return True
+
+
+def invalidate_application_cache(sender, instance, **kwargs):
+    application_cache.delete(str(instance.pk))
+
+
+post_save.connect(
+    invalidate_application_cache,
+    sender=Application,
+    dispatch_uid="apps.application.invalidate_cache",
+)
+post_delete.connect(
+    invalidate_application_cache,
+    sender=Application,
+    dispatch_uid="apps.application.invalidate_cache",
+)
+
+
+def invalidate_api_key_cache(apikey_id):
+    cache.set(
+        get_api_key_generation_key(get_api_key_prefix(apikey_id)),
+        uuid.uuid4().hex,
+        API_KEY_CACHE_TTL,
+    )
+    api_key_cache.delete_many(lambda key, value: value[0] == apikey_id)
+
+
+def api_key_changed(sender, instance, **kwargs):
+    invalidate_api_key_cache(instance.pk)
+
+
+def application_key_changed(sender, instance, **kwargs):
+    invalidate_api_key_cache(instance.key_id)
+
+
+post_save.connect(
+    api_key_changed, sender=APIKey, dispatch_uid="apps.apikey.invalidate_cache"
+)
+post_delete.connect(
+    api_key_changed, sender=APIKey, dispatch_uid="apps.apikey.invalidate_cache"
+)
+post_save.connect(
+    application_key_changed,
+    sender=ApplicationKey,
+    dispatch_uid="apps.applicationkey.invalidate_cache",
+)
+post_delete.connect(
+    application_key_changed,
+    sender=ApplicationKey,
+    dispatch_uid="apps.applicationkey.invalidate_cache",
+)
@@ -22,6 +22,11 @@ class OwnerObject:
         self.owner = owner
 
 
+class RecipientObject:
+    def __init__(self, recipient_id) -> None:
+        self.recipient_id = recipient_id
+
+
 class ViewObject:
     def __init__(self) -> None:
         pass
@@ -91,6 +96,21 @@ class TestSendNotification(TestCase):
         has_obj_perm = is_owner.has_object_permission(request2, self.view, owner_object)
         self.assertFalse(has_obj_perm)
 
+    def test_is_recipient(self):
+        is_owner = permissions.IsOwner()
+        recipient_object = RecipientObject(str(self.user1.pk))
+
+        with self.assertNumQueries(0):
+            has_obj_perm = is_owner.has_object_permission(
+                RequestObject(self.user1), self.view, recipient_object
+            )
+        self.assertTrue(has_obj_perm)
+
+        has_obj_perm = is_owner.has_object_permission(
+            RequestObject(self.user2), self.view, recipient_object
+        )
+        self.assertFalse(has_obj_perm)
+
     def test_is_admin_user(self):
         perm = permissions.IsAdminUser()
 
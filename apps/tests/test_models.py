@@ -0,0 +1,134 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework_api_key.models import APIKey
+from apps.models import (
+    Application,
+    ApplicationKey,
+    api_key_cache,
+    application_cache,
+    invalidate_api_key_cache,
+)
+
+User = get_user_model()
+
+
+class RequestObject:
+    def __init__(self, application_id) -> None:
+        self.headers = {"X-Application": application_id}
+        self.META = {"HTTP_X_APPLICATION": application_id}
+
+
+class TestApplicationCache(TestCase):
+    def setUp(self) -> None:
+        application_cache.clear()
+        self.user = User.objects.create_user(username="testuser1", password="test123")
+        self.application = Application.objects.create(
+            owner=self.user, name="Application Test", domain="http://localhost:8000"
+        )
+        self.application_id = str(self.application.id)
+        return super().setUp()
+
+    def test_resolved_once_per_request(self):
+        request = RequestObject(self.application_id)
+        with self.assertNumQueries(1):
+            application = Application.get_from_request_headers(request)
+            self.assertIs(Application.get_from_request_headers(request), application)
+
+        # Warm process cache, a new request costs no query
+        with self.assertNumQueries(0):
+            application = Application.get_from_request_headers(
+                RequestObject(self.application_id)
+            )
+        self.assertEqual(application.name, "Application Test")
+
+    def test_invalidated_on_save_and_delete(self):
+        Application.get_from_request_headers(RequestObject(self.application_id))
+
+        self.application.name = "Renamed"
+        self.application.save()
+        application = Application.get_from_request_headers(
+            RequestObject(self.application_id)
+        )
+        self.assertEqual(application.name, "Renamed")
+
+        self.application.delete()
+        self.assertIsNone(
+            Application.get_from_request_headers(RequestObject(self.application_id))
+        )
+
+    def test_unknown_application(self):
+        request = RequestObject("unknown")
+        self.assertIsNone(Application.get_from_request_headers(request))
+        self.assertIsNone(Application.get_from_request_headers(RequestObject(None)))
+
+
+class TestApiKeyCache(TestCase):
+    def setUp(self) -> None:
+        api_key_cache.clear()
+        self.user = User.objects.create_user(username="testuser1", password="test123")
+        self.application = Application.objects.create(
+            owner=self.user, name="Application Test", domain="http://localhost:8000"
+        )
+        self.api_key, self.key = APIKey.objects.create_key(name="Test API Key")
+        self.link = ApplicationKey.objects.create(
+            application=self.application, key=self.api_key
+        )
+        return super().setUp()
+
+    def is_authorized(self):
+        return ApplicationKey.is_authorized(self.application, self.key)
+
+    def test_verified_key_is_cached(self):
+        with mock.patch.object(
+            APIKey, "is_valid", autospec=True, side_effect=APIKey.is_valid
+        ) as is_valid:
+            self.assertTrue(self.is_authorized())
+            with self.assertNumQueries(0):
+                self.assertTrue(self.is_authorized())
+        self.assertEqual(is_valid.call_count, 1)
+
+    def test_wrong_key(self):
+        self.assertFalse(
+            ApplicationKey.is_authorized(self.application, self.key + "wrong")
+        )
+        other = Application.objects.create(owner=self.user, domain="http://other")
+        self.assertTrue(self.is_authorized())
+        self.assertFalse(ApplicationKey.is_authorized(other, self.key))
+
+    def test_revoked_key(self):
+        self.assertTrue(self.is_authorized())
+        self.api_key.revoked = True
+        self.api_key.save()
+        self.assertFalse(self.is_authorized())
+
+    def test_key_revoked_while_verified(self):
+        get_from_key = APIKey.objects.get_from_key
+
+        def revoke(key):
+            apikey = get_from_key(key)
+            APIKey.objects.filter(pk=apikey.pk).update(revoked=True)
+            invalidate_api_key_cache(apikey.pk)
+            return apikey
+
+        with mock.patch.object(APIKey.objects, "get_from_key", side_effect=revoke):
+            self.is_authorized()
+        self.assertFalse(self.is_authorized())
+
+    def test_unlinked_key(self):
+        self.assertTrue(self.is_authorized())
+        self.link.delete()
+        self.assertFalse(self.is_authorized())
+
+    def test_expired_key(self):
+        self.api_key.expiry_date = timezone.now() + timedelta(seconds=1)
+        self.api_key.save()
+        self.assertTrue(self.is_authorized())
+        with mock.patch(
+            "django.utils.timezone.now",
+            return_value=timezone.now() + timedelta(seconds=2),
+        ):
+            self.assertFalse(self.is_authorized())
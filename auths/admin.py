@@ -2,8 +2,17 @@ from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 
+from .models import RevokedToken
+
 
 # Register your models here.
 @admin.register(get_user_model())
 class CustomUserAdmin(UserAdmin):
     pass
+
+
+@admin.register(RevokedToken)
+class RevokedTokenAdmin(admin.ModelAdmin):
+    list_display = ["jti", "user", "expires_at", "created"]
+    search_fields = ["jti", "user__username"]
+    raw_id_fields = ["user"]
@@ -1,8 +1,13 @@
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import update_last_login
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework_simplejwt.serializers import RefreshToken, TokenObtainSerializer
 from rest_framework_simplejwt.settings import api_settings
 
+from ....authentication import set_user_claims
+from ....models import RevokedToken
+
 
 class JWTTokenRefreshSerializer(serializers.Serializer):
     refresh_token = serializers.CharField()
@@ -10,8 +15,22 @@ class JWTTokenRefreshSerializer(serializers.Serializer):
 
     def validate(self, attrs):
         refresh = RefreshToken(attrs["refresh_token"])
+        if RevokedToken.is_revoked(refresh[api_settings.JTI_CLAIM]):
+            raise InvalidToken("Token is revoked")
+
+        # The claims are read again, the user may have changed
+        user = (
+            get_user_model()
+            .objects.filter(
+                **{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}
+            )
+            .first()
+        )
+        if user is None or not user.is_active:
+            raise InvalidToken("User is inactive")
+        access = set_user_claims(refresh.access_token, user)
         data = {
-            "access_token": str(refresh.access_token),
+            "access_token": str(access),
             "refresh_token": str(refresh),
         }
         return data
@@ -20,7 +39,8 @@ class JWTTokenRefreshSerializer(serializers.Serializer):
 class JWTTokenObtainPairSerializer(TokenObtainSerializer):
     @classmethod
     def get_token(cls, user):
-        return RefreshToken.for_user(user)
+        # The access token inherits the claims of the refresh token
+        return set_user_claims(RefreshToken.for_user(user), user)
 
     def validate(self, attrs):
         data = super().validate(attrs)
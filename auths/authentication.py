@@ -0,0 +1,61 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import RevokedToken
+
+# Claims of the tokens issued with ``set_user_claims``
+STATELESS_CLAIMS = ("username", "is_staff", "is_superuser", "is_active", "apps")
+
+
+def set_user_claims(token, user):
+    """Store what the stateless authentication needs to know about the user."""
+    token["username"] = user.get_username()
+    token["is_staff"] = user.is_staff
+    token["is_superuser"] = user.is_superuser
+    token["is_active"] = user.is_active
+    token["apps"] = [str(pk) for pk in user.applications.values_list("pk", flat=True)]
+    return token
+
+
+class StatelessUser(TokenUser):
+    """User backed by the claims of its token, nothing is loaded."""
+
+    @property
+    def is_active(self):
+        return self.token.get("is_active", False)
+
+    @property
+    def application_ids(self):
+        """Ids of the applications owned by the user."""
+        return self.token.get("apps", [])
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """Reject the revoked tokens, see ``RevokedToken``."""
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        if jti is not None and RevokedToken.is_revoked(jti):
+            raise AuthenticationFailed(_("Token is revoked"), code="token_revoked")
+        return validated_token
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Authenticate with the claims of the token only, without loading the user.
+    The tokens issued before the claims were added take the regular path.
+    """
+
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in STATELESS_CLAIMS):
+            return super().get_user(validated_token)
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        user = StatelessUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
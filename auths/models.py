@@ -1,7 +1,20 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _  # NOQA
 import uuid
 from django.contrib.auth.models import AbstractUser
 
+from apps.caches import TTLCache
+
+REVOCATION_CACHE_TTL = getattr(settings, "AUTHS_REVOCATION_CACHE_TTL", 30)
+
+# Single entry, the set of revoked token ids
+revocation_cache = TTLCache(maxsize=1, ttl=REVOCATION_CACHE_TTL)
+
 
 class User(AbstractUser):
     id = models.CharField(
@@ -10,3 +23,73 @@ class User(AbstractUser):
         primary_key=True,
         unique=True,
     )
+
+
+class RevokedToken(models.Model):
+    """
+    JWT revoked before its expiry. The rows are only needed until the
+    token expires, the list stays small.
+    """
+
+    jti = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="revoked_tokens",
+    )
+    expires_at = models.DateTimeField(db_index=True)
+    created = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        verbose_name = _("Revoked Token")
+        verbose_name_plural = _("Revoked Tokens")
+
+    def __str__(self):
+        return self.jti
+
+    @classmethod
+    def revoke(cls, token, user=None):
+        """Revoke the ``token``, a validated simplejwt token."""
+        expires_at = datetime.fromtimestamp(token["exp"], tz=dt_timezone.utc)
+        revoked, created = cls.objects.get_or_create(
+            jti=token["jti"], defaults={"user": user, "expires_at": expires_at}
+        )
+        return revoked
+
+    @classmethod
+    def get_revoked_ids(cls):
+        """
+        Return the ids of the revoked tokens not expired yet, cached in
+        process for ``AUTHS_REVOCATION_CACHE_TTL`` seconds.
+        """
+        revoked = revocation_cache.get("jti")
+        if revoked is None:
+            revoked = frozenset(
+                cls.objects.filter(expires_at__gt=timezone.now()).values_list(
+                    "jti", flat=True
+                )
+            )
+            revocation_cache.set("jti", revoked)
+        return revoked
+
+    @classmethod
+    def is_revoked(cls, jti):
+        return jti in cls.get_revoked_ids()
+
+
+def invalidate_revocation_cache(sender, **kwargs):
+    revocation_cache.clear()
+
+
+post_save.connect(
+    invalidate_revocation_cache,
+    sender=RevokedToken,
+    dispatch_uid="auths.revokedtoken.invalidate_cache",
+)
+post_delete.connect(
+    invalidate_revocation_cache,
+    sender=RevokedToken,
+    dispatch_uid="auths.revokedtoken.invalidate_cache",
+)
@@ -1,3 +1,83 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.models import Application
+from auths.models import RevokedToken
 
-# Create your tests here.
+User = get_user_model()
+
+
+class TestStatelessJWT(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="testuser1", password="test123")
+        self.application = Application.objects.create(
+            owner=self.user,
+            name="Application Test",
+            domain="http://localhost:8000",
+        )
+        self.client = APIClient()
+        return super().setUp()
+
+    def obtain(self):
+        response = self.client.post(
+            "/api/v1/authentications/jwt/",
+            {"username": "testuser1", "password": "test123"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get(self, path, access_token):
+        return self.client.get(
+            path,
+            HTTP_AUTHORIZATION="JWT %s" % access_token,
+            HTTP_X_APPLICATION=self.application.id,
+        )
+
+    def test_claims(self):
+        token = AccessToken(self.obtain()["access_token"])
+        self.assertEqual(token["username"], "testuser1")
+        self.assertTrue(token["is_active"])
+        self.assertEqual(token["apps"], [str(self.application.id)])
+
+    def test_list_without_user_query(self):
+        access_token = self.obtain()["access_token"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get("/api/v1/notifications/", access_token)
+        self.assertEqual(response.status_code, 200)
+        user_table = User._meta.db_table
+        self.assertFalse(
+            [query for query in queries if 'FROM "%s"' % user_table in query["sql"]]
+        )
+
+    def test_revoked_token(self):
+        access_token = self.obtain()["access_token"]
+        RevokedToken.revoke(AccessToken(access_token), user=self.user)
+        response = self.get("/api/v1/notifications/", access_token)
+        self.assertEqual(response.status_code, 401)
+        # The regular path rejects it too
+        response = self.get("/api/v1/me/", access_token)
+        self.assertEqual(response.status_code, 401)
+
+    def test_inactive_claim(self):
+        token = AccessToken.for_user(self.user)
+        for claim in ("username", "is_staff", "is_superuser", "apps"):
+            token[claim] = []
+        token["is_active"] = False
+        response = self.get("/api/v1/notifications/", str(token))
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_reads_claims_again(self):
+        refresh_token = self.obtain()["refresh_token"]
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(
+            "/api/v1/authentications/jwt/refresh/",
+            {"refresh_token": refresh_token},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(AccessToken(response.json()["access_token"])["is_staff"])
@@ -1,6 +1,8 @@
 from django.contrib import admin, messages
+from django.db.models import F
 from django.utils.translation import gettext_lazy as _
-from .models import Broadcast, Notification
+from .fields import DeliveryField
+from .models import Broadcast, Notification, NotificationOutbox
 from notifications.admin import AbstractNotificationAdmin
 
 
@@ -9,8 +11,15 @@ class BroadcastModelAdmin(admin.ModelAdmin):
     menu_order = 9
     model = Broadcast
     menu_label = _("Broadcasts")
-    list_display = ["title", "message", "sent_counter", "last_sent_at"]
-    list_filter = ["last_sent_at"]
+    list_display = [
+        "title",
+        "message",
+        "sent_counter",
+        "last_recipients",
+        "last_sent_at",
+        "delivery",
+    ]
+    list_filter = ["last_sent_at", "delivery"]
     actions = ["send"]
 
     @admin.action(description=_("Send selected Broadcast message"))
@@ -18,19 +27,55 @@ class BroadcastModelAdmin(admin.ModelAdmin):
         try:
             for obj in queryset:
                 obj.send(actor=request.user)
-            self.message_user(
-                request,
-                level=messages.SUCCESS,
-                message=_("Notification #{} sent.").format(obj.id),
-            )
+                self.message_user(
+                    request,
+                    level=messages.SUCCESS,
+                    message=_("Broadcast #{} queued.").format(obj.id),
+                )
         except Exception as err:
             self.message_user(request, level=messages.ERROR, message=err)
 
 
+@admin.register(NotificationOutbox)
+class NotificationOutboxModelAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "channel",
+        "application",
+        "broadcast",
+        "status",
+        "attempts",
+        "available_at",
+    ]
+    list_filter = ["status", "channel", "application"]
+    raw_id_fields = ("content", "broadcast")
+
+
 admin.site.unregister(Notification)
 
 
+class DeliveredListFilter(admin.SimpleListFilter):
+    title = _("delivered on")
+    parameter_name = "delivered"
+    NOT_DELIVERED = "none"
+
+    def lookups(self, request, model_admin):
+        return [
+            *((str(flag), _(label)) for flag, label in DeliveryField.FLAGS),
+            (self.NOT_DELIVERED, _("Not delivered")),
+        ]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value == self.NOT_DELIVERED:
+            return queryset.filter(delivered=0)
+        if value:
+            return queryset.filter(delivered__has=int(value))
+        return queryset
+
+
 class NotificationModelAdmin(AbstractNotificationAdmin):
+    raw_id_fields = ("recipient", "content")
     search_fields = ["recipient__username"]
     list_filter = [
         "application",
@@ -38,11 +83,7 @@ class NotificationModelAdmin(AbstractNotificationAdmin):
         "unread",
         "public",
         "timestamp",
-        "notified_email",
-        "notified_apns",
-        "notified_gcm",
-        "notified_wns",
-        "notified_webpush",
+        DeliveredListFilter,
     ]
     actions = [
         "send_email",
@@ -54,23 +95,23 @@ class NotificationModelAdmin(AbstractNotificationAdmin):
 
     @admin.action(description="Send selected notifications by email")
     def send_email(self, request, queryset):
-        queryset.update(emailed=True)
+        queryset.update(delivered=F("delivered").bitor(DeliveryField.EMAIL))
 
     @admin.action(description="Send selected notifications to android devices")
     def send_android(self, request, queryset):
-        queryset.update(notified_gcm=True)
+        queryset.update(delivered=F("delivered").bitor(DeliveryField.GCM))
 
     @admin.action(description="Send selected notifications to apple devices")
     def send_apple(self, request, queryset):
-        queryset.update(notified_apns=True)
+        queryset.update(delivered=F("delivered").bitor(DeliveryField.APNS))
 
     @admin.action(description="Send selected notifications to windows devices")
     def send_windows(self, request, queryset):
-        queryset.update(notified_wns=True)
+        queryset.update(delivered=F("delivered").bitor(DeliveryField.WNS))
 
     @admin.action(description="Send selected notifications to webpush / browser")
     def send_webpush(self, request, queryset):
-        queryset.update(notified_webpush=True)
+        queryset.update(delivered=F("delivered").bitor(DeliveryField.WEBPUSH))
 
 
 admin.site.register(Notification, NotificationModelAdmin)
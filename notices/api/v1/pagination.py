@@ -0,0 +1,171 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Seconds read again before a ``since`` cursor, longer than a fan-out commits
+SYNC_OVERLAP = getattr(settings, "NOTICES_SYNC_OVERLAP", 60)
+
+
+class NotificationCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the notification feed on ``(timestamp, id)``.
+
+    Pages walk the feed from the newest notification with ``cursor``, each
+    page is a range scan starting after the last row of the previous one, so
+    rows inserted meanwhile never shift the pages and nothing is counted.
+
+    ``since`` returns the notifications newer than a position instead,
+    oldest first, to sync a feed incrementally. The first page and every
+    ``since`` response hold the ``since`` cursor to poll with next time.
+
+    Timestamps are taken before a fan-out commits, so a row can show up
+    after a newer one was synced. A poll reads again the last
+    ``NOTICES_SYNC_OVERLAP`` seconds before its cursor to catch them, the
+    clients skip the ids they already have. The ``next`` pages of a poll
+    carry on from their last row without overlap.
+    """
+
+    since_query_param = "since"
+    since_query_description = (
+        "Only return the notifications after this cursor, the notifications "
+        "of the last seconds before it may be returned again."
+    )
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = ("-timestamp", "-id")
+
+    def encode_position(self, notification, overlap=0):
+        position = [notification.timestamp.isoformat(), notification.pk]
+        if overlap:
+            position.append(overlap)
+        return urlsafe_b64encode(json.dumps(position).encode("ascii")).decode("ascii")
+
+    @staticmethod
+    def decode_position_overlap(encoded):
+        """
+        Return the ``(timestamp, id, overlap)`` of a cursor, ``overlap`` are
+        the seconds to read again before it. Raise ``ValueError``.
+        """
+        try:
+            timestamp, pk, *overlap = json.loads(
+                urlsafe_b64decode(encoded.encode("ascii"))
+            )
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+            overlap = int(overlap[0]) if overlap else 0
+        except (TypeError, ValueError, IndexError):
+            raise ValueError("Invalid cursor")
+        if timestamp is None or overlap < 0:
+            raise ValueError("Invalid cursor")
+        return timestamp, pk, overlap
+
+    @classmethod
+    def decode_cursor(cls, encoded):
+        """Return the ``(timestamp, id)`` of a cursor, raise ``ValueError``."""
+        return cls.decode_position_overlap(encoded)[:2]
+
+    def decode_position(self, request, param):
+        encoded = request.query_params.get(param)
+        if not encoded:
+            return None
+        try:
+            return self.decode_position_overlap(encoded)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.request = request
+
+        since = self.decode_position(request, self.since_query_param)
+        cursor = self.decode_position(request, self.cursor_query_param)
+        if since is not None:
+            timestamp, pk, overlap = since
+            if overlap:
+                position = Q(timestamp__gt=timestamp - timedelta(seconds=overlap))
+            else:
+                position = Q(timestamp__gt=timestamp) | Q(
+                    timestamp=timestamp, id__gt=pk
+                )
+            queryset = queryset.filter(position).order_by("timestamp", "id")
+        else:
+            queryset = queryset.order_by(*self.ordering)
+            if cursor is not None:
+                timestamp, pk, _ = cursor
+                queryset = queryset.filter(
+                    Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk)
+                )
+
+        results = list(queryset[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+
+        self.next_url = None
+        self.since = request.query_params.get(self.since_query_param)
+        if since is not None:
+            if self.page:
+                self.since = self.encode_position(self.page[-1], SYNC_OVERLAP)
+            if self.has_next:
+                self.next_url = replace_query_param(
+                    self.base_url,
+                    self.since_query_param,
+                    self.encode_position(self.page[-1]),
+                )
+        else:
+            if self.page and cursor is None:
+                # The newest row of the feed, where the next sync starts
+                self.since = self.encode_position(self.page[0], SYNC_OVERLAP)
+            if self.has_next:
+                self.next_url = replace_query_param(
+                    self.base_url,
+                    self.cursor_query_param,
+                    self.encode_position(self.page[-1]),
+                )
+        return self.page
+
+    def get_next_link(self):
+        return self.next_url
+
+    def get_previous_link(self):
+        return None
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "since": self.since,
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "since": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append(
+            {
+                "name": self.since_query_param,
+                "required": False,
+                "in": "query",
+                "description": self.since_query_description,
+                "schema": {"type": "string"},
+            }
+        )
+        return parameters
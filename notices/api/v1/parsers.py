@@ -0,0 +1,32 @@
+import json
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline delimited JSON, one document per line.
+
+    The stream is not read upfront, the parsed data is a lazy iterator of
+    ``(line, item)`` pairs where ``item`` is the decoded document or the
+    ``ValueError`` raised decoding it. Blank lines are skipped.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        return self.iter_lines(stream, encoding)
+
+    def iter_lines(self, stream, encoding):
+        if stream is None:
+            return
+        for number, line in enumerate(stream, start=1):
+            try:
+                line = line.decode(encoding).strip()
+                if line:
+                    yield number, json.loads(line)
+            except ValueError as err:
+                yield number, err
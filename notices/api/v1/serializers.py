@@ -1,14 +1,19 @@
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.humanize.templatetags import humanize
+from django.db.models import Q
 
+from notices.helpers import BULK_MAX_IDS, SEND_MAX_NOTIFICATIONS, SEND_MAX_RECIPIENTS
 from notices.models import (
     Notification,
+    NotificationOutbox,
     Broadcast,
     ActionObjectSerializer,
     TargetObjectSerializer,
 )
 from rest_framework import serializers
 
+from .pagination import NotificationCursorPagination
+
 
 class ContentTypeSerializer(serializers.ModelSerializer):
     name = serializers.SerializerMethodField()
@@ -21,7 +26,35 @@ class ContentTypeSerializer(serializers.ModelSerializer):
         return f"{obj.app_label}.{obj.model}"
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationContentMixin:
+    """Join the shared notification content back into the representation."""
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.content_id is None:
+            return data
+        for field, value in instance.get_payload().items():
+            if field not in self.fields:
+                continue
+            data[field] = (
+                None if value is None else self.fields[field].to_representation(value)
+            )
+        return data
+
+
+class DeliveryStatusMixin(serializers.Serializer):
+    """The channels of the ``delivered`` bitmask, as read only booleans."""
+
+    notified_email = serializers.BooleanField(read_only=True)
+    notified_apns = serializers.BooleanField(read_only=True)
+    notified_gcm = serializers.BooleanField(read_only=True)
+    notified_wns = serializers.BooleanField(read_only=True)
+    notified_webpush = serializers.BooleanField(read_only=True)
+
+
+class NotificationSerializer(
+    DeliveryStatusMixin, NotificationContentMixin, serializers.ModelSerializer
+):
     actor_content_type = ContentTypeSerializer()
     actor_object_id = serializers.UUIDField()
     target = ActionObjectSerializer()
@@ -31,7 +64,7 @@ class NotificationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Notification
-        exclude = ["application"]
+        exclude = ["application", "content", "dedupe_key", "delivered"]
 
     def validate(self, attrs):
         return super().validate(attrs)
@@ -40,7 +73,9 @@ class NotificationSerializer(serializers.ModelSerializer):
         return humanize.naturaltime(obj.timestamp)
 
 
-class ServerNotificationSerializer(serializers.ModelSerializer):
+class ServerNotificationSerializer(
+    DeliveryStatusMixin, NotificationContentMixin, serializers.ModelSerializer
+):
     actor_content_type = ContentTypeSerializer()
     actor_object_id = serializers.UUIDField()
     target = ActionObjectSerializer()
@@ -50,7 +85,7 @@ class ServerNotificationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Notification
-        fields = "__all__"
+        exclude = ["content", "delivered"]
 
     def validate(self, attrs):
         return super().validate(attrs)
@@ -63,3 +98,120 @@ class BroadcastSerializer(serializers.ModelSerializer):
     class Meta:
         model = Broadcast
         fields = "__all__"
+
+
+class RecipientListField(serializers.Field):
+    """
+    List of user ids validated in a single pass over the list, without a
+    child field per recipient. Duplicates are removed.
+    """
+
+    default_error_messages = {
+        "not_a_list": "Expected a list of user ids.",
+        "empty": "This list may not be empty.",
+        "max_length": "Ensure this list has no more than {max_length} items.",
+        "invalid": "Invalid user ids at positions {positions}.",
+    }
+
+    def __init__(self, max_length=SEND_MAX_RECIPIENTS, **kwargs):
+        self.max_length = max_length
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            self.fail("not_a_list")
+        if not data:
+            self.fail("empty")
+        if len(data) > self.max_length:
+            self.fail("max_length", max_length=self.max_length)
+        invalid = [
+            position
+            for position, value in enumerate(data)
+            if not isinstance(value, str) or not 0 < len(value) <= 255
+        ]
+        if invalid:
+            self.fail("invalid", positions=", ".join(map(str, invalid[:10])))
+        return list(dict.fromkeys(data))
+
+    def to_representation(self, value):
+        return value
+
+
+class NotificationSelectionSerializer(serializers.Serializer):
+    """
+    Notifications of a bulk change, by ``ids``, ``before`` a feed cursor
+    (the notification of the cursor included) or by field, the criteria
+    combine.
+    """
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_MAX_IDS,
+        required=False,
+    )
+    before = serializers.CharField(required=False)
+    level = serializers.ChoiceField(choices=Notification.LEVELS, required=False)
+    verb = serializers.CharField(max_length=255, required=False)
+    unread = serializers.BooleanField(required=False)
+
+    def validate_before(self, value):
+        try:
+            return NotificationCursorPagination.decode_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor.")
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError(
+                "Select the notifications by ids, before a cursor or by field."
+            )
+        return attrs
+
+    def filter_queryset(self, queryset):
+        selection = dict(self.validated_data)
+        if "ids" in selection:
+            queryset = queryset.filter(id__in=selection.pop("ids"))
+        if "before" in selection:
+            timestamp, pk = selection.pop("before")
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lte=pk)
+            )
+        return queryset.filter(**selection)
+
+
+class NotificationSendSerializer(serializers.Serializer):
+    """One notification spec of the server notification API."""
+
+    recipients = RecipientListField()
+    platform = serializers.ChoiceField(
+        choices=NotificationOutbox.CHANNELS, required=False
+    )
+    platforms = serializers.ListField(
+        child=serializers.ChoiceField(choices=NotificationOutbox.CHANNELS),
+        required=False,
+    )
+    verb = serializers.CharField(max_length=255, default="notification")
+    level = serializers.ChoiceField(
+        choices=Notification.LEVELS, default=Notification.INFO
+    )
+    public = serializers.BooleanField(default=True)
+    description = serializers.CharField(required=False, allow_null=True)
+    target = TargetObjectSerializer(required=False)
+    action = ActionObjectSerializer(required=False)
+    data = serializers.DictField(required=False)
+    dedupe_key = serializers.CharField(max_length=255, required=False)
+
+    def validate(self, attrs):
+        platforms = attrs.pop("platforms", [])
+        platform = attrs.pop("platform", None)
+        if platform is not None:
+            platforms.append(platform)
+        attrs["platforms"] = list(dict.fromkeys(platforms))
+        return attrs
+
+
+class ServerNotificationSendSerializer(serializers.Serializer):
+    notifications = NotificationSendSerializer(
+        many=True, allow_empty=False, max_length=SEND_MAX_NOTIFICATIONS
+    )
@@ -1,8 +1,19 @@
-from django.conf import settings
-from django.shortcuts import get_object_or_404
+import hashlib
+import json
+from tempfile import SpooledTemporaryFile
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404
+from notices.helpers import IDEMPOTENCY_TTL
 from notices.models import Notification, Broadcast
+from notifications import settings as notifications_settings
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.request import Empty
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.viewsets import ReadOnlyModelViewSet, GenericViewSet
 from rest_framework.mixins import DestroyModelMixin
@@ -14,11 +25,18 @@ from push_notifications.api.rest_framework import (
     WNSDeviceViewSet,
 )
 from apps.api.v1.permissions import IsOwner, HasApplicationAPIKey
+from .pagination import NotificationCursorPagination
+from .parsers import NDJSONParser
 from .serializers import (
     NotificationSerializer,
+    NotificationSelectionSerializer,
     BroadcastSerializer,
     ServerNotificationSerializer,
+    ServerNotificationSendSerializer,
 )
+from ...counters import get_unread_counts
+from ...ingest import NotificationIngestor
+from ...tasks import send_notifications
 from ...models import Application
 
 
@@ -52,10 +70,125 @@ class ApplicationAuthorizedMixin:
         return super().perform_update(serializer)
 
 
+class SpooledBodyParser:
+    """
+    Wrap a parser to parse the copy of the body made by ``IdempotencyMixin``
+    while hashing it, the request stream itself was already read.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.media_type = parser.media_type
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = (parser_context or {}).get("idempotency_body")
+        return self.parser.parse(
+            stream if body is None else body, media_type, parser_context
+        )
+
+
+class IdempotencyMixin:
+    """
+    Answer a request retried with the same ``Idempotency-Key`` header with
+    the response of the first one, from the cache and for
+    ``NOTICES_IDEMPOTENCY_TTL`` seconds. A retry arriving while the first
+    request still runs is answered with a 409, a key reused with another
+    body with a 422.
+    """
+
+    idempotency_header = "Idempotency-Key"
+    idempotency_in_progress = "in-progress"
+    # Bodies larger than this are spooled to disk while hashed
+    idempotency_spool_size = 1024 * 1024
+    idempotency_chunk_size = 64 * 1024
+
+    def get_parsers(self):
+        return [SpooledBodyParser(parser) for parser in super().get_parsers()]
+
+    def get_idempotency_cache_key(self):
+        key = self.request.headers.get(self.idempotency_header)
+        if not key:
+            return None
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return "notices:idempotency:%s:%s:%s" % (
+            self.get_application().pk,
+            self.action,
+            digest,
+        )
+
+    def get_body_digest(self):
+        """
+        Return the sha256 of the request body. The body is copied to a
+        spooled file on the way and parsed from it by ``SpooledBodyParser``,
+        so it is still parsed as a stream. A body already parsed is hashed
+        from its data.
+        """
+        request = self.request
+        if getattr(request, "_full_data", Empty) is not Empty:
+            data = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+            return hashlib.sha256(data.encode("utf-8")).hexdigest()
+        digest = hashlib.sha256()
+        stream = request.stream
+        if stream is None:
+            # Empty body, nothing to parse
+            return digest.hexdigest()
+        body = SpooledTemporaryFile(max_size=self.idempotency_spool_size)
+        for chunk in iter(lambda: stream.read(self.idempotency_chunk_size), b""):
+            digest.update(chunk)
+            body.write(chunk)
+        body.seek(0)
+        request.parser_context["idempotency_body"] = body
+        return digest.hexdigest()
+
+    def idempotent(self, handler, *args, **kwargs):
+        cache_key = self.get_idempotency_cache_key()
+        if cache_key is None:
+            return handler(*args, **kwargs)
+        digest = self.get_body_digest()
+        if not cache.add(cache_key, self.idempotency_in_progress, IDEMPOTENCY_TTL):
+            cached = cache.get(cache_key)
+            if cached is None or cached == self.idempotency_in_progress:
+                return Response(
+                    data={"detail": "A request with this key is in progress."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            if cached.get("digest") != digest:
+                return Response(
+                    data={"detail": "This key was used with another request body."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            response = Response(data=cached["data"], status=cached["status"])
+            response["Idempotent-Replayed"] = "true"
+            return response
+        try:
+            response = handler(*args, **kwargs)
+        except Exception:
+            # Nothing to replay, let the client retry
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500:
+            cache.delete(cache_key)
+        else:
+            cache.set(
+                cache_key,
+                {
+                    "status": response.status_code,
+                    "data": response.data,
+                    "digest": digest,
+                },
+                IDEMPOTENCY_TTL,
+            )
+        return response
+
+
 class NotificationViewSet(DestroyModelMixin, ReadOnlyModelViewSet):
-    queryset = Notification.objects.all()
+    queryset = Notification.objects.select_related("content", "actor_content_type")
     permission_classes = (IsAuthenticated, IsOwner)
     serializer_class = NotificationSerializer
+    pagination_class = NotificationCursorPagination
+    lookup_value_regex = r"\d+"
+    # Polled by the apps, the JWT claims are enough to list the feed
+    stateless_authentication = ("list", "unread_count")
 
     def get_application(self):
         application = Application.get_from_request_headers(self.request)
@@ -64,29 +197,90 @@ class NotificationViewSet(DestroyModelMixin, ReadOnlyModelViewSet):
     def get_queryset(self):
         application = self.get_application()
         queryset = super().get_queryset()
-        return queryset.filter(recipient=self.request.user, application=application)
+        return queryset.filter(
+            recipient_id=self.request.user.pk, application=application, deleted=False
+        )
+
+    def list(self, request, *args, **kwargs):
+        application = self.get_application()
+        if application is not None:
+            # Pull the broadcasts delivered on read into the feed
+            Broadcast.deliver_on_read(request.user, application)
+        return super().list(request, *args, **kwargs)
+
+    @action(methods=["GET"], url_path="unread-count", detail=False)
+    def unread_count(self, request, *args, **kwargs):
+        """Unread notifications of the application, in total and by level."""
+        application = self.get_application()
+        levels = get_unread_counts(application and application.pk, request.user.pk)
+        return Response(data={"count": sum(levels.values()), "levels": levels})
 
     @action(methods=["GET"], url_path="mark-all-as-read", detail=False)
     def mark_as_read_all(self, request, *args, **kwargs):
-        self.request.user.notifications.mark_all_as_read()
+        count = self.get_queryset().mark_all_as_read()
+        return Response(data={"message": "success", "count": count})
+
+    def set_status(self, pk, **values):
+        """Write the status ``values`` of one notification with an ``UPDATE``."""
+        queryset = self.get_queryset().filter(pk=pk)
+        if not queryset.exclude(**values).update(**values) and not queryset.exists():
+            raise Http404
         return Response(data={"message": "success"})
 
     @action(methods=["GET"], url_path="mark-as-read", detail=True)
-    def mark_as_read(self, request, id, *args, **kwargs):
-        notification = get_object_or_404(Notification, recipient=request.user, id=id)
-        notification.mark_as_read()
-        return Response(data={"message": "success"})
+    def mark_as_read(self, request, pk=None, *args, **kwargs):
+        return self.set_status(pk, unread=False)
 
     @action(methods=["GET"], url_path="mark-as-unread", detail=True)
-    def mark_as_unread(self, request, id, *args, **kwargs):
-        notification = get_object_or_404(Notification, recipient=request.user, id=id)
-        notification.mark_as_unread()
-        return Response(data={"message": "success"})
+    def mark_as_unread(self, request, pk=None, *args, **kwargs):
+        return self.set_status(pk, unread=True)
+
+    def get_selection(self):
+        serializer = self.get_serializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.filter_queryset(self.get_queryset())
+
+    @action(
+        methods=["POST"],
+        url_path="bulk/read",
+        detail=False,
+        serializer_class=NotificationSelectionSerializer,
+    )
+    def bulk_read(self, request, *args, **kwargs):
+        count = self.get_selection().filter(unread=True).update(unread=False)
+        return Response(data={"count": count})
+
+    @action(
+        methods=["POST"],
+        url_path="bulk/unread",
+        detail=False,
+        serializer_class=NotificationSelectionSerializer,
+    )
+    def bulk_unread(self, request, *args, **kwargs):
+        count = self.get_selection().filter(unread=False).update(unread=True)
+        return Response(data={"count": count})
+
+    @action(
+        methods=["POST"],
+        url_path="bulk/delete",
+        detail=False,
+        serializer_class=NotificationSelectionSerializer,
+    )
+    def bulk_delete(self, request, *args, **kwargs):
+        selection = self.get_selection()
+        if notifications_settings.get_config()["SOFT_DELETE"]:
+            count = selection.update(deleted=True)
+        else:
+            # Same rule as ``perform_destroy``
+            count = selection.filter(broadcast__isnull=False).update(deleted=True)
+            count += selection.filter(broadcast__isnull=True).delete()[0]
+        return Response(data={"count": count})
 
     def perform_destroy(self, instance):
-        if settings.get_config()["SOFT_DELETE"]:
-            instance.deleted = True
-            instance.save()
+        # Broadcast notifications delivered on read are kept as deleted,
+        # otherwise they would be delivered again on the next read.
+        if notifications_settings.get_config()["SOFT_DELETE"] or instance.broadcast_id:
+            instance.mark_as_deleted()
         else:
             instance.delete()
         return Response(data={"message": "success"})
@@ -108,8 +302,8 @@ class WNSDeviceAuthorizedViewSet(ApplicationAuthorizedMixin, WNSDeviceViewSet):
     pass
 
 
-class ServerNotificationViewSet(GenericViewSet):
-    queryset = Notification.objects.all()
+class ServerNotificationViewSet(IdempotencyMixin, GenericViewSet):
+    queryset = Notification.objects.select_related("content", "actor_content_type")
     permission_classes = [HasApplicationAPIKey]
     authentication_classes = []
     serializer_class = ServerNotificationSerializer
@@ -122,10 +316,70 @@ class ServerNotificationViewSet(GenericViewSet):
         application = self.get_application()
         return self.queryset.filter(application_id=application.id)
 
+    def get_serializer_class(self):
+        if self.action == "send_notifications":
+            return ServerNotificationSendSerializer
+        return super().get_serializer_class()
+
     @action(methods=["POST"], url_path="send", detail=False)
     def send_notifications(self, request, *args, **kwargs):
-        """Send Notifications"""
-        return Response(data={"message": "sending notifications"})
+        """
+        Send Notifications
+
+        Accept a notification spec, a list of specs or ``{"notifications":
+        [...]}`` and queue them, the notifications are created and delivered
+        by the workers. Respond with the id of the queued job.
+
+        A retry sending the same ``Idempotency-Key`` header is answered with
+        the first response, a ``dedupe_key`` in a spec prevents notifying a
+        recipient twice.
+        """
+        return self.idempotent(self.queue_notifications, request)
+
+    def queue_notifications(self, request):
+        data = request.data
+        if isinstance(data, list):
+            data = {"notifications": data}
+        elif "notifications" not in data:
+            data = {"notifications": [data]}
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        notifications = serializer.validated_data["notifications"]
+        job = send_notifications.delay(self.get_application().pk, notifications)
+        return Response(
+            data={
+                "job": job.id,
+                "notifications": len(notifications),
+                "recipients": sum(len(spec["recipients"]) for spec in notifications),
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(
+        methods=["POST"],
+        url_path="stream",
+        detail=False,
+        parser_classes=[NDJSONParser],
+    )
+    def stream_notifications(self, request, *args, **kwargs):
+        """
+        Stream Notifications
+
+        Create the notifications of a ``application/x-ndjson`` body, one
+        notification per line with a single ``recipient``. Lines are
+        validated and written in batches as they are read, so the body size
+        is not bounded. Respond with the accepted and rejected counts and the
+        errors of the rejected lines. Retries are handled like in
+        ``send_notifications``.
+        """
+        return self.idempotent(self.ingest_notifications, request)
+
+    def ingest_notifications(self, request):
+        try:
+            ingestor = NotificationIngestor(self.get_application())
+        except DjangoValidationError as err:
+            raise ValidationError({"non_field_errors": err.messages})
+        return Response(data=ingestor.feed(request.data))
 
 
 class ServerBroadcastViewSet(ReadOnlyModelViewSet):
@@ -0,0 +1,178 @@
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.utils import timezone
+from swapper import load_model
+
+UNREAD_COUNTER_TTL = getattr(settings, "NOTICES_UNREAD_COUNTER_TTL", 86400)
+# Above this many recipients the counters of the whole application are reset
+UNREAD_COUNTER_FANOUT = getattr(settings, "NOTICES_UNREAD_COUNTER_FANOUT", 1000)
+UNREAD_RECONCILE_WINDOW = getattr(settings, "NOTICES_UNREAD_RECONCILE_WINDOW", 1200)
+
+
+def get_levels():
+    Notification = load_model("notifications", "Notification")
+    return [level for level, _ in Notification.LEVELS]
+
+
+def get_generation_key(application_id):
+    return "notices:unread:generation:%s" % application_id
+
+
+def get_counter_keys(application_id, recipient_id, generation):
+    return {
+        level: "notices:unread:%s:%s:%s:%s"
+        % (application_id, generation, recipient_id, level)
+        for level in get_levels()
+    }
+
+
+def count_unread(application_id, recipient_ids):
+    """
+    Return the unread notifications of the ``recipient_ids`` by level, as
+    ``{recipient_id: {level: count}}``, from the database.
+    """
+    Notification = load_model("notifications", "Notification")
+    rows = (
+        Notification.objects.filter(
+            application_id=application_id,
+            recipient_id__in=recipient_ids,
+            unread=True,
+            deleted=False,
+        )
+        .order_by()
+        .values_list("recipient_id", "level")
+        .annotate(count=models.Count("id"))
+    )
+    counts = {
+        str(recipient_id): dict.fromkeys(get_levels(), 0)
+        for recipient_id in recipient_ids
+    }
+    for recipient_id, level, count in rows:
+        counts[str(recipient_id)][level] = count
+    return counts
+
+
+def store_counts(application_id, counts):
+    generation = cache.get(get_generation_key(application_id))
+    values = {}
+    for recipient_id, levels in counts.items():
+        keys = get_counter_keys(application_id, recipient_id, generation)
+        values.update((keys[level], count) for level, count in levels.items())
+    cache.set_many(values, UNREAD_COUNTER_TTL)
+
+
+def get_unread_counts(application_id, recipient_id):
+    """
+    Return the unread notifications of a recipient by level, read from the
+    counters of the cache. Missing counters are counted again in the database
+    with one query on the unread index.
+    """
+    generation = cache.get(get_generation_key(application_id))
+    keys = get_counter_keys(application_id, recipient_id, generation)
+    cached = cache.get_many(keys.values())
+    if len(cached) == len(keys):
+        # Counters drift below zero when a decrement races a recount
+        return {level: max(cached[key], 0) for level, key in keys.items()}
+    counts = count_unread(application_id, [recipient_id])
+    store_counts(application_id, counts)
+    return counts[str(recipient_id)]
+
+
+def adjust_unread(application_id, changes):
+    """
+    Add the ``{(recipient_id, level): delta}`` changes to the counters once
+    the transaction commits. Counters not cached are left to be recounted,
+    past ``NOTICES_UNREAD_COUNTER_FANOUT`` recipients the application ones
+    are dropped.
+    """
+    changes = {key: delta for key, delta in changes.items() if delta}
+    if not changes:
+        return
+    if len({recipient_id for recipient_id, _ in changes}) > UNREAD_COUNTER_FANOUT:
+        invalidate_unread(application_id)
+        return
+
+    def apply():
+        generation = cache.get(get_generation_key(application_id))
+        for (recipient_id, level), delta in changes.items():
+            key = get_counter_keys(application_id, recipient_id, generation)[level]
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                pass
+
+    transaction.on_commit(apply)
+
+
+def invalidate_unread(application_id, recipient_ids=None):
+    """
+    Drop the counters of the ``recipient_ids`` once the transaction commits,
+    they are counted again on their next read. Without recipients, or with
+    more than ``NOTICES_UNREAD_COUNTER_FANOUT``, every counter of the
+    application is dropped at once by changing its generation.
+    """
+    if recipient_ids is not None:
+        recipient_ids = set(map(str, recipient_ids))
+
+    def apply():
+        if recipient_ids is None or len(recipient_ids) > UNREAD_COUNTER_FANOUT:
+            cache.set(get_generation_key(application_id), uuid.uuid4().hex, None)
+            return
+        generation = cache.get(get_generation_key(application_id))
+        cache.delete_many(
+            [
+                key
+                for recipient_id in recipient_ids
+                for key in get_counter_keys(
+                    application_id, recipient_id, generation
+                ).values()
+            ]
+        )
+
+    transaction.on_commit(apply)
+
+
+def notifications_created(application_id, level, recipient_ids, exact=True):
+    """
+    Count new notifications of ``level`` for the ``recipient_ids``, ``None``
+    when they are unknown. When some of them may not have been created,
+    ``exact`` is false and their counters are dropped instead.
+    """
+    if exact and recipient_ids is not None:
+        adjust_unread(
+            application_id,
+            Counter((str(recipient_id), level) for recipient_id in recipient_ids),
+        )
+    else:
+        invalidate_unread(application_id, recipient_ids)
+
+
+def reconcile_unread(window=None):
+    """
+    Count again the counters of the recipients notified in the last
+    ``window`` seconds, the ones most likely to have drifted. The other
+    counters are recounted once they expire. Return the number of recipients.
+    """
+    Notification = load_model("notifications", "Notification")
+    since = timezone.now() - timedelta(seconds=window or UNREAD_RECONCILE_WINDOW)
+    pairs = (
+        Notification.objects.filter(timestamp__gte=since)
+        .order_by()
+        .values_list("application_id", "recipient_id")
+        .distinct()
+    )
+    recipients = {}
+    for application_id, recipient_id in pairs.iterator():
+        recipients.setdefault(application_id, []).append(recipient_id)
+    reconciled = 0
+    for application_id, recipient_ids in recipients.items():
+        for start in range(0, len(recipient_ids), UNREAD_COUNTER_FANOUT):
+            chunk = recipient_ids[start : start + UNREAD_COUNTER_FANOUT]
+            store_counts(application_id, count_unread(application_id, chunk))
+            reconciled += len(chunk)
+    return reconciled
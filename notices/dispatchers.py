@@ -0,0 +1,594 @@
+import json
+import logging
+import smtplib
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import F
+from django.template.loader import get_template
+from push_notifications.conf import get_manager
+from push_notifications.models import APNSDevice, GCMDevice, WebPushDevice, WNSDevice
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS
+from requests.adapters import HTTPAdapter
+from swapper import load_model
+
+from .fields import DeliveryField
+from .helpers import iter_recipient_chunks
+
+logger = logging.getLogger(__name__)
+
+PUSH_WORKERS = getattr(settings, "NOTICES_PUSH_WORKERS", 8)
+PUSH_TIMEOUT = getattr(settings, "NOTICES_PUSH_TIMEOUT", 10)
+PUSH_BATCH_SIZE = getattr(settings, "NOTICES_PUSH_BATCH_SIZE", 100)
+APNS_BATCH_SIZE = getattr(settings, "NOTICES_APNS_BATCH_SIZE", 1000)
+EMAIL_WORKERS = getattr(settings, "NOTICES_EMAIL_WORKERS", 4)
+EMAIL_BATCH_SIZE = getattr(settings, "NOTICES_EMAIL_BATCH_SIZE", 100)
+
+SENT = "sent"
+FAILED = "failed"
+INVALID = "invalid"
+
+
+class Dispatcher:
+    """
+    Send batches of messages concurrently from ``max_workers`` threads, with
+    at most two batches per worker in flight.
+
+    ``send_batch`` runs in the worker threads and only talks to the provider,
+    it returns a ``(key, user_id, status)`` tuple per message. Every database
+    write happens in the calling thread: the rejected keys are passed to
+    ``deactivate`` and the ``delivery_flag`` of the delivered notifications
+    is set with one bulk update per batch. The recipients reached are kept
+    in ``delivered``.
+    """
+
+    delivery_flag = None
+
+    def __init__(self, application_id=None, max_workers=None):
+        self.application_id = application_id and str(application_id)
+        self.max_workers = max_workers
+        self.delivered = set()
+
+    def send_batch(self, batch, payload):
+        raise NotImplementedError
+
+    def deactivate(self, keys):
+        pass
+
+    def run(self, batches, payload, content=None):
+        """Send every batch of ``batches`` and return the delivery counters."""
+        result = {SENT: 0, FAILED: 0, INVALID: 0}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            for batch in batches:
+                pending.add(executor.submit(self.send_batch, batch, payload))
+                if len(pending) >= self.max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.handle_results(done, result, content)
+            done, _ = wait(pending)
+            self.handle_results(done, result, content)
+        return result
+
+    def handle_results(self, futures, result, content=None):
+        delivered, invalid = set(), []
+        for future in futures:
+            for key, user_id, status in future.result():
+                result[status] += 1
+                if status == SENT:
+                    delivered.add(user_id)
+                elif status == INVALID:
+                    invalid.append(key)
+        self.delivered.update(delivered)
+        if invalid:
+            self.deactivate(invalid)
+        if delivered and content is not None:
+            Notification = load_model("notifications", "Notification")
+            notifications = Notification.objects.filter(
+                content_id=getattr(content, "pk", content),
+                recipient_id__in=delivered,
+                delivered__lacks=self.delivery_flag,
+            )
+            if self.application_id is not None:
+                notifications = notifications.filter(application_id=self.application_id)
+            notifications.update(delivered=F("delivered").bitor(self.delivery_flag))
+
+
+class PushDispatcher(Dispatcher):
+    """
+    Deliver a push message to the active devices of the recipients of one
+    application.
+
+    Devices are streamed from the database in batches of ``get_batch_size()``
+    tokens, devices rejected by the push service are deactivated.
+    """
+
+    platform = None
+    device_model = None
+    device_fields = ("registration_id",)
+
+    def __init__(self, application_id, manager=None, max_workers=None):
+        super().__init__(application_id, max_workers or PUSH_WORKERS)
+        self.manager = manager or get_manager()
+        self.timeout = PUSH_TIMEOUT
+        self.session = get_session(self.max_workers)
+
+    def get_batch_size(self):
+        return PUSH_BATCH_SIZE
+
+    def get_devices(self, recipient_ids):
+        return self.device_model.objects.filter(
+            user_id__in=recipient_ids,
+            application_id=self.application_id,
+            active=True,
+        )
+
+    def iter_batches(self, recipients):
+        """Yield lists of ``(device_id, user_id, *device_fields)`` tuples."""
+        batch_size = self.get_batch_size()
+        batch = []
+        for recipient_ids in iter_recipient_chunks(recipients):
+            devices = self.get_devices(recipient_ids).values_list(
+                "id", "user_id", *self.device_fields
+            )
+            for device in devices.iterator():
+                batch.append(device)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def get_payload(self, title, message, data):
+        raise NotImplementedError
+
+    def send_batch(self, batch, payload):
+        """
+        Send ``payload`` to the devices of ``batch``, runs in a worker thread.
+        Return a list of ``(device_id, user_id, status)`` tuples.
+
+        Platforms without a bulk API send one request per device over the
+        pooled session, see ``send_device``.
+        """
+        statuses = []
+        for device in batch:
+            try:
+                status = self.send_device(device[2:], payload)
+            except Exception as err:
+                # One bad device never aborts the dispatch, like APNS batches
+                logger.warning(
+                    "%s push failed for application %s: %s",
+                    self.platform,
+                    self.application_id,
+                    err,
+                )
+                status = FAILED
+            statuses.append((device[0], device[1], status))
+        return statuses
+
+    def send_device(self, fields, payload):
+        """Send ``payload`` to one device, return its delivery status."""
+        raise NotImplementedError
+
+    def dispatch(self, recipients, title=None, message=None, data=None, content=None):
+        """
+        Send the message to every device of ``recipients`` and return the
+        delivery counters. When ``content`` (a ``NotificationContent`` or its
+        hash) is given the matching notifications are flagged as delivered.
+        """
+        payload = self.get_payload(title, message, data or {})
+        return self.run(self.iter_batches(recipients), payload, content)
+
+    def deactivate(self, keys):
+        self.device_model.objects.filter(id__in=keys).update(active=False)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_size):
+    """Return the process wide HTTP session, keeping connections alive."""
+    with _sessions_lock:
+        session = _sessions.get(pool_size)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[pool_size] = session
+        return session
+
+
+class FCMDispatcher(PushDispatcher):
+    """
+    Firebase Cloud Messaging dispatcher, sends up to ``MAX_RECIPIENTS`` tokens
+    per request to the legacy HTTP endpoint of the application settings.
+    Devices registered with the ``GCM`` cloud message type are sent there too,
+    FCM accepts their tokens.
+    """
+
+    platform = "FCM"
+    device_model = GCMDevice
+    delivery_flag = DeliveryField.GCM
+    invalid_errors = ("NotRegistered", "InvalidRegistration")
+
+    def __init__(self, application_id, manager=None, max_workers=None):
+        super().__init__(application_id, manager, max_workers)
+        self.url = self.manager.get_post_url(self.platform, self.application_id)
+        self.api_key = self.manager.get_fcm_api_key(self.application_id)
+        self.timeout = (
+            self.manager.get_error_timeout(self.platform, self.application_id)
+            or PUSH_TIMEOUT
+        )
+
+    def get_batch_size(self):
+        return self.manager.get_max_recipients(self.platform, self.application_id)
+
+    def get_payload(self, title, message, data):
+        return {
+            "notification": {"title": title, "body": message},
+            "data": data,
+        }
+
+    def send_batch(self, batch, payload):
+        payload = dict(payload, registration_ids=[token for _, _, token in batch])
+        try:
+            response = self.session.post(
+                self.url,
+                json=payload,
+                headers={"Authorization": "key=%s" % self.api_key},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            results = response.json()["results"]
+        except (requests.RequestException, ValueError, KeyError) as err:
+            logger.warning(
+                "FCM batch of %s devices failed for application %s: %s",
+                len(batch),
+                self.application_id,
+                err,
+            )
+            return [(device_id, user_id, FAILED) for device_id, user_id, _ in batch]
+
+        statuses = []
+        for (device_id, user_id, _), item in zip(batch, results):
+            error = item.get("error")
+            if error is None:
+                statuses.append((device_id, user_id, SENT))
+            elif error in self.invalid_errors:
+                statuses.append((device_id, user_id, INVALID))
+            else:
+                statuses.append((device_id, user_id, FAILED))
+        return statuses
+
+
+class APNSDispatcher(PushDispatcher):
+    """
+    Apple Push Notification service dispatcher, every batch is sent over one
+    HTTP/2 connection with the ``apns2`` client of ``push_notifications``.
+    """
+
+    platform = "APNS"
+    device_model = APNSDevice
+    delivery_flag = DeliveryField.APNS
+    invalid_reasons = ("Unregistered", "BadDeviceToken", "DeviceTokenNotForTopic")
+
+    def __init__(self, application_id, manager=None, max_workers=None):
+        super().__init__(application_id, manager, max_workers)
+        # Fail early when the optional apns2 dependency is missing
+        from push_notifications import apns
+
+        self.apns = apns
+        self.manager.get_apns_topic(self.application_id)
+
+    def get_batch_size(self):
+        return APNS_BATCH_SIZE
+
+    def get_payload(self, title, message, data):
+        return {"alert": {"title": title, "body": message}, "extra": data}
+
+    def send_batch(self, batch, payload):
+        tokens = [token for _, _, token in batch]
+        try:
+            # The public apns_send_bulk_message deactivates devices from this
+            # worker thread, django-push-notifications is pinned in the
+            # Pipfile for this private helper.
+            results = self.apns._apns_send(
+                tokens,
+                payload["alert"],
+                batch=True,
+                application_id=self.application_id,
+                extra=payload["extra"],
+            )
+        except Exception as err:
+            logger.warning(
+                "APNS batch of %s devices failed for application %s: %s",
+                len(batch),
+                self.application_id,
+                err,
+            )
+            return [(device_id, user_id, FAILED) for device_id, user_id, _ in batch]
+
+        statuses = []
+        for device_id, user_id, token in batch:
+            reason = results.get(token)
+            if reason == "Success":
+                statuses.append((device_id, user_id, SENT))
+            elif reason in self.invalid_reasons:
+                statuses.append((device_id, user_id, INVALID))
+            else:
+                statuses.append((device_id, user_id, FAILED))
+        return statuses
+
+
+class WNSDispatcher(PushDispatcher):
+    """
+    Windows Notification Service dispatcher, the access token is requested
+    once per dispatch and the toasts are posted over the pooled session.
+    """
+
+    platform = "WNS"
+    device_model = WNSDevice
+    delivery_flag = DeliveryField.WNS
+    invalid_status = (404, 410)
+
+    def __init__(self, application_id, manager=None, max_workers=None):
+        super().__init__(application_id, manager, max_workers)
+        self.package_security_id = self.manager.get_wns_package_security_id(
+            self.application_id
+        )
+        self.secret_key = self.manager.get_wns_secret_key(self.application_id)
+        self.access_url = PUSH_NOTIFICATIONS_SETTINGS["WNS_ACCESS_URL"]
+        self.access_token = None
+
+    def authenticate(self):
+        response = self.session.post(
+            self.access_url,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": self.package_security_id,
+                "client_secret": self.secret_key,
+                "scope": "notify.windows.com",
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+    def get_payload(self, title, message, data):
+        from push_notifications.wns import _wns_prepare_toast
+
+        text = [value for value in (title, message) if value]
+        return _wns_prepare_toast({"text": text}, template="ToastText02")
+
+    def dispatch(self, recipients, **kwargs):
+        try:
+            self.access_token = self.authenticate()
+        except (requests.RequestException, ValueError, KeyError) as err:
+            logger.warning(
+                "WNS authentication failed for application %s: %s",
+                self.application_id,
+                err,
+            )
+            # Nothing can be sent, every device of the audience failed
+            failed = sum(len(batch) for batch in self.iter_batches(recipients))
+            return {SENT: 0, FAILED: failed, INVALID: 0}
+        return super().dispatch(recipients, **kwargs)
+
+    def send_device(self, fields, payload):
+        response = self.session.post(
+            fields[0],
+            data=payload,
+            headers={
+                "Content-Type": "text/xml",
+                "Authorization": "Bearer %s" % self.access_token,
+                "X-WNS-Type": "wns/toast",
+            },
+            timeout=self.timeout,
+        )
+        if response.ok:
+            return SENT
+        if response.status_code in self.invalid_status:
+            return INVALID
+        return FAILED
+
+
+class WebPushDispatcher(PushDispatcher):
+    """
+    Web Push dispatcher, every subscription is encrypted and posted with
+    ``pywebpush`` over the pooled session.
+    """
+
+    platform = "WP"
+    device_model = WebPushDevice
+    device_fields = ("registration_id", "browser", "auth", "p256dh")
+    delivery_flag = DeliveryField.WEBPUSH
+    invalid_status = (404, 410)
+
+    def __init__(self, application_id, manager=None, max_workers=None):
+        super().__init__(application_id, manager, max_workers)
+        # Fail early when the optional pywebpush dependency is missing
+        import pywebpush
+
+        self.pywebpush = pywebpush
+        self.private_key = self.manager.get_wp_private_key(self.application_id)
+        self.claims = self.manager.get_wp_claims(self.application_id)
+
+    def get_payload(self, title, message, data):
+        return json.dumps(
+            {"title": title, "message": message, "data": data}, cls=DjangoJSONEncoder
+        )
+
+    def send_device(self, fields, payload):
+        uri, browser, auth, p256dh = fields
+        subscription_info = {
+            "endpoint": "%s/%s"
+            % (self.manager.get_wp_post_url(self.application_id, browser), uri),
+            "keys": {"auth": auth, "p256dh": p256dh},
+        }
+        try:
+            self.pywebpush.webpush(
+                subscription_info=subscription_info,
+                data=payload,
+                vapid_private_key=self.private_key,
+                vapid_claims=self.claims.copy(),
+                timeout=self.timeout,
+                requests_session=self.session,
+            )
+        except self.pywebpush.WebPushException as err:
+            response = getattr(err, "response", None)
+            if response is not None and response.status_code in self.invalid_status:
+                return INVALID
+            logger.warning(
+                "WP push failed for application %s: %s", self.application_id, err
+            )
+            return FAILED
+        return SENT
+
+
+DISPATCHERS = {
+    FCMDispatcher.platform: FCMDispatcher,
+    APNSDispatcher.platform: APNSDispatcher,
+    WNSDispatcher.platform: WNSDispatcher,
+    WebPushDispatcher.platform: WebPushDispatcher,
+}
+
+
+class EmailDispatcher(Dispatcher):
+    """
+    Send one email per recipient, rendered from a template compiled once.
+
+    Every worker thread keeps its own SMTP connection open across all of its
+    batches, so ``max_workers`` connections send concurrently. Recipients
+    without an email address or that opted out of emails in their
+    ``NotificationPreference`` are skipped.
+    """
+
+    delivery_flag = DeliveryField.EMAIL
+    recipient_fields = ("id", "email", "username", "first_name", "last_name")
+
+    def __init__(
+        self,
+        subject,
+        template_name,
+        context=None,
+        from_email=None,
+        application_id=None,
+        max_workers=None,
+        batch_size=None,
+        connection_options=None,
+    ):
+        super().__init__(application_id, max_workers or EMAIL_WORKERS)
+        self.subject = subject
+        self.template = get_template(template_name)
+        self.context = context or {}
+        self.from_email = from_email or settings.DEFAULT_FROM_EMAIL
+        self.batch_size = batch_size or EMAIL_BATCH_SIZE
+        self.connection_options = connection_options or {}
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+
+    def get_recipients(self, recipient_ids):
+        User = get_user_model()
+        NotificationPreference = apps.get_model("notices", "NotificationPreference")
+        opted_out = NotificationPreference.objects.filter(email=False).values("user_id")
+        return (
+            User.objects.filter(id__in=recipient_ids)
+            .exclude(email__in=["", None])
+            .exclude(id__in=opted_out)
+        )
+
+    def iter_batches(self, recipients):
+        """Yield lists of recipient dicts holding the ``recipient_fields``."""
+        batch = []
+        for recipient_ids in iter_recipient_chunks(recipients):
+            rows = self.get_recipients(recipient_ids).values(*self.recipient_fields)
+            for row in rows.iterator():
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def get_connection(self):
+        """Return the SMTP connection of the current worker thread."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = get_connection(fail_silently=False, **self.connection_options)
+            connection.open()
+            self.local.connection = connection
+            with self.connections_lock:
+                self.connections.append(connection)
+        return connection
+
+    def reset_connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            self.local.connection = None
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def render(self, recipient):
+        return self.template.render(dict(self.context, recipient=recipient))
+
+    def send_batch(self, batch, payload=None):
+        statuses = []
+        for recipient in batch:
+            message = EmailMessage(
+                self.subject,
+                self.render(recipient),
+                self.from_email,
+                [recipient["email"]],
+            )
+            try:
+                self.get_connection().send_messages([message])
+            except smtplib.SMTPRecipientsRefused:
+                status = INVALID
+            except (smtplib.SMTPException, OSError) as err:
+                logger.warning("Email to %s failed: %s", recipient["email"], err)
+                # Start over with a fresh connection on the next message
+                self.reset_connection()
+                status = FAILED
+            else:
+                status = SENT
+            statuses.append((recipient["id"], recipient["id"], status))
+        return statuses
+
+    def dispatch(self, recipients, content=None):
+        """
+        Email every recipient and return the delivery counters. When
+        ``content`` is given the matching notifications are flagged as
+        emailed.
+        """
+        try:
+            return self.run(self.iter_batches(recipients), None, content)
+        finally:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+
+
+def get_application_ids(device_model, recipients):
+    """Return the applications the ``recipients`` have active devices on."""
+    application_ids = set()
+    for recipient_ids in iter_recipient_chunks(recipients):
+        application_ids.update(
+            device_model.objects.filter(user_id__in=recipient_ids, active=True)
+            .exclude(
+                models.Q(application_id__isnull=True) | models.Q(application_id="")
+            )
+            .values_list("application_id", flat=True)
+            .distinct()
+        )
+    return sorted(application_ids)
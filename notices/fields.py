@@ -0,0 +1,91 @@
+from django.db import models
+from django.utils.functional import cached_property
+
+
+class LevelField(models.PositiveSmallIntegerField):
+    """
+    Store string choices as small integer ``codes``, the values are read and
+    written as the strings so filters, forms and serializers are unchanged.
+    """
+
+    def __init__(self, *args, codes=None, **kwargs):
+        self.codes = dict(codes or {})
+        self.names = {code: name for name, code in self.codes.items()}
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["codes"] = self.codes
+        return name, path, args, kwargs
+
+    @cached_property
+    def validators(self):
+        # The integer range validators do not apply to the names
+        return [*self.default_validators, *self._validators]
+
+    def from_db_value(self, value, expression, connection):
+        return self.names.get(value, value)
+
+    def to_python(self, value):
+        if isinstance(value, int):
+            return self.names.get(value, value)
+        return value
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None or isinstance(value, int):
+            return value
+        try:
+            return self.codes[value]
+        except KeyError:
+            raise ValueError(f"Unknown {self.name} {value!r}.")
+
+
+class DeliveryField(models.PositiveSmallIntegerField):
+    """
+    Bitmask of the channels a notification was delivered on, filtered with
+    the ``has`` and ``lacks`` lookups and set with ``F(...).bitor(flag)``.
+    """
+
+    EMAIL = 1
+    APNS = 2
+    GCM = 4
+    WNS = 8
+    WEBPUSH = 16
+    FLAGS = (
+        (EMAIL, "Email"),
+        (APNS, "Apple"),
+        (GCM, "Android"),
+        (WNS, "Windows"),
+        (WEBPUSH, "Webpush"),
+    )
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("default", 0)
+        super().__init__(*args, **kwargs)
+
+
+class FlagLookup(models.Lookup):
+    operator = None
+
+    def as_sql(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        # Inlined, so the partial index conditions match the queries
+        return f"({lhs} & {int(self.rhs)}) {self.operator} 0", params
+
+
+@DeliveryField.register_lookup
+class HasFlag(FlagLookup):
+    lookup_name = "has"
+    operator = "<>"
+
+
+@DeliveryField.register_lookup
+class LacksFlag(FlagLookup):
+    lookup_name = "lacks"
+    operator = "="
+
+
+def delivery_status(flag):
+    """Read only attribute telling whether the ``delivered`` mask has ``flag``."""
+    return property(lambda self: bool(self.delivered & flag))
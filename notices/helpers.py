@@ -0,0 +1,412 @@
+import datetime
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from functools import partial
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models.constants import OnConflict
+from django.db.models.query import QuerySet
+
+CHUNK_SIZE = getattr(settings, "NOTICES_CHUNK_SIZE", 1000)
+SHARD_SIZE = getattr(settings, "NOTICES_SHARD_SIZE", 10000)
+BULK_BATCH_SIZE = getattr(settings, "NOTICES_BULK_BATCH_SIZE", 5000)
+CHANNEL_TIMEOUT = getattr(settings, "NOTICES_CHANNEL_TIMEOUT", 600)
+CHANNEL_TIMEOUTS = getattr(settings, "NOTICES_CHANNEL_TIMEOUTS", {})
+DELIVERY_OUTBOX = getattr(settings, "NOTICES_DELIVERY_OUTBOX", False)
+OUTBOX_MAX_ATTEMPTS = getattr(settings, "NOTICES_OUTBOX_MAX_ATTEMPTS", 5)
+OUTBOX_RETRY_DELAY = getattr(settings, "NOTICES_OUTBOX_RETRY_DELAY", 30)
+OUTBOX_LEASE = getattr(settings, "NOTICES_OUTBOX_LEASE", 600)
+SEND_MAX_RECIPIENTS = getattr(settings, "NOTICES_SEND_MAX_RECIPIENTS", 10000)
+SEND_MAX_NOTIFICATIONS = getattr(settings, "NOTICES_SEND_MAX_NOTIFICATIONS", 100)
+IDEMPOTENCY_TTL = getattr(settings, "NOTICES_IDEMPOTENCY_TTL", 3600)
+BULK_MAX_IDS = getattr(settings, "NOTICES_BULK_MAX_IDS", 1000)
+
+CHANNEL_DONE = "done"
+CHANNEL_FAILED = "failed"
+CHANNEL_TIMEOUT_EXPIRED = "timeout"
+CHANNEL_QUEUED = "queued"
+
+logger = logging.getLogger(__name__)
+
+
+def iter_id_chunks(queryset, chunk_size=None, field="pk"):
+    """
+    Yield lists of ``field`` values from ``queryset`` in chunks of at most
+    ``chunk_size`` items, using keyset pagination on ``field`` so memory
+    stays bounded no matter how large the queryset is.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    queryset = queryset.order_by(field).values_list(field, flat=True).distinct()
+    last_id = None
+    while True:
+        page = queryset
+        if last_id is not None:
+            page = page.filter(**{"%s__gt" % field: last_id})
+        chunk = list(page[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]
+
+
+def iter_id_ranges(queryset, shard_size=None, field="pk"):
+    """
+    Yield ``(first, last)`` boundaries splitting ``queryset`` into shards of at
+    most ``shard_size`` rows. Only the boundaries are kept, so the shards can
+    be handed to workers as tiny messages.
+    """
+    shard_size = shard_size or SHARD_SIZE
+    for chunk in iter_id_chunks(queryset, chunk_size=shard_size, field=field):
+        yield chunk[0], chunk[-1]
+
+
+def iter_recipient_chunks(recipients, chunk_size=None):
+    """
+    Normalize any accepted ``recipients`` argument into chunks of user ids.
+
+    ``recipients`` can be a single user, a ``Group``, a user ``QuerySet``,
+    an iterable of users or user ids, or an iterable of id chunks such as
+    the one returned by ``Broadcast.iter_recipient_ids``.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    if isinstance(recipients, Group):
+        yield from iter_id_chunks(recipients.user_set.all(), chunk_size)
+        return
+    if isinstance(recipients, QuerySet):
+        yield from iter_id_chunks(recipients, chunk_size)
+        return
+    if isinstance(recipients, models.Model):
+        yield [recipients.pk]
+        return
+
+    chunk = []
+    for item in recipients:
+        if isinstance(item, (list, tuple)):
+            # Already chunked, pass it through untouched
+            yield list(item)
+            continue
+        chunk.append(item.pk if isinstance(item, models.Model) else item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _copy_text(field, value):
+    """Render ``value`` for the PostgreSQL ``COPY ... FROM STDIN`` text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(field, models.JSONField):
+        value = json.dumps(value, cls=field.encoder or DjangoJSONEncoder)
+    elif isinstance(value, bool):
+        return "t" if value else "f"
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_prefix(fields, constants):
+    """Render the shared columns of every ``COPY`` row, prepared by their field."""
+    return "".join(
+        _copy_text(field, field.get_prep_value(value)) + "\t"
+        for field, value in zip(fields, constants)
+    )
+
+
+def _copy_rows(cursor, sql, prefix, key_field, keys):
+    """Stream one batch of rows to PostgreSQL with ``COPY``."""
+    buffer = io.StringIO()
+    for key in keys:
+        buffer.write(prefix + _copy_text(key_field, key_field.to_python(key)) + "\n")
+    buffer.seek(0)
+    raw_cursor = cursor.cursor
+    if hasattr(raw_cursor, "copy_expert"):
+        # psycopg2
+        raw_cursor.copy_expert(sql, buffer)
+    else:
+        # psycopg 3
+        with raw_cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+    return len(keys)
+
+
+def _insert_rows(
+    cursor, connection, sql, constants, key_field, keys, ignore_conflicts=False
+):
+    """Insert one batch of rows with a single ``executemany``."""
+    rows = [constants + (key_field.get_db_prep_save(key, connection),) for key in keys]
+    cursor.executemany(sql, rows)
+    # Skipped rows are only known to the database
+    return cursor.rowcount if ignore_conflicts else len(rows)
+
+
+def _fanout_columns(model, values, key_field):
+    """
+    Return the key field, the other concrete fields and their shared values
+    for a fan-out insert.
+    """
+    opts = model._meta
+    key_field = opts.get_field(key_field)
+    fields = [
+        field
+        for field in opts.concrete_fields
+        if not field.primary_key and field != key_field
+    ]
+    constants = []
+    for field in fields:
+        value = values[field.name] if field.name in values else field.get_default()
+        if isinstance(value, models.Model):
+            value = value.pk
+        constants.append(value)
+    return key_field, fields, constants
+
+
+def _fanout_target(connection, model, fields):
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = ", ".join([qn(field.column) for field in fields])
+    return table, columns
+
+
+def bulk_fanout(
+    model,
+    values,
+    key_field,
+    keys,
+    batch_size=None,
+    using=None,
+    ignore_conflicts=False,
+):
+    """
+    Insert one ``model`` row per item of ``keys`` and return the number of
+    inserted rows.
+
+    Every row shares the column ``values`` (a dict keyed by field name, the
+    missing fields get their default) and only ``key_field`` changes from row
+    to row. Rows are built from plain tuples, never from model instances, and
+    are streamed to the database in batches of ``batch_size``, with ``COPY``
+    on PostgreSQL and ``executemany`` elsewhere. With ``ignore_conflicts``
+    rows violating a unique constraint are skipped, ``COPY`` cannot skip
+    them so ``executemany`` is used on PostgreSQL too.
+    """
+    batch_size = batch_size or BULK_BATCH_SIZE
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    key_field, fields, constants = _fanout_columns(model, values, key_field)
+    table, columns = _fanout_target(connection, model, fields + [key_field])
+
+    # Everything but the key is rendered once for the whole fan-out
+    if connection.vendor == "postgresql" and not ignore_conflicts:
+        sql = "COPY %s (%s) FROM STDIN" % (table, columns)
+        insert = partial(_copy_rows, prefix=_copy_prefix(fields, constants))
+    else:
+        on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+        sql = "%s %s (%s) VALUES (%s) %s" % (
+            connection.ops.insert_statement(on_conflict=on_conflict),
+            table,
+            columns,
+            ", ".join(["%s"] * (len(fields) + 1)),
+            connection.ops.on_conflict_suffix_sql(fields, on_conflict, None, None),
+        )
+        sql = sql.rstrip()
+        constants = tuple(
+            field.get_db_prep_save(value, connection)
+            for field, value in zip(fields, constants)
+        )
+        insert = partial(
+            _insert_rows,
+            connection=connection,
+            constants=constants,
+            ignore_conflicts=ignore_conflicts,
+        )
+
+    keys = iter(keys)
+    inserted = 0
+    with transaction.atomic(using=using, savepoint=False):
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(keys, batch_size))
+                if not batch:
+                    break
+                inserted += insert(cursor, sql=sql, key_field=key_field, keys=batch)
+    return inserted
+
+
+def bulk_fanout_select(
+    model, values, queryset, select, using=None, ignore_conflicts=False
+):
+    """
+    Insert one ``model`` row per row of ``queryset`` with a single
+    ``INSERT ... SELECT`` statement and return the number of inserted rows.
+
+    ``select`` maps field names to expressions evaluated on ``queryset``
+    (e.g. ``{"recipient": F("pk")}``), every other column shares the given
+    ``values`` which are sent once as parameters. Nothing is loaded into
+    Python. With ``ignore_conflicts`` rows violating a unique constraint are
+    skipped.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    opts = model._meta
+    selected = [opts.get_field(name) for name in select]
+    fields = [
+        field
+        for field in opts.concrete_fields
+        if not field.primary_key and field not in selected
+    ]
+    constants = []
+    for field in fields:
+        value = values[field.name] if field.name in values else field.get_default()
+        if isinstance(value, models.Model):
+            value = value.pk
+        constants.append(field.get_db_prep_save(value, connection))
+    table, columns = _fanout_target(connection, model, fields + selected)
+
+    aliases = ["fanout_%s" % field.name for field in selected]
+    select_sql, select_params = (
+        queryset.order_by()
+        .annotate(**dict(zip(aliases, select.values())))
+        .values_list(*aliases)
+        .query.sql_with_params()
+    )
+    qn = connection.ops.quote_name
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+    sql = "%s %s (%s) SELECT %s FROM (%s) %s %s" % (
+        connection.ops.insert_statement(on_conflict=on_conflict),
+        table,
+        columns,
+        ", ".join(
+            ["%s"] * len(fields)
+            + ["%s.%s" % (qn("fanout"), qn(alias)) for alias in aliases]
+        ),
+        select_sql,
+        qn("fanout"),
+        connection.ops.on_conflict_suffix_sql(fields, on_conflict, None, None),
+    )
+    params = constants + list(select_params)
+    with transaction.atomic(using=using, savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute(sql.rstrip(), params)
+            return cursor.rowcount
+
+
+def _timed(function):
+    start = time.monotonic()
+    return function(), time.monotonic() - start
+
+
+def _run_channel(function, after=None):
+    """Run one channel in a worker thread, return its result and duration."""
+    try:
+        if after is not None:
+            # Wait for the channel it depends on, whatever its outcome
+            wait([after])
+        return _timed(function)
+    finally:
+        # Connections are per thread, do not leak the one of this worker
+        connections.close_all()
+
+
+def _channel_outcome(name, run):
+    try:
+        result, duration = run()
+    except FutureTimeoutError:
+        logger.warning("Channel %s timed out", name)
+        return {"status": CHANNEL_TIMEOUT_EXPIRED}
+    except Exception as err:
+        logger.exception("Channel %s failed", name)
+        return {"status": CHANNEL_FAILED, "error": repr(err)}
+    return {"status": CHANNEL_DONE, "result": result, "duration": round(duration, 3)}
+
+
+def run_channels(channels, timeouts=None):
+    """
+    Run the delivery ``channels`` concurrently and return their outcome keyed
+    by channel name.
+
+    ``channels`` is a list of ``(name, function, after)`` tuples, a channel
+    naming another one in ``after`` starts once that one finished. Every
+    channel runs in its own thread so a slow or failing channel never delays
+    or aborts the others, each one gets ``timeouts[name]`` seconds (from
+    ``NOTICES_CHANNEL_TIMEOUTS``, ``NOTICES_CHANNEL_TIMEOUT`` by default) to
+    finish. The outcome holds the ``status`` (done, failed or timeout) with
+    the ``result`` and ``duration``, or the ``error``. A single channel runs
+    in the calling thread, without timeout.
+    """
+    if timeouts is None:
+        timeouts = CHANNEL_TIMEOUTS
+    if len(channels) == 1:
+        name, function, _ = channels[0]
+        return {name: _channel_outcome(name, partial(_timed, function))}
+
+    outcomes = {}
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(
+        max_workers=len(channels), thread_name_prefix="notices-channel"
+    )
+    try:
+        futures = {}
+        for name, function, after in channels:
+            futures[name] = executor.submit(_run_channel, function, futures.get(after))
+        for name, future in futures.items():
+            deadline = start + timeouts.get(name, CHANNEL_TIMEOUT)
+            timeout = max(deadline - time.monotonic(), 0)
+            outcomes[name] = _channel_outcome(name, partial(future.result, timeout))
+    finally:
+        # A timed out channel keeps its thread until it returns, it is not
+        # waited for.
+        executor.shutdown(wait=False)
+    return outcomes
+
+
+def merge_channel_outcomes(outcomes):
+    """
+    Merge the channel outcomes of several shards, see ``run_channels``.
+
+    Every channel counts its shards per status, sums the numeric results
+    (numbers or dicts of numbers) and keeps the first errors.
+    """
+    merged = {}
+    for shard in outcomes:
+        for name, outcome in shard.items():
+            channel = merged.setdefault(
+                name, {"shards": {}, "result": None, "duration": 0, "errors": []}
+            )
+            status = outcome["status"]
+            channel["shards"][status] = channel["shards"].get(status, 0) + 1
+            channel["duration"] = round(
+                channel["duration"] + outcome.get("duration", 0), 3
+            )
+            if "error" in outcome and len(channel["errors"]) < 5:
+                channel["errors"].append(outcome["error"])
+            channel["result"] = _merge_result(channel["result"], outcome.get("result"))
+    return merged
+
+
+def _merge_result(total, result):
+    if result is None:
+        return total
+    if total is None:
+        return result
+    if isinstance(result, dict):
+        return {
+            key: total.get(key, 0) + result.get(key, 0) for key in {**total, **result}
+        }
+    return total + result
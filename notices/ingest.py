@@ -0,0 +1,291 @@
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import transaction
+from django.utils import timezone
+
+from .counters import adjust_unread, invalidate_unread
+from .helpers import DELIVERY_OUTBOX
+from .models import Notification, NotificationContent, NotificationOutbox
+from .tasks import deliver_notifications
+
+User = get_user_model()
+
+INGEST_BATCH_SIZE = getattr(settings, "NOTICES_INGEST_BATCH_SIZE", 1000)
+INGEST_MAX_ERRORS = getattr(settings, "NOTICES_INGEST_MAX_ERRORS", 1000)
+
+LEVELS = frozenset(level for level, _ in Notification.LEVELS)
+CHANNELS = frozenset(channel for channel, _ in NotificationOutbox.CHANNELS)
+# Same rules as ``TargetObjectSerializer`` and ``ActionObjectSerializer``
+OBJECT_FIELDS = {"name": 120, "description": 255}
+OBJECT_URL_FIELDS = ("image", "url")
+
+validate_url = URLValidator()
+
+
+def _validate_object(value):
+    if not isinstance(value, dict):
+        return ["Expected an object."]
+    errors = []
+    for field, max_length in OBJECT_FIELDS.items():
+        text = value.get(field)
+        if not isinstance(text, str) or not text:
+            errors.append(f"{field} - this field is required.")
+        elif len(text) > max_length:
+            errors.append(
+                f"{field} - ensure this field has no more than {max_length} characters."
+            )
+    for field in OBJECT_URL_FIELDS:
+        if field not in value:
+            continue
+        try:
+            validate_url(value[field])
+        except (ValidationError, TypeError):
+            errors.append(f"{field} - enter a valid url.")
+    return errors
+
+
+def validate_notification_line(item):
+    """
+    Validate one decoded NDJSON line and return ``(spec, errors)``, one of
+    them is ``None``. Plain type checks keep the cost per line low, no
+    serializer is instantiated.
+    """
+    if not isinstance(item, dict):
+        return None, {"non_field_errors": ["Expected a notification object."]}
+    errors = {}
+    recipient = item.get("recipient")
+    if not isinstance(recipient, str) or not 0 < len(recipient) <= 255:
+        errors["recipient"] = ["Expected a user id."]
+    verb = item.get("verb", "notification")
+    if not isinstance(verb, str) or not 0 < len(verb) <= 255:
+        errors["verb"] = ["Expected a string of at most 255 characters."]
+    level = item.get("level", Notification.INFO)
+    if level not in LEVELS:
+        errors["level"] = [f'"{level}" is not a valid choice.']
+    public = item.get("public", True)
+    if not isinstance(public, bool):
+        errors["public"] = ["Must be a valid boolean."]
+    description = item.get("description")
+    if description is not None and not isinstance(description, str):
+        errors["description"] = ["Not a valid string."]
+    for field in ("target", "action"):
+        if item.get(field) is not None:
+            field_errors = _validate_object(item[field])
+            if field_errors:
+                errors[field] = field_errors
+    dedupe_key = item.get("dedupe_key")
+    if dedupe_key is not None and (
+        not isinstance(dedupe_key, str) or not 0 < len(dedupe_key) <= 255
+    ):
+        errors["dedupe_key"] = ["Expected a string of at most 255 characters."]
+    data = item.get("data")
+    if data is not None and not isinstance(data, dict):
+        errors["data"] = ["Expected a dictionary of items."]
+    platforms = item.get("platforms", [])
+    if "platform" in item:
+        platforms = (
+            [*platforms, item["platform"]] if isinstance(platforms, list) else None
+        )
+    if not isinstance(platforms, list) or not CHANNELS.issuperset(platforms):
+        errors["platforms"] = ["Expected a list of platforms."]
+    if errors:
+        return None, errors
+    return {
+        "recipient": recipient,
+        "verb": verb,
+        "level": level,
+        "public": public,
+        "description": description,
+        "target": item.get("target"),
+        "action": item.get("action"),
+        "data": data or None,
+        "platforms": list(dict.fromkeys(platforms)),
+        "dedupe_key": dedupe_key,
+    }, None
+
+
+class NotificationIngestor:
+    """
+    Create the notifications of a stream of ``(line, item)`` pairs, ``item``
+    is the decoded line or the exception raised decoding it.
+
+    Valid lines are buffered and written ``batch_size`` at a time, the
+    rejected lines are reported with their number, up to ``max_errors`` of
+    them. Only one batch is held in memory whatever the length of the stream.
+    Raise ``ValidationError`` when there is no user to notify from.
+    """
+
+    def __init__(self, application, actor=None, batch_size=None, max_errors=None):
+        self.application = application
+        self.actor = (
+            actor or application.owner or User.objects.filter(is_superuser=True).first()
+        )
+        if self.actor is None:
+            raise ValidationError(
+                "The application has no owner to send the notifications from."
+            )
+        self.batch_size = batch_size or INGEST_BATCH_SIZE
+        self.max_errors = INGEST_MAX_ERRORS if max_errors is None else max_errors
+        self.actor_content_type = ContentType.objects.get_for_model(self.actor)
+        self.pending = []
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line, errors):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": errors})
+
+    def feed(self, lines):
+        for line, item in lines:
+            if isinstance(item, Exception):
+                self.reject(line, {"non_field_errors": [f"Invalid JSON - {item}"]})
+                continue
+            spec, errors = validate_notification_line(item)
+            if errors:
+                self.reject(line, errors)
+                continue
+            self.pending.append((line, spec))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+        self.flush()
+        return self.summary()
+
+    def summary(self):
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+    def flush(self):
+        """Write the pending lines with one query per table."""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        recipient_ids = {spec["recipient"] for _, spec in pending}
+        known = set(
+            User.objects.filter(id__in=recipient_ids, is_active=True).values_list(
+                "id", flat=True
+            )
+        )
+        known = {str(recipient_id) for recipient_id in known}
+
+        contents = {}
+        deliveries = {}
+        notifications = []
+        timestamp = timezone.now()
+        for line, spec in pending:
+            if spec["recipient"] not in known:
+                self.reject(line, {"recipient": ["Unknown recipient."]})
+                continue
+            payload = {
+                field: spec[field] for field in NotificationContent.PAYLOAD_FIELDS
+            }
+            content_id = NotificationContent.get_hash(**payload)
+            contents.setdefault(content_id, payload)
+            for platform in spec["platforms"]:
+                key = (content_id, platform)
+                deliveries.setdefault(key, set()).add(spec["recipient"])
+            notifications.append(
+                Notification(
+                    application=self.application,
+                    recipient_id=spec["recipient"],
+                    actor_content_type=self.actor_content_type,
+                    actor_object_id=self.actor.pk,
+                    verb=spec["verb"],
+                    content_id=content_id,
+                    level=spec["level"],
+                    public=spec["public"],
+                    timestamp=timestamp,
+                    dedupe_key=spec["dedupe_key"],
+                )
+            )
+
+        with transaction.atomic():
+            NotificationContent.objects.bulk_create(
+                [
+                    NotificationContent(hash=content_id, **payload)
+                    for content_id, payload in contents.items()
+                ],
+                ignore_conflicts=True,
+            )
+            # Lines already notified with their dedupe key are skipped
+            Notification.objects.bulk_create(notifications, ignore_conflicts=True)
+            # The platforms of a content with the same recipients go together
+            audiences = {}
+            for (content_id, platform), recipient_ids in deliveries.items():
+                key = (content_id, frozenset(recipient_ids))
+                audiences.setdefault(key, []).append(platform)
+            for (content_id, recipient_ids), platforms in audiences.items():
+                self.queue_delivery(
+                    content_id,
+                    sorted(platforms),
+                    contents[content_id],
+                    sorted(recipient_ids),
+                )
+            self.count_unread(notifications)
+            self.accepted += self.count_created(notifications, timestamp)
+
+    def count_created(self, notifications, timestamp):
+        """
+        Return how many of the ``notifications`` were inserted, only the ones
+        with a dedupe key may have been skipped. The inserted rows are the
+        ones holding the ``timestamp`` of the batch.
+        """
+        deduped = [
+            notification
+            for notification in notifications
+            if notification.dedupe_key is not None
+        ]
+        if not deduped:
+            return len(notifications)
+        inserted = Notification.objects.filter(
+            application=self.application,
+            recipient_id__in={notification.recipient_id for notification in deduped},
+            dedupe_key__in={notification.dedupe_key for notification in deduped},
+            timestamp=timestamp,
+        ).count()
+        return len(notifications) - len(deduped) + inserted
+
+    def count_unread(self, notifications):
+        # Only the lines with a dedupe key may have been skipped
+        created = Counter()
+        deduped = []
+        for notification in notifications:
+            if notification.dedupe_key is None:
+                created[(notification.recipient_id, notification.level)] += 1
+            else:
+                deduped.append(notification.recipient_id)
+        adjust_unread(self.application.pk, created)
+        if deduped:
+            invalidate_unread(self.application.pk, deduped)
+
+    def queue_delivery(self, content_id, platforms, payload, recipient_ids):
+        """Deliver the content only to the ``recipient_ids`` of this batch."""
+        data = payload["data"] or {}
+        message = {
+            "title": data.get("title"),
+            "message": data.get("message"),
+            "data": data,
+        }
+        if DELIVERY_OUTBOX:
+            NotificationOutbox.enqueue(
+                platforms,
+                self.application,
+                content=NotificationContent(hash=content_id),
+                recipients=recipient_ids,
+                **message,
+            )
+            return
+        transaction.on_commit(
+            lambda: deliver_notifications.delay(
+                self.application.pk, content_id, platforms, message, recipient_ids
+            )
+        )
@@ -0,0 +1,114 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.mail import get_connection, send_mass_mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.loader import get_template
+
+from notices.dispatchers import EmailDispatcher
+
+User = get_user_model()
+
+TEMPLATE_NAME = "notices/email_broadcast.txt"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the broadcast email path against a SMTP server, a local "
+        "aiosmtpd sink is started when no --host is given. Everything is "
+        "rolled back when the benchmark ends."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipients", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--host", default=None)
+        parser.add_argument("--port", type=int, default=8025)
+        parser.add_argument(
+            "--legacy",
+            action="store_true",
+            help="Also run the send_mass_mail baseline, one connection",
+        )
+
+    def report(self, label, sent, elapsed):
+        self.stdout.write(
+            "%s: %s emails in %.2fs, %.0f emails/sec"
+            % (label, sent, elapsed, sent / elapsed if elapsed else 0)
+        )
+
+    def start_sink(self, port):
+        try:
+            from aiosmtpd.controller import Controller
+            from aiosmtpd.handlers import Sink
+        except ImportError:
+            raise CommandError("Install aiosmtpd or give the --host of a SMTP server")
+        controller = Controller(Sink(), hostname="127.0.0.1", port=port)
+        controller.start()
+        return controller
+
+    def handle(self, *args, **options):
+        controller = None
+        host = options["host"]
+        if host is None:
+            controller = self.start_sink(options["port"])
+            host = "127.0.0.1"
+        connection_options = {
+            "backend": "django.core.mail.backends.smtp.EmailBackend",
+            "host": host,
+            "port": options["port"],
+        }
+        context = {"title": "Benchmark", "message": "Benchmark message"}
+        try:
+            with transaction.atomic():
+                prefix = uuid.uuid4().hex[:8]
+                users = User.objects.bulk_create(
+                    [
+                        User(
+                            username="bench-%s-%s" % (prefix, i),
+                            email="bench-%s-%s@example.com" % (prefix, i),
+                        )
+                        for i in range(options["recipients"])
+                    ]
+                )
+                recipient_ids = [str(user.pk) for user in users]
+
+                dispatcher = EmailDispatcher(
+                    subject="Benchmark",
+                    template_name=TEMPLATE_NAME,
+                    context=context,
+                    max_workers=options["workers"],
+                    batch_size=options["batch_size"],
+                    connection_options=connection_options,
+                )
+                start = time.perf_counter()
+                result = dispatcher.dispatch(recipient_ids)
+                self.report(
+                    "EmailDispatcher (%s workers)" % dispatcher.max_workers,
+                    result["sent"],
+                    time.perf_counter() - start,
+                )
+
+                if options["legacy"]:
+                    template = get_template(TEMPLATE_NAME)
+                    start = time.perf_counter()
+                    sent = send_mass_mail(
+                        (
+                            (
+                                "Benchmark",
+                                template.render(dict(context, recipient=user)),
+                                None,
+                                [user.email],
+                            )
+                            for user in users
+                        ),
+                        connection=get_connection(**connection_options),
+                    )
+                    self.report("send_mass_mail", sent, time.perf_counter() - start)
+
+                transaction.set_rollback(True)
+        finally:
+            if controller is not None:
+                controller.stop()
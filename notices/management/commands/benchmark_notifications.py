@@ -0,0 +1,116 @@
+import itertools
+import time
+import tracemalloc
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apps.models import Application
+from notices.models import Notification
+from notices.signals import bulk_notify
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the notification insert path, everything is rolled back "
+        "when the benchmark ends."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument("--recipients", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--legacy",
+            action="store_true",
+            help="Also run the model instance + bulk_create baseline",
+        )
+        parser.add_argument(
+            "--memory",
+            action="store_true",
+            help="Trace the peak python memory (slows the run down)",
+        )
+
+    def report(self, label, rows, elapsed, peak=None):
+        message = "%s: %s rows in %.2fs, %.0f rows/sec" % (
+            label,
+            rows,
+            elapsed,
+            rows / elapsed if elapsed else 0,
+        )
+        if peak is not None:
+            message += ", peak memory %.1f MiB" % (peak / 1024 / 1024)
+        self.stdout.write(message)
+
+    def run(self, label, func, rows, memory):
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        peak = None
+        if memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.report(label, rows, elapsed, peak)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        with transaction.atomic():
+            prefix = uuid.uuid4().hex[:8]
+            users = User.objects.bulk_create(
+                [
+                    User(username="bench-%s-%s" % (prefix, i))
+                    for i in range(options["recipients"])
+                ]
+            )
+            recipient_ids = [str(user.pk) for user in users]
+            actor = users[0]
+            application = Application.objects.create(
+                name="Benchmark", domain="bench-%s" % prefix
+            )
+
+            def recipients():
+                return itertools.islice(itertools.cycle(recipient_ids), rows)
+
+            def fanout():
+                bulk_notify.send(
+                    sender=application,
+                    actor=actor,
+                    verb="benchmark",
+                    recipients=recipients(),
+                    application=application,
+                    batch_size=options["batch_size"],
+                    title="Benchmark",
+                    message="Benchmark message",
+                )
+
+            self.run("bulk_notify", fanout, rows, options["memory"])
+
+            if options["legacy"]:
+                content_type = ContentType.objects.get_for_model(actor)
+                timestamp = timezone.now()
+
+                def legacy():
+                    Notification.objects.bulk_create(
+                        Notification(
+                            recipient_id=recipient_id,
+                            actor_content_type=content_type,
+                            actor_object_id=actor.pk,
+                            verb="benchmark",
+                            timestamp=timestamp,
+                            application=application,
+                            data={"title": "Benchmark", "message": "Benchmark"},
+                        )
+                        for recipient_id in recipients()
+                    )
+
+                self.run("bulk_create", legacy, rows, options["memory"])
+
+            transaction.set_rollback(True)
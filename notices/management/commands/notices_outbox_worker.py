@@ -0,0 +1,111 @@
+import asyncio
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from notices.models import NotificationOutbox
+
+
+def claim(limit):
+    try:
+        return NotificationOutbox.claim(limit)
+    finally:
+        connections.close_all()
+
+
+def process(entry):
+    try:
+        return entry.process()
+    finally:
+        # Every delivery runs in a pool thread, release its connection
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Drain the notification outbox, delivering up to --concurrency entries "
+        "at once. Entries are claimed with SELECT ... FOR UPDATE SKIP LOCKED so "
+        "several workers can run side by side."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=64)
+        parser.add_argument("--batch-size", type=int, default=32)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when the outbox is empty",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the outbox is drained",
+        )
+
+    def handle(self, *args, **options):
+        close_old_connections()
+        processed = asyncio.run(self.run(**options))
+        self.stdout.write("Processed %s outbox entries" % processed)
+
+    def collect(self, done):
+        """
+        Report the entries that could not even record their outcome, they are
+        claimed again once their lease expires.
+        """
+        for task in done:
+            if task.exception() is not None:
+                self.stderr.write("Outbox delivery crashed: %r" % task.exception())
+        return len(done)
+
+    def stop(self):
+        self.stopping = True
+
+    async def run(self, concurrency, batch_size, poll_interval, once, **options):
+        self.stopping = False
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        # The deliveries block on the providers, give them enough threads
+        executor = ThreadPoolExecutor(
+            max_workers=concurrency + 1, thread_name_prefix="notices-outbox"
+        )
+        claim_entries = sync_to_async(claim, thread_sensitive=False, executor=executor)
+        process_entry = sync_to_async(
+            process, thread_sensitive=False, executor=executor
+        )
+
+        processed = 0
+        tasks = set()
+        while not self.stopping:
+            free = concurrency - len(tasks)
+            entries = []
+            if free:
+                entries = await claim_entries(min(free, batch_size))
+            for entry in entries:
+                tasks.add(asyncio.ensure_future(process_entry(entry)))
+            if entries and len(tasks) < concurrency:
+                continue
+            if not tasks:
+                if once:
+                    break
+                await asyncio.sleep(poll_interval)
+                continue
+            done, tasks = await asyncio.wait(
+                tasks,
+                timeout=None if entries else poll_interval,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            processed += self.collect(done)
+        if tasks:
+            done, _ = await asyncio.wait(tasks)
+            processed += self.collect(done)
+        executor.shutdown()
+        return processed
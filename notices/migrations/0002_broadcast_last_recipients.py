@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="broadcast",
+            name="last_recipients",
+            field=models.IntegerField(
+                default=0,
+                editable=False,
+                help_text="Number of recipients reached by the last send",
+                verbose_name="Recipients",
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-18 08:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0002_broadcast_last_recipients"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationContent",
+            fields=[
+                (
+                    "hash",
+                    models.CharField(
+                        editable=False, max_length=64, primary_key=True, serialize=False
+                    ),
+                ),
+                ("verb", models.CharField(max_length=255)),
+                ("description", models.TextField(blank=True, null=True)),
+                ("target", models.JSONField(blank=True, null=True)),
+                ("action", models.JSONField(blank=True, null=True)),
+                ("data", models.JSONField(blank=True, null=True)),
+                (
+                    "created",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Notification Content",
+                "verbose_name_plural": "Notification Contents",
+            },
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="content",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="notifications",
+                to="notices.notificationcontent",
+            ),
+        ),
+    ]
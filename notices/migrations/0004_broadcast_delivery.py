@@ -0,0 +1,72 @@
+# Generated by Django 4.2 on 2026-10-18 08:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("notices", "0003_notification_content"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="broadcast",
+            name="actor",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="actor",
+            ),
+        ),
+        migrations.AddField(
+            model_name="broadcast",
+            name="content",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="broadcasts",
+                to="notices.notificationcontent",
+                verbose_name="content",
+            ),
+        ),
+        migrations.AddField(
+            model_name="broadcast",
+            name="delivery",
+            field=models.CharField(
+                choices=[("write", "On send"), ("read", "On read")],
+                default="write",
+                help_text="Create the notification of every recipient on send, or only when the recipient reads the notification feed.",
+                max_length=10,
+                verbose_name="delivery",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="broadcast",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="notifications",
+                to="notices.broadcast",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="notification",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("broadcast__isnull", False)),
+                fields=("broadcast", "recipient"),
+                name="unique_broadcast_recipient",
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0004_broadcast_delivery"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="broadcast",
+            name="media",
+            field=models.CharField(
+                choices=[
+                    ("notification", "Notification"),
+                    ("email", "Email"),
+                    ("android_notification", "Android Notification"),
+                    ("apple_notification", "Apple Notification"),
+                    ("push_notification", "Push Notification"),
+                    ("all", "All"),
+                ],
+                default="notification",
+                max_length=255,
+                verbose_name="media",
+            ),
+        ),
+    ]
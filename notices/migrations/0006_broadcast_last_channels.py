@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0005_broadcast_media"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="broadcast",
+            name="last_channels",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                help_text="Outcome of every delivery channel in the last send",
+                verbose_name="Channels",
+            ),
+        ),
+    ]
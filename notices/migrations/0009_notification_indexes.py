@@ -0,0 +1,132 @@
+# Generated by Django 4.2 on 2026-10-18 09:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("notices", "0008_notification_dedupe_key"),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name="notification",
+            index_together=set(),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="deleted",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="notified_apns",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="notified_email",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="notified_gcm",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="notified_webpush",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="notified_wns",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="public",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="recipient",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="notifications",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="unread",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("deleted", False)),
+                fields=["recipient", "application", "-timestamp", "-id"],
+                name="notices_feed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("unread", True)),
+                fields=["recipient", "application"],
+                name="notices_unread_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(
+                    ("content__isnull", False), ("notified_email", False)
+                ),
+                fields=["content", "application", "recipient"],
+                name="notices_pending_email_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(
+                    ("content__isnull", False), ("notified_apns", False)
+                ),
+                fields=["content", "application", "recipient"],
+                name="notices_pending_apns_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("content__isnull", False), ("notified_gcm", False)),
+                fields=["content", "application", "recipient"],
+                name="notices_pending_gcm_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("content__isnull", False), ("notified_wns", False)),
+                fields=["content", "application", "recipient"],
+                name="notices_pending_wns_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(
+                    ("content__isnull", False), ("notified_webpush", False)
+                ),
+                fields=["content", "application", "recipient"],
+                name="notices_pending_webpush_idx",
+            ),
+        ),
+    ]
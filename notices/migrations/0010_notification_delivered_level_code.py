@@ -0,0 +1,131 @@
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+import notices.fields
+
+LEVEL_CODES = {"success": 1, "info": 2, "warning": 3, "promotion": 4, "error": 5}
+NOTIFIED_FIELDS = {
+    "notified_email": notices.fields.DeliveryField.EMAIL,
+    "notified_apns": notices.fields.DeliveryField.APNS,
+    "notified_gcm": notices.fields.DeliveryField.GCM,
+    "notified_wns": notices.fields.DeliveryField.WNS,
+    "notified_webpush": notices.fields.DeliveryField.WEBPUSH,
+}
+
+
+def pack_status(apps, schema_editor):
+    Notification = apps.get_model("notices", "Notification")
+    for level in LEVEL_CODES:
+        Notification.objects.filter(level=level).update(level_code=level)
+    for field, flag in NOTIFIED_FIELDS.items():
+        Notification.objects.filter(**{field: True}).update(
+            delivered=F("delivered").bitor(flag)
+        )
+
+
+def unpack_status(apps, schema_editor):
+    Notification = apps.get_model("notices", "Notification")
+    for level in LEVEL_CODES:
+        Notification.objects.filter(level_code=level).update(level=level)
+    for field, flag in NOTIFIED_FIELDS.items():
+        Notification.objects.filter(delivered__has=flag).update(**{field: True})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0009_notification_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="level_code",
+            field=notices.fields.LevelField(
+                choices=[
+                    ("success", "Success"),
+                    ("info", "Info"),
+                    ("warning", "Warning"),
+                    ("promotion", "Promotion"),
+                    ("error", "Error"),
+                ],
+                codes=LEVEL_CODES,
+                default="info",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="delivered",
+            field=notices.fields.DeliveryField(default=0),
+        ),
+        migrations.RunPython(pack_status, unpack_status),
+        migrations.RemoveIndex(
+            model_name="notification",
+            name="notices_pending_email_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="notification",
+            name="notices_pending_apns_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="notification",
+            name="notices_pending_gcm_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="notification",
+            name="notices_pending_wns_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="notification",
+            name="notices_pending_webpush_idx",
+        ),
+        migrations.RemoveField(
+            model_name="notification",
+            name="notified_apns",
+        ),
+        migrations.RemoveField(
+            model_name="notification",
+            name="notified_email",
+        ),
+        migrations.RemoveField(
+            model_name="notification",
+            name="notified_gcm",
+        ),
+        migrations.RemoveField(
+            model_name="notification",
+            name="notified_webpush",
+        ),
+        migrations.RemoveField(
+            model_name="notification",
+            name="notified_wns",
+        ),
+        migrations.RemoveField(
+            model_name="notification",
+            name="level",
+        ),
+        migrations.RenameField(
+            model_name="notification",
+            old_name="level_code",
+            new_name="level",
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="content",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="notifications",
+                to="notices.notificationcontent",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("content__isnull", False)),
+                fields=["content", "application", "recipient"],
+                name="notices_delivery_idx",
+            ),
+        ),
+    ]
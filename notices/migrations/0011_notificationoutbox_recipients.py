@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0010_notification_delivered_level_code"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationoutbox",
+            name="recipients",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
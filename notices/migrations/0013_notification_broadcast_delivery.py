@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0012_notification_recipient_indexes"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="notification",
+            name="unique_broadcast_recipient",
+        ),
+        migrations.AddConstraint(
+            model_name="notification",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("broadcast__isnull", False)),
+                fields=("recipient", "broadcast", "timestamp"),
+                name="unique_broadcast_delivery",
+            ),
+        ),
+    ]
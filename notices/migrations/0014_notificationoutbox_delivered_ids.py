@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0013_notification_broadcast_delivery"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationoutbox",
+            name="delivered_ids",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
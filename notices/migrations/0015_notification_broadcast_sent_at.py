@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 10:41
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_sent_at(apps, schema_editor):
+    # The broadcast notifications were stamped with the send they belong to
+    Notification = apps.get_model("notices", "Notification")
+    Notification.objects.filter(broadcast__isnull=False).update(
+        broadcast_sent_at=F("timestamp")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notices", "0014_notificationoutbox_delivered_ids"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="notification",
+            name="unique_broadcast_delivery",
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="broadcast_sent_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_sent_at, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="notification",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("broadcast__isnull", False)),
+                fields=("recipient", "broadcast", "broadcast_sent_at"),
+                name="unique_broadcast_delivery",
+            ),
+        ),
+    ]
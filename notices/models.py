@@ -1,15 +1,21 @@
+import hashlib
+import json
+import logging
 import uuid
+from collections import Counter
+from datetime import timedelta
+from functools import partial
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.contrib.contenttypes.models import ContentType
-from django.core.mail import send_mass_mail
-from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
 from django.db.models.query import QuerySet
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _  # NOQA
-from django.template.loader import render_to_string
-from notifications.base.models import NotificationQuerySet, id2slug
+from notifications.base.models import NotificationQuerySet as BaseNotificationQuerySet
+from notifications.base.models import id2slug
 from django.apps import apps
 from django.contrib.contenttypes.fields import GenericForeignKey
 from rest_framework_api_key.models import APIKey
@@ -20,7 +26,53 @@ from apps.models import Application
 
 from swapper import load_model
 
-from .signals import bulk_notify, firebase_push_notify
+from .counters import (
+    UNREAD_COUNTER_FANOUT,
+    adjust_unread,
+    invalidate_unread,
+    notifications_created,
+)
+from .fields import DeliveryField, LevelField, delivery_status
+from .dispatchers import DISPATCHERS, FAILED, EmailDispatcher, get_application_ids
+from .helpers import (
+    CHANNEL_QUEUED,
+    DELIVERY_OUTBOX,
+    OUTBOX_LEASE,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_DELAY,
+    bulk_fanout,
+    bulk_fanout_select,
+    iter_id_chunks,
+    iter_id_ranges,
+    iter_recipient_chunks,
+    run_channels,
+)
+from .signals import (
+    apns_push_notify,
+    bulk_notify,
+    firebase_push_notify,
+    web_push_notify,
+    wns_push_notify,
+)
+from .tasks import send_broadcast
+
+logger = logging.getLogger(__name__)
+
+FANOUT_SELECT = "select"
+
+# Every push platform a broadcast can reach, see ``push_notification_handler``
+PUSH_SIGNALS = (
+    firebase_push_notify,
+    apns_push_notify,
+    wns_push_notify,
+    web_push_notify,
+)
+PUSH_PLATFORMS = {
+    firebase_push_notify: "FCM",
+    apns_push_notify: "APNS",
+    wns_push_notify: "WNS",
+    web_push_notify: "WP",
+}
 
 DEVICE_MODEL = {
     "Google": GCMDevice,
@@ -110,6 +162,138 @@ class NotificationPreference(models.Model):
         return f"{self.user}"
 
 
+class NotificationContent(models.Model):
+    """
+    Payload shared by every recipient of the same notification, addressed by
+    the sha256 hash of its content so identical payloads are stored once.
+    """
+
+    PAYLOAD_FIELDS = ("verb", "description", "target", "action", "data")
+
+    hash = models.CharField(max_length=64, primary_key=True, editable=False)
+    verb = models.CharField(max_length=255)
+    description = models.TextField(blank=True, null=True)
+    target = models.JSONField(blank=True, null=True)
+    action = models.JSONField(blank=True, null=True)
+    data = models.JSONField(blank=True, null=True)
+    created = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        verbose_name = _("Notification Content")
+        verbose_name_plural = _("Notification Contents")
+
+    def __str__(self):
+        return f"{self.verb}: {self.hash}"
+
+    @classmethod
+    def get_hash(cls, **payload):
+        payload = {field: payload.get(field) for field in cls.PAYLOAD_FIELDS}
+        canonical = json.dumps(
+            payload,
+            cls=DjangoJSONEncoder,
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get_or_create_for(cls, **payload):
+        """Return the stored content for ``payload``, creating it if needed."""
+        payload = {field: payload.get(field) for field in cls.PAYLOAD_FIELDS}
+        payload["verb"] = str(payload["verb"])
+        content, _ = cls.objects.get_or_create(
+            hash=cls.get_hash(**payload), defaults=payload
+        )
+        return content
+
+
+class NotificationQuerySet(BaseNotificationQuerySet):
+    # Changing these moves notifications in or out of the unread counters
+    COUNTED_FIELDS = ("unread", "deleted")
+
+    def count_unread_changes(self, delete=False, **values):
+        """
+        Return the ``{application_id: {(recipient_id, level): delta}}`` changes
+        of the unread counters once the status ``values`` are written, or the
+        rows deleted, with the number of rows changed.
+        """
+        if delete:
+            values = {"deleted": True}
+        rows = (
+            self.order_by()
+            .values_list(
+                "application_id", "recipient_id", "level", *self.COUNTED_FIELDS
+            )
+            .annotate(count=models.Count("id"))
+        )
+        changes = {}
+        changed = 0
+        for application_id, recipient_id, level, unread, deleted, count in rows:
+            status = {"unread": unread, "deleted": deleted}
+            if not delete and all(status[k] == values[k] for k in values):
+                continue
+            changed += count
+            counted = unread and not deleted
+            if counted != (
+                values.get("unread", unread) and not values.get("deleted", deleted)
+            ):
+                delta = -count if counted else count
+                key = (str(recipient_id), level)
+                changes.setdefault(application_id, Counter())[key] += delta
+        return changes, changed
+
+    def apply_unread_changes(self, changes, exact=True):
+        """
+        Adjust the counters by the ``changes``, or drop the counters of their
+        recipients when a concurrent write changed some of the rows first.
+        """
+        for application_id, counts in changes.items():
+            if exact:
+                adjust_unread(application_id, counts)
+            else:
+                invalidate_unread(application_id, {key[0] for key in counts})
+
+    def update(self, **kwargs):
+        """
+        Keep the unread counters of the changed notifications up to date.
+
+        Status updates skip the rows already in the status, so when two
+        requests race on the same rows only one of them changes each row.
+        The counters are adjusted when every row counted beforehand was
+        changed, and dropped otherwise.
+        """
+        if not any(field in kwargs for field in self.COUNTED_FIELDS):
+            return super().update(**kwargs)
+        if not all(
+            field in self.COUNTED_FIELDS and isinstance(value, bool)
+            for field, value in kwargs.items()
+        ):
+            pairs = self.order_by().values_list("application_id", "recipient_id")
+            changes = {}
+            for application_id, recipient_id in pairs.distinct():
+                changes.setdefault(application_id, []).append(recipient_id)
+            updated = super().update(**kwargs)
+            for application_id, recipient_ids in changes.items():
+                invalidate_unread(application_id, recipient_ids)
+            return updated
+        changes, changed = self.count_unread_changes(**kwargs)
+        updated = super(NotificationQuerySet, self.exclude(**kwargs)).update(**kwargs)
+        self.apply_unread_changes(changes, exact=updated == changed)
+        return updated
+
+    update.alters_data = True
+
+    def delete(self):
+        changes, changed = self.count_unread_changes(delete=True)
+        deleted, rows = super().delete()
+        exact = rows.get(self.model._meta.label, 0) == changed
+        self.apply_unread_changes(changes, exact=exact)
+        return deleted, rows
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Notification(models.Model):
     SUCCESS, INFO, WARNING, PROMOTION, ERROR = (
         "success",
@@ -125,16 +309,18 @@ class Notification(models.Model):
         (PROMOTION, _("Promotion")),
         (ERROR, _("Error")),
     )
+    # Stored codes of the levels, append only
+    LEVEL_CODES = {SUCCESS: 1, INFO: 2, WARNING: 3, PROMOTION: 4, ERROR: 5}
     application = models.ForeignKey(
         Application,
         on_delete=models.CASCADE,
         related_name="notifications",
     )
 
-    level = models.CharField(
+    level = LevelField(
         choices=LEVELS,
+        codes=LEVEL_CODES,
         default=INFO,
-        max_length=20,
     )
     timestamp = models.DateTimeField(default=timezone.now, db_index=True)
 
@@ -143,6 +329,9 @@ class Notification(models.Model):
         blank=False,
         related_name="notifications",
         on_delete=models.CASCADE,
+        # The feed and unread indexes are partial, user deletes cascade on
+        # this one
+        db_index=True,
     )
     actor_content_type = models.ForeignKey(
         ContentType,
@@ -158,20 +347,83 @@ class Notification(models.Model):
     action = models.JSONField(blank=True, null=True)
     data = models.JSONField(blank=True, null=True)
 
-    # Status Fields
-    unread = models.BooleanField(default=True, blank=False, db_index=True)
-    public = models.BooleanField(default=True, db_index=True)
-    deleted = models.BooleanField(default=False, db_index=True)
-    notified_email = models.BooleanField(default=False, db_index=True)
-    notified_apns = models.BooleanField(default=False, db_index=True)
-    notified_gcm = models.BooleanField(default=False, db_index=True)
-    notified_wns = models.BooleanField(default=False, db_index=True)
-    notified_webpush = models.BooleanField(default=False, db_index=True)
+    # Shared payload, when set the description, target, action and data
+    # columns above are left empty and read from the content instead.
+    content = models.ForeignKey(
+        NotificationContent,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="notifications",
+        # Leading column of the delivery index
+        db_index=False,
+    )
+    # Set for the notifications of broadcasts delivered on read
+    broadcast = models.ForeignKey(
+        "Broadcast",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="notifications",
+    )
+    # The ``last_sent_at`` of the broadcast send the notification belongs to
+    broadcast_sent_at = models.DateTimeField(null=True, blank=True)
+
+    # Set by the sender, a notification is created once per application,
+    # recipient and key so retried submissions are skipped
+    dedupe_key = models.CharField(max_length=255, null=True, blank=True)
+
+    # Status Fields, indexed through the partial indexes of ``Meta`` only
+    unread = models.BooleanField(default=True, blank=False)
+    public = models.BooleanField(default=True)
+    deleted = models.BooleanField(default=False)
+    # Channels the notification was delivered on, ``DeliveryField`` flags
+    delivered = DeliveryField()
     objects = NotificationQuerySet.as_manager()
 
     class Meta:
         ordering = ("-timestamp",)
-        index_together = ("recipient", "unread")
+        indexes = [
+            # The feed, filtered by recipient and application and paged on
+            # (timestamp, id) without sorting, the deleted rows left out.
+            models.Index(
+                fields=["recipient", "application", "-timestamp", "-id"],
+                condition=models.Q(deleted=False),
+                name="notices_feed_idx",
+            ),
+            # Unread counts and mark all as read, only the unread rows.
+            models.Index(
+                fields=["recipient", "application"],
+                condition=models.Q(unread=True),
+                name="notices_unread_idx",
+            ),
+            # Delivery bookkeeping, the channels are read from the bitmask.
+            models.Index(
+                fields=["content", "application", "recipient"],
+                condition=models.Q(content__isnull=False),
+                name="notices_delivery_idx",
+            ),
+        ]
+        constraints = [
+            # One notification per send of an on read broadcast, recipient
+            # first so it answers the delivered broadcasts of a feed
+            models.UniqueConstraint(
+                fields=["recipient", "broadcast", "broadcast_sent_at"],
+                condition=models.Q(broadcast__isnull=False),
+                name="unique_broadcast_delivery",
+            ),
+            models.UniqueConstraint(
+                fields=["application", "recipient", "dedupe_key"],
+                condition=models.Q(dedupe_key__isnull=False),
+                name="unique_notification_dedupe_key",
+            ),
+        ]
+
+    notified_email = delivery_status(DeliveryField.EMAIL)
+    notified_apns = delivery_status(DeliveryField.APNS)
+    notified_gcm = delivery_status(DeliveryField.GCM)
+    notified_wns = delivery_status(DeliveryField.WNS)
+    notified_webpush = delivery_status(DeliveryField.WEBPUSH)
 
     def timesince(self, now=None):
         """
@@ -186,6 +438,14 @@ class Notification(models.Model):
     def slug(self):
         return id2slug(self.id)
 
+    def get_payload(self):
+        """Return the payload fields, read from the shared content when set."""
+        source = self.content if self.content_id else self
+        return {
+            field: getattr(source, field)
+            for field in NotificationContent.PAYLOAD_FIELDS
+        }
+
     def clean(self):
         # Validate target data
         # from rest_framework.exceptions import ValidationError
@@ -221,35 +481,159 @@ class Notification(models.Model):
                     }
                 )
 
+    def count_unread(self, delta):
+        if not self.deleted:
+            adjust_unread(
+                self.application_id, {(str(self.recipient_id), self.level): delta}
+            )
+
+    def set_status(self, **values):
+        """Write the status ``values`` with a single ``UPDATE``, no validation."""
+        for field, value in values.items():
+            setattr(self, field, value)
+        type(self).objects.filter(pk=self.pk).update(**values)
+
     def mark_as_read(self):
         if self.unread:
-            self.unread = False
-            self.save()
+            self.set_status(unread=False)
 
     def mark_as_unread(self):
         if not self.unread:
-            self.unread = True
-            self.save()
+            self.set_status(unread=True)
+
+    def mark_as_deleted(self):
+        if not self.deleted:
+            self.set_status(deleted=True)
+
+    def delete(self, *args, **kwargs):
+        if self.unread:
+            self.count_unread(-1)
+        return super().delete(*args, **kwargs)
 
     def save(self, *args, **kwargs):
         self.clean()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def notify(
+        cls,
+        application,
+        recipients,
+        verb="notification",
+        platforms=None,
+        actor=None,
+        dedupe_key=None,
+        **kwargs,
+    ):
+        """
+        Notify the users of the ``recipients`` ids and deliver the
+        notification on the ``platforms`` (push platforms and ``email``).
+        Return the number of created notifications.
+
+        With ``NOTICES_DELIVERY_OUTBOX`` the deliveries are queued in the
+        ``NotificationOutbox`` in the same transaction as the notifications.
+
+        With a ``dedupe_key`` the recipients already notified with the same
+        key are neither notified nor delivered again.
+        """
+        data = kwargs.pop("data", None) or {}
+        content = NotificationContent.get_or_create_for(
+            verb=verb,
+            description=kwargs.get("description"),
+            target=kwargs.get("target"),
+            action=kwargs.get("action"),
+            data=data or None,
+        )
+        users = User.objects.filter(id__in=recipients)
+        platforms = platforms or []
+        title, message = data.get("title"), data.get("message")
+        with transaction.atomic():
+            responses = bulk_notify.send(
+                sender=application,
+                actor=actor or application.owner,
+                verb=verb,
+                recipients=users,
+                application=application,
+                content=content,
+                level=kwargs.get("level", cls.INFO),
+                public=kwargs.get("public", True),
+                dedupe_key=dedupe_key,
+                recipient_ids=recipients,
+            )
+            if platforms and DELIVERY_OUTBOX:
+                NotificationOutbox.enqueue(
+                    platforms,
+                    application,
+                    content=content,
+                    recipients=[str(recipient) for recipient in recipients],
+                    title=title,
+                    message=message,
+                    data=data,
+                )
+                platforms = []
+        for platform in platforms:
+            audience = users
+            if dedupe_key is not None:
+                audience = users.exclude(
+                    id__in=cls.objects.filter(
+                        application=application,
+                        dedupe_key=dedupe_key,
+                        delivered__has=NotificationOutbox.DELIVERY_FLAGS[platform],
+                    ).values("recipient_id")
+                )
+            if platform == NotificationOutbox.EMAIL:
+                EmailDispatcher(
+                    subject=title,
+                    template_name="notices/email_broadcast.txt",
+                    context={"title": title, "message": message, "data": data},
+                    application_id=application.pk,
+                ).dispatch(audience, content=content)
+            else:
+                push_notification_handler(
+                    platform,
+                    audience,
+                    title,
+                    message,
+                    application=application,
+                    content=content,
+                    data=data,
+                )
+        return sum(response or 0 for _, response in responses)
+
 
 class Broadcast(models.Model):
     EMAIL = "email"
     NOTIFICATION = "notification"
     ANDROID_NOTIFICATION = "android_notification"
     APPLE_NOTIFICATION = "apple_notification"
+    PUSH_NOTIFICATION = "push_notification"
     ALL_MEDIA = "all"
 
+    PUSH_CHANNEL = "push"
+    PUSH_MEDIA = {
+        ANDROID_NOTIFICATION: [firebase_push_notify],
+        APPLE_NOTIFICATION: [apns_push_notify],
+        PUSH_NOTIFICATION: PUSH_SIGNALS,
+        ALL_MEDIA: PUSH_SIGNALS,
+    }
+
     MEDIA_CHOICES = (
         (NOTIFICATION, _("Notification")),
         (EMAIL, _("Email")),
         (ANDROID_NOTIFICATION, _("Android Notification")),
+        (APPLE_NOTIFICATION, _("Apple Notification")),
+        (PUSH_NOTIFICATION, _("Push Notification")),
         (ALL_MEDIA, _("All")),
     )
 
+    FANOUT_ON_WRITE = "write"
+    FANOUT_ON_READ = "read"
+
+    DELIVERY_CHOICES = (
+        (FANOUT_ON_WRITE, _("On send")),
+        (FANOUT_ON_READ, _("On read")),
+    )
+
     title = models.CharField(
         max_length=255,
         verbose_name=_("title"),
@@ -291,12 +675,53 @@ class Broadcast(models.Model):
         editable=False,
         verbose_name=_("Counter"),
     )
+    last_recipients = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_("Recipients"),
+        help_text=_("Number of recipients reached by the last send"),
+    )
+    last_channels = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name=_("Channels"),
+        help_text=_("Outcome of every delivery channel in the last send"),
+    )
     media = models.CharField(
         max_length=255,
         default=NOTIFICATION,
         choices=MEDIA_CHOICES,
         verbose_name=_("media"),
     )
+    delivery = models.CharField(
+        max_length=10,
+        default=FANOUT_ON_WRITE,
+        choices=DELIVERY_CHOICES,
+        verbose_name=_("delivery"),
+        help_text=_(
+            "Create the notification of every recipient on send, or only "
+            "when the recipient reads the notification feed."
+        ),
+    )
+    actor = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name=_("actor"),
+    )
+    content = models.ForeignKey(
+        NotificationContent,
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.PROTECT,
+        related_name="broadcasts",
+        verbose_name=_("content"),
+    )
 
     users = models.ManyToManyField(
         User,
@@ -326,48 +751,55 @@ class Broadcast(models.Model):
     def __str__(self):
         return f"{self.title}"
 
-    def _send_notification(self, actor, recipients, data):
-        bulk_notify.send(
+    def _send_notification(self, actor, recipients, data, content=None):
+        responses = bulk_notify.send(
             self,
             actor=actor,
             verb="broadcast",
             recipients=recipients,
             application=self.application,
+            content=content,
             **data,
         )
-
-    def _send_firebase(self, recipients, data):
-        firebase_push_notify.send(
-            self,
-            recipients=recipients,
-            title=self.title,
-            message=self.message,
-            data=data,
+        return sum(response or 0 for _, response in responses)
+
+    def _send_push(self, recipients, data, content=None, signals=PUSH_SIGNALS):
+        result = {}
+        for signal in signals:
+            responses = signal.send(
+                self,
+                recipients=recipients,
+                title=self.title,
+                message=self.message,
+                data=data,
+                application=self.application,
+                content=content,
+            )
+            for _, counters in responses:
+                for status, count in (counters or {}).items():
+                    result[status] = result.get(status, 0) + count
+        return result
+
+    def _send_firebase(self, recipients, data, content=None):
+        return self._send_push(
+            recipients, data, content, signals=[firebase_push_notify]
         )
 
-    def _send_email(self, recipients, data):
-        # TODO find more eficient way to send mas email
-        from django.conf import settings
-
-        sender_email = getattr(
-            settings,
-            "DEFAULT_FROM_EMAIL",
-            "My Domain <noreply@mydomain.com>",
-        )
+    def _send_apns(self, recipients, data, content=None):
+        return self._send_push(recipients, data, content, signals=[apns_push_notify])
 
-        recipient_emails = [
-            user.email for user in recipients if user.email not in ["", None]
-        ]
-        email_content = render_to_string(
+    def _send_email(self, recipients, data, content=None):
+        dispatcher = EmailDispatcher(
+            subject=self.title,
             template_name="notices/email_broadcast.txt",
             context={
                 "title": self.title,
                 "message": self.message,
                 "data": data,
             },
+            application_id=self.application_id,
         )
-        messages = [(self.title, email_content, sender_email, recipient_emails)]
-        send_mass_mail(messages)
+        return dispatcher.dispatch(recipients, content=content)
 
     def get_title(self):
         return self.title
@@ -393,42 +825,549 @@ class Broadcast(models.Model):
             }
         return data
 
+    def get_content(self, data):
+        """Return the shared notification content of the broadcast ``data``."""
+        data = dict(data)
+        return NotificationContent.get_or_create_for(
+            verb="broadcast",
+            description=data.pop("description", None),
+            target=data.pop("target", None),
+            action=data.pop("action", None),
+            data=data,
+        )
+
     def get_recipients(self):
-        queryset = User.objects.filter(is_active=True)
-        user_ids = [user.id for user in self.users.all()]
-        group_query = models.Q(groups__in=self.groups.all())
-        user_query = models.Q(id__in=user_ids)
-        queryset = queryset.filter(group_query | user_query)
+        """
+        Return active users targeted directly or through one of the groups.
+
+        Both audiences are resolved with subqueries on the membership tables,
+        so no user row is loaded in Python and users that are members of
+        several groups are not duplicated.
+        """
+        user_ids = self.users.through.objects.filter(broadcast_id=self.pk).values(
+            "user_id"
+        )
+        group_ids = self.groups.through.objects.filter(broadcast_id=self.pk).values(
+            "group_id"
+        )
+        member_ids = User.groups.through.objects.filter(group_id__in=group_ids).values(
+            "user_id"
+        )
+        queryset = User.objects.filter(is_active=True).filter(
+            models.Q(id__in=user_ids) | models.Q(id__in=member_ids)
+        )
         return queryset
 
+    def iter_recipient_ids(self, chunk_size=None):
+        """Stream the recipient ids in keyset paginated chunks."""
+        return iter_id_chunks(self.get_recipients(), chunk_size=chunk_size)
+
+    def iter_shards(self, shard_size=None):
+        """Split the audience into ``(first_id, last_id)`` shards."""
+        return iter_id_ranges(self.get_recipients(), shard_size=shard_size)
+
+    @property
+    def fanout_on_read(self):
+        return self.delivery == self.FANOUT_ON_READ
+
     def send(self, actor=None, **kwargs):
-        recipients = self.get_recipients()
+        """
+        Queue the broadcast, the coordinator task splits the audience into
+        shards that are delivered in parallel by the workers.
+
+        With the on read delivery the notification is only published, the
+        rows are created when the recipients read their feed.
+        """
+        if self.fanout_on_read:
+            self.publish(actor, **kwargs)
+            if self.media == self.NOTIFICATION:
+                return None
+        return send_broadcast.delay(
+            self.pk,
+            actor_id=getattr(actor, "pk", None),
+            **kwargs,
+        )
+
+    def publish(self, actor=None, **kwargs):
+        """Store the notification once for the on read delivery."""
+        if actor is None:
+            actor = User.objects.filter(is_superuser=True).first()
+        data = self.get_data()
+        data.update(kwargs)
+        self.actor = actor
+        self.content = self.get_content(data)
+        self.last_sent_at = timezone.now()
+        Broadcast.objects.filter(pk=self.pk).update(
+            actor=self.actor, content=self.content, last_sent_at=self.last_sent_at
+        )
+        if self.media == self.NOTIFICATION:
+            self.mark_as_sent()
+
+    @classmethod
+    def deliver_on_read(cls, user, application):
+        """
+        Create the notifications of the published on read broadcasts
+        targeting ``user`` that are not in their feed yet, with a single
+        ``INSERT ... SELECT``. Return the number of created notifications.
+
+        The notifications are stamped when they are created, so a user
+        targeted after the publication still finds them past their ``since``
+        cursor. They are keyed on the ``last_sent_at`` of their broadcast, a
+        broadcast published again reaches the users who got an earlier send.
+        """
+        user_broadcasts = cls.users.through.objects.filter(user_id=user.pk).values(
+            "broadcast_id"
+        )
+        user_groups = User.groups.through.objects.filter(user_id=user.pk).values(
+            "group_id"
+        )
+        group_broadcasts = cls.groups.through.objects.filter(
+            group_id__in=user_groups
+        ).values("broadcast_id")
+        delivered = Notification.objects.filter(
+            recipient_id=user.pk,
+            broadcast=models.OuterRef("pk"),
+            broadcast_sent_at=models.OuterRef("last_sent_at"),
+        )
+        opted_out = NotificationPreference.objects.filter(
+            user_id=user.pk, push_notification=False
+        )
+        pending = (
+            cls.objects.filter(
+                application=application,
+                delivery=cls.FANOUT_ON_READ,
+                content__isnull=False,
+                actor__isnull=False,
+            )
+            .filter(
+                models.Q(id__in=user_broadcasts) | models.Q(id__in=group_broadcasts)
+            )
+            .filter(~models.Exists(delivered))
+            .filter(~models.Exists(opted_out))
+        )
+        created = bulk_fanout_select(
+            Notification,
+            {
+                "recipient": user.pk,
+                "application": application,
+                "actor_content_type": ContentType.objects.get_for_model(User),
+            },
+            queryset=pending,
+            select={
+                "broadcast": models.F("pk"),
+                "content": models.F("content_id"),
+                "verb": models.F("content__verb"),
+                "broadcast_sent_at": models.F("last_sent_at"),
+                "actor_object_id": models.F("actor_id"),
+            },
+            ignore_conflicts=True,
+        )
+        if created:
+            invalidate_unread(application.pk, [user.pk])
+        return created
+
+    def get_channels(self, actor, recipients, data, content=None):
+        """
+        Return the delivery channels of the media, as ``run_channels`` expects
+        them. The push and email channels start once the notifications are
+        created so they can flag them as delivered.
+        """
+        channels = []
+        after = None
+        if self.media in (self.NOTIFICATION, self.ALL_MEDIA):
+            if not self.fanout_on_read:
+                channels.append(
+                    (
+                        self.NOTIFICATION,
+                        partial(
+                            self._send_notification, actor, recipients, data, content
+                        ),
+                        None,
+                    )
+                )
+                after = self.NOTIFICATION
+        signals = self.PUSH_MEDIA.get(self.media)
+        if signals:
+            channels.append(
+                (
+                    self.PUSH_CHANNEL,
+                    partial(self._send_push, recipients, data, content, signals),
+                    after,
+                )
+            )
+        if self.media in (self.EMAIL, self.ALL_MEDIA):
+            channels.append(
+                (
+                    self.EMAIL,
+                    partial(self._send_email, recipients, data, content),
+                    after,
+                )
+            )
+        return channels
+
+    def send_shard(self, first_id, last_id, actor=None, **kwargs):
+        """
+        Deliver the broadcast to the recipients between ``first_id`` and
+        ``last_id`` (inclusive).
+
+        The channels of the media run concurrently, see ``run_channels``.
+        Return the number of recipients with the outcome of every channel.
+        """
+        recipients = self.get_recipients().filter(id__gte=first_id, id__lte=last_id)
 
         # Get dictionary extra data
         data = self.get_data()
         data.update(kwargs)
 
-        # Send web notification
-        if self.media == self.EMAIL:
-            self._send_email(recipients, data)
-        elif self.media == self.ANDROID_NOTIFICATION:
-            self._send_firebase(recipients, data)
-        elif self.media == self.NOTIFICATION:
-            self._send_notification(actor, recipients, data)
-        elif self.media == self.ALL_MEDIA:
-            self._send_email(recipients, data)
-            self._send_firebase(recipients, data)
-            self._send_notification(actor, recipients, data)
+        if self.media not in dict(self.MEDIA_CHOICES):
+            return {"recipients": 0, "channels": {}}
+
+        # Every channel streams the shard on its own, recipients are never
+        # materialized as a whole.
+        content = None
+        if self.fanout_on_read:
+            content = self.content
+        elif self.media != self.EMAIL:
+            content = self.get_content(data)
+        if DELIVERY_OUTBOX:
+            return self.queue_shard(first_id, last_id, actor, recipients, data, content)
+        channels = self.get_channels(actor, recipients, data, content)
+        return {
+            "recipients": recipients.count(),
+            "channels": run_channels(channels) if channels else {},
+        }
+
+    def queue_shard(self, first_id, last_id, actor, recipients, data, content=None):
+        """
+        Create the notifications of the shard and queue its push and email
+        deliveries in the ``NotificationOutbox``, in the same transaction.
+        The deliveries are made by the ``notices_outbox_worker`` command.
+        """
+        channels = []
+        outcomes = {}
+        signals = self.PUSH_MEDIA.get(self.media) or []
+        channels += [PUSH_PLATFORMS[signal] for signal in signals]
+        if self.media in (self.EMAIL, self.ALL_MEDIA):
+            channels.append(NotificationOutbox.EMAIL)
+        with transaction.atomic():
+            if self.media in (self.NOTIFICATION, self.ALL_MEDIA):
+                if not self.fanout_on_read:
+                    outcomes[self.NOTIFICATION] = {
+                        "status": "done",
+                        "result": self._send_notification(
+                            actor, recipients, data, content
+                        ),
+                    }
+            queued = NotificationOutbox.enqueue(
+                channels,
+                self.application,
+                content=content,
+                broadcast=self,
+                first_id=first_id,
+                last_id=last_id,
+                title=self.title,
+                message=self.message,
+                data=data,
+            )
+        if signals:
+            outcomes[self.PUSH_CHANNEL] = {"status": CHANNEL_QUEUED}
+        if NotificationOutbox.EMAIL in channels:
+            outcomes[self.EMAIL] = {"status": CHANNEL_QUEUED}
+        logger.debug("Broadcast #%s queued %s deliveries", self.pk, len(queued))
+        return {"recipients": recipients.count(), "channels": outcomes}
+
+    def mark_as_sent(self, recipients_count=None, channels=None):
+        values = {
+            "sent_counter": models.F("sent_counter") + 1,
+            # On read broadcasts keep the time they were published at, their
+            # notifications are keyed on it
+            "last_sent_at": models.Case(
+                models.When(
+                    delivery=self.FANOUT_ON_READ, then=models.F("last_sent_at")
+                ),
+                default=models.Value(timezone.now()),
+                output_field=models.DateTimeField(),
+            ),
+        }
+        if recipients_count is not None:
+            values["last_recipients"] = recipients_count
+        if channels is not None:
+            values["last_channels"] = channels
+        Broadcast.objects.filter(pk=self.pk).update(**values)
+
+
+class NotificationOutbox(models.Model):
+    """
+    Durable delivery intent, written in the same transaction as the
+    notifications and drained by the ``notices_outbox_worker`` command.
+
+    An entry delivers one channel to the recipients of a broadcast shard, or
+    to its ``recipients`` notified with ``content`` when it has no broadcast.
+    Recipients already flagged as notified for the content, or kept in
+    ``delivered_ids`` when there is no content to flag, are skipped, so a
+    retried entry only delivers what is missing.
+    """
+
+    EMAIL = "email"
+    CHANNELS = [
+        ("FCM", "Firebase"),
+        ("APNS", "Apple"),
+        ("WNS", "Windows"),
+        ("WP", "Web Push"),
+        (EMAIL, "Email"),
+    ]
+
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (PENDING, _("Pending")),
+        (PROCESSING, _("Processing")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    ]
+
+    DELIVERY_FLAGS = {
+        "FCM": DeliveryField.GCM,
+        "APNS": DeliveryField.APNS,
+        "WNS": DeliveryField.WNS,
+        "WP": DeliveryField.WEBPUSH,
+        EMAIL: DeliveryField.EMAIL,
+    }
+
+    channel = models.CharField(max_length=10, choices=CHANNELS)
+    application = models.ForeignKey(
+        Application,
+        on_delete=models.CASCADE,
+        related_name="outbox",
+    )
+    content = models.ForeignKey(
+        NotificationContent,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="outbox",
+    )
+    broadcast = models.ForeignKey(
+        Broadcast,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="outbox",
+    )
+    first_id = models.CharField(max_length=255, null=True, blank=True)
+    last_id = models.CharField(max_length=255, null=True, blank=True)
+    # Ids of the recipients of an entry without broadcast
+    recipients = models.JSONField(null=True, blank=True)
+    # Ids of the recipients delivered by an entry without content
+    delivered_ids = models.JSONField(null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        verbose_name = _("Notification Outbox")
+        verbose_name_plural = _("Notification Outbox")
+        indexes = [
+            models.Index(
+                fields=["status", "available_at"], name="notices_outbox_claim_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.channel} #{self.pk} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, channels, application, **kwargs):
+        """Queue one entry per channel, the other ``kwargs`` make the payload."""
+        fields = {
+            name: kwargs.pop(name, None)
+            for name in ("content", "broadcast", "first_id", "last_id", "recipients")
+        }
+        return cls.objects.bulk_create(
+            [
+                cls(channel=channel, application=application, payload=kwargs, **fields)
+                for channel in channels
+            ]
+        )
+
+    @classmethod
+    def claim(cls, limit, lease=None):
+        """
+        Lock up to ``limit`` entries ready to be delivered for ``lease``
+        seconds and return them. Rows locked by another worker are skipped,
+        entries whose lease expired are claimed again.
+        """
+        now = timezone.now()
+        ready = models.Q(status=cls.PENDING, available_at__lte=now) | models.Q(
+            status=cls.PROCESSING, locked_until__lt=now
+        )
+        with transaction.atomic():
+            entries = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(ready)
+                .order_by("available_at")[:limit]
+            )
+            locked_until = now + timedelta(seconds=lease or OUTBOX_LEASE)
+            cls.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+                status=cls.PROCESSING,
+                locked_until=locked_until,
+                attempts=models.F("attempts") + 1,
+            )
+        for entry in entries:
+            entry.status = cls.PROCESSING
+            entry.locked_until = locked_until
+            entry.attempts += 1
+        return entries
+
+    def get_recipients(self):
+        if self.broadcast_id is not None:
+            recipients = self.broadcast.get_recipients()
+            if self.first_id is not None:
+                recipients = recipients.filter(
+                    id__gte=self.first_id, id__lte=self.last_id
+                )
         else:
-            return
-        self.sent_counter += 1
-        self.last_sent_at = timezone.now()
-        self.save()
+            # The rows of the entry recipients not delivered on the channel
+            # yet, earlier recipients of the same content are left alone
+            return User.objects.filter(
+                id__in=Notification.objects.filter(
+                    content_id=self.content_id,
+                    application_id=self.application_id,
+                    recipient_id__in=self.recipients or [],
+                    delivered__lacks=self.DELIVERY_FLAGS[self.channel],
+                ).values("recipient_id")
+            )
+        if self.content_id is not None:
+            notified = Notification.objects.filter(
+                content_id=self.content_id,
+                application_id=self.application_id,
+                delivered__has=self.DELIVERY_FLAGS[self.channel],
+            ).values("recipient_id")
+            recipients = recipients.exclude(id__in=notified)
+        if self.delivered_ids:
+            recipients = recipients.exclude(id__in=self.delivered_ids)
+        return recipients
+
+    def deliver(self):
+        """Deliver the entry and return the delivery counters."""
+        payload = dict(self.payload)
+        recipients = self.get_recipients()
+        if self.channel == self.EMAIL:
+            dispatcher = EmailDispatcher(
+                subject=payload.get("title"),
+                template_name="notices/email_broadcast.txt",
+                context=payload,
+                application_id=self.application_id,
+            )
+            try:
+                return dispatcher.dispatch(recipients, content=self.content_id)
+            finally:
+                if self.content_id is None:
+                    # No notification to flag, remember who was emailed
+                    self.delivered_ids = sorted(
+                        {*(self.delivered_ids or []), *map(str, dispatcher.delivered)}
+                    )
+        return push_notification_handler(
+            self.channel,
+            recipients,
+            payload.pop("title", None),
+            payload.pop("message", None),
+            application=self.application,
+            content=self.content_id,
+            data=payload.get("data") or {},
+        )
+
+    def retry(self, error):
+        """Schedule the entry again with an exponential backoff, or give up."""
+        self.last_error = error
+        if self.attempts >= OUTBOX_MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            self.status = self.PENDING
+            self.available_at = timezone.now() + timedelta(
+                seconds=OUTBOX_RETRY_DELAY * 2 ** (self.attempts - 1)
+            )
+
+    def process(self):
+        """
+        Deliver the entry and record the outcome, retry it when it raises or
+        some of its deliveries failed. Only the recipients still missing are
+        delivered on the next attempt.
+        """
+        try:
+            result = self.deliver()
+        except Exception as err:
+            logger.exception("Outbox entry #%s failed", self.pk)
+            self.retry(repr(err))
+        else:
+            self.result = result
+            failed = (result or {}).get(FAILED, 0)
+            if failed:
+                logger.warning(
+                    "Outbox entry #%s: %s deliveries failed", self.pk, failed
+                )
+                self.retry("%s deliveries failed" % failed)
+            else:
+                self.status = self.DONE
+        self.locked_until = None
+        self.save(
+            update_fields=[
+                "status",
+                "result",
+                "delivered_ids",
+                "last_error",
+                "available_at",
+                "locked_until",
+            ]
+        )
+        return self.status
+
+
+def get_notification_audience(recipients):
+    """
+    Return the active users of a ``Group`` or user ``QuerySet`` that did not
+    opt out of app notifications in their ``NotificationPreference``.
+    """
+    if isinstance(recipients, Group):
+        recipients = User.objects.filter(groups=recipients)
+    opted_out = NotificationPreference.objects.filter(push_notification=False).values(
+        "user_id"
+    )
+    return recipients.filter(is_active=True).exclude(id__in=opted_out)
+
+
+def count_recipients(recipient_ids, counted):
+    """Yield the ``recipient_ids``, the first ones are collected in ``counted``."""
+    for recipient_id in recipient_ids:
+        if len(counted) <= UNREAD_COUNTER_FANOUT:
+            counted.append(recipient_id)
+        yield recipient_id
 
 
 def bulk_notification_handler(verb, **kwargs):
     """
     Handler function to bulk create Notification instance upon action signal call.
+
+    Every lookup is resolved once per call. When the recipients are a ``Group``
+    or a user ``QuerySet`` (or ``fanout="select"`` is given) the rows are
+    created by the database with a single ``INSERT ... SELECT`` over the
+    active users that did not opt out, see ``get_notification_audience``.
+    Otherwise the rows are built as plain tuples sharing everything but the
+    recipient and written in batches of ``batch_size``
+    (``NOTICES_BULK_BATCH_SIZE`` by default). In both cases the payload is
+    stored once as ``NotificationContent`` and the rows only reference it.
+
+    The unread counters of the recipients are updated, or dropped when the
+    created rows are not known exactly: pass ``recipient_ids`` along with a
+    ``QuerySet`` to keep them for small audiences.
     """
 
     EXTRA_DATA = True
@@ -438,74 +1377,150 @@ def bulk_notification_handler(verb, **kwargs):
     kwargs.pop("sender")
     recipient = kwargs.pop("recipients")
     actor = kwargs.pop("actor")
+    batch_size = kwargs.pop("batch_size", None)
+    fanout = kwargs.pop("fanout", None)
 
     if actor is None:
         actor = User.objects.filter(is_superuser=True).first()
 
-    optional_objs = [
-        (kwargs.pop(opt, None), opt) for opt in ("target", "action_object")
-    ]
+    # The model has no generic action object, target and action are
+    # stored as json payloads.
+    kwargs.pop("action_object", None)
+    target = kwargs.pop("target", None)
+    action = kwargs.pop("action", None)
     public = bool(kwargs.pop("public", True))
     description = kwargs.pop("description", None)
     timestamp = kwargs.pop("timestamp", timezone.now())
     Notification = load_model("notifications", "Notification")
-    level = kwargs.pop("level", Notification.LEVELS.info)
+    level = kwargs.pop("level", Notification.INFO)
     application = kwargs.pop("application", None)
-
-    # Check if User or Group
-    if isinstance(recipient, Group):
-        recipients = recipient.user_set.all()
-    elif isinstance(recipient, (QuerySet, list)):
-        recipients = recipient
+    content = kwargs.pop("content", None)
+    # Rows of a recipient already notified with the key are skipped
+    dedupe_key = kwargs.pop("dedupe_key", None)
+    # Ids of the recipients when known, for the unread counters
+    recipient_ids = kwargs.pop("recipient_ids", None)
+    counted, exact = None, False
+
+    # The payload is stored once and every row only references it
+    if content is None:
+        content = NotificationContent.get_or_create_for(
+            verb=verb,
+            description=description,
+            target=target,
+            action=action,
+            data=kwargs if kwargs and EXTRA_DATA else None,
+        )
+    values = {
+        "application": application,
+        "level": level,
+        "timestamp": timestamp,
+        "actor_content_type": ContentType.objects.get_for_model(actor),
+        "actor_object_id": actor.pk,
+        "verb": content.verb,
+        "content": content,
+        "public": public,
+        "dedupe_key": dedupe_key,
+    }
+
+    if fanout is None:
+        fanout = FANOUT_SELECT if isinstance(recipient, (Group, QuerySet)) else None
+    if fanout == FANOUT_SELECT:
+        # Let the database build the rows for the whole audience with a
+        # single INSERT ... SELECT, no user is loaded into Python.
+        created = bulk_fanout_select(
+            Notification,
+            values,
+            queryset=get_notification_audience(recipient),
+            select={"recipient": models.F("pk")},
+            ignore_conflicts=dedupe_key is not None,
+        )
+        # The audience may leave some of the given ids out
+        if recipient_ids is not None:
+            counted = set(map(str, recipient_ids))
+            exact = created == len(counted)
     else:
-        recipients = [recipient]
+        # Recipients are consumed chunk by chunk, so a broadcast to a huge
+        # audience never holds more than one batch of rows in memory.
+        counted = []
+        keys = (
+            recipient_id
+            for chunk in iter_recipient_chunks(recipient)
+            for recipient_id in chunk
+        )
+        created = bulk_fanout(
+            Notification,
+            values,
+            key_field="recipient",
+            keys=count_recipients(keys, counted),
+            batch_size=batch_size,
+            ignore_conflicts=dedupe_key is not None,
+        )
+        exact = created == len(counted)
 
-    new_notifications = []
+    if application is not None:
+        if counted is not None and len(counted) > UNREAD_COUNTER_FANOUT:
+            counted = None
+        notifications_created(application.pk, level, counted, exact=exact)
+    return created
 
-    for recipient in recipients:
-        newnotify = Notification(
-            recipient=recipient,
-            actor_content_type=ContentType.objects.get_for_model(actor),
-            actor_object_id=actor.pk,
-            verb=str(verb),
-            public=public,
-            description=description,
-            timestamp=timestamp,
-            application=application,
-            level=level,
+
+def push_notification_handler(platform, recipients, title, message, **kwargs):
+    """
+    Push ``message`` to the ``platform`` devices of the recipients, see
+    ``notices.dispatchers.PushDispatcher``.
+
+    The devices of ``application`` are targeted, or the devices of every
+    application when it is not given. Applications without settings for the
+    platform in ``PUSH_NOTIFICATIONS_SETTINGS`` are skipped. When the
+    notifications were created with the shared ``content`` the notified flag
+    of the platform is set for the delivered recipients. Return the delivery
+    counters.
+    """
+    kwargs.pop("signal", None)
+    kwargs.pop("sender", None)
+    application = kwargs.pop("application", None)
+    content = kwargs.pop("content", None)
+    data = kwargs.pop("data", kwargs)
+    dispatcher_class = DISPATCHERS[platform]
+
+    if application is not None:
+        application_ids = [application.pk]
+    else:
+        if not isinstance(recipients, (Group, QuerySet, models.Model)):
+            recipients = list(recipients)
+        application_ids = get_application_ids(dispatcher_class.device_model, recipients)
+
+    result = {}
+    for application_id in application_ids:
+        try:
+            dispatcher = dispatcher_class(application_id)
+        except (ImproperlyConfigured, ImportError) as err:
+            logger.info(
+                "Skip %s push for application %s: %s", platform, application_id, err
+            )
+            continue
+        counters = dispatcher.dispatch(
+            recipients, title=title, message=message, data=data, content=content
         )
+        for status, count in counters.items():
+            result[status] = result.get(status, 0) + count
+    return result
 
-        # Set optional objects
-        for obj, opt in optional_objs:
-            if obj is not None:
-                setattr(newnotify, "%s_object_id" % opt, obj.pk)
-                setattr(
-                    newnotify,
-                    "%s_content_type" % opt,
-                    ContentType.objects.get_for_model(obj),
-                )
 
-        # extra data as json data
-        if kwargs and EXTRA_DATA:
-            newnotify.data = kwargs
+def firebase_notification_handler(recipients, title, message, **kwargs):
+    return push_notification_handler("FCM", recipients, title, message, **kwargs)
 
-        new_notifications.append(newnotify)
 
-    results = Notification.objects.bulk_create(new_notifications)
-    return results
+def apns_notification_handler(recipients, title, message, **kwargs):
+    return push_notification_handler("APNS", recipients, title, message, **kwargs)
 
 
-def firebase_notification_handler(recipients, title, message, **kwargs):
-    kwargs.pop("signal", None)
-    kwargs.pop("sender", None)
-    GCMDevice = apps.get_model("push_notifications.GCMDevice")
-    recipient_ids = [user.id for user in recipients]
-    gcm_devices = GCMDevice.objects.filter(user_id__in=recipient_ids, active=True)
+def wns_notification_handler(recipients, title, message, **kwargs):
+    return push_notification_handler("WNS", recipients, title, message, **kwargs)
 
-    try:
-        gcm_devices.send_message(message, title=title, payload=kwargs)
-    except Exception as err:
-        print(err)
+
+def webpush_notification_handler(recipients, title, message, **kwargs):
+    return push_notification_handler("WP", recipients, title, message, **kwargs)
 
 
 # Connect the signal
@@ -517,3 +1532,10 @@ bulk_notify.connect(
 firebase_push_notify.connect(
     firebase_notification_handler, dispatch_uid="push_notification.gcm.firebase"
 )
+apns_push_notify.connect(
+    apns_notification_handler, dispatch_uid="push_notification.apns"
+)
+wns_push_notify.connect(wns_notification_handler, dispatch_uid="push_notification.wns")
+web_push_notify.connect(
+    webpush_notification_handler, dispatch_uid="push_notification.webpush"
+)
@@ -1,4 +1,5 @@
-""" Django notifications signal file """
+"""Django notifications signal file"""
+
 # -*- coding: utf-8 -*-
 from django.dispatch import Signal
 
@@ -6,3 +7,4 @@ bulk_notify = Signal()
 firebase_push_notify = Signal()
 apns_push_notify = Signal()
 web_push_notify = Signal()
+wns_push_notify = Signal()
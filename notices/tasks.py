@@ -1,7 +1,14 @@
+import logging
+
 from django.apps import apps
-from celery import shared_task
+from django.contrib.auth import get_user_model
+from celery import chord, shared_task
+from .counters import reconcile_unread
+from .helpers import CHANNEL_FAILED, merge_channel_outcomes
 from .signals import bulk_notify
 
+logger = logging.getLogger(__name__)
+
 get_model = apps.get_model
 
 
@@ -18,3 +25,102 @@ def send_email_notification(self):
 @shared_task(name="notices.send_push_notification", bind=True)
 def send_push_notification(obj_id, app_label, model_name, recipients=None):
     pass
+
+
+@shared_task(name="notices.send_broadcast", bind=True)
+def send_broadcast(self, broadcast_id, actor_id=None, **kwargs):
+    """
+    Coordinator task, split the broadcast audience into recipient id shards
+    and deliver them in parallel, the shard results are aggregated by
+    ``finish_broadcast``.
+    """
+    Broadcast = get_model("notices", "Broadcast")
+    broadcast = Broadcast.objects.get(pk=broadcast_id)
+    shards = [
+        send_broadcast_shard.s(broadcast_id, first_id, last_id, actor_id, **kwargs)
+        for first_id, last_id in broadcast.iter_shards()
+    ]
+    if not shards:
+        return finish_broadcast([], broadcast_id)
+    return chord(shards)(finish_broadcast.s(broadcast_id)).id
+
+
+@shared_task(name="notices.send_broadcast_shard", bind=True)
+def send_broadcast_shard(
+    self, broadcast_id, first_id, last_id, actor_id=None, **kwargs
+):
+    """
+    Deliver one shard of a broadcast, return the number of recipients with
+    the outcome of every channel.
+
+    A shard never raises, the chord would not run ``finish_broadcast``
+    otherwise: its error is returned as the failed outcome of a ``shard``
+    channel.
+    """
+    Broadcast = get_model("notices", "Broadcast")
+    try:
+        broadcast = Broadcast.objects.get(pk=broadcast_id)
+        actor = None
+        if actor_id is not None:
+            actor = get_user_model().objects.filter(pk=actor_id).first()
+        return broadcast.send_shard(first_id, last_id, actor=actor, **kwargs)
+    except Exception as err:
+        logger.exception(
+            "Shard %s-%s of broadcast %s failed", first_id, last_id, broadcast_id
+        )
+        return {
+            "recipients": 0,
+            "channels": {"shard": {"status": CHANNEL_FAILED, "error": repr(err)}},
+        }
+
+
+@shared_task(name="notices.finish_broadcast")
+def finish_broadcast(results, broadcast_id):
+    """Aggregate the shard results back into the broadcast counters."""
+    Broadcast = get_model("notices", "Broadcast")
+    recipients_count = sum(result["recipients"] for result in results)
+    channels = merge_channel_outcomes(result["channels"] for result in results)
+    Broadcast(pk=broadcast_id).mark_as_sent(recipients_count, channels)
+    return {"recipients": recipients_count, "channels": channels}
+
+
+@shared_task(name="notices.send_notifications", bind=True)
+def send_notifications(self, application_id, notifications):
+    """
+    Notify every notification spec accepted by the server notification API,
+    return the number of created notifications of each spec.
+    """
+    Application = get_model("apps", "Application")
+    Notification = get_model("notices", "Notification")
+    application = Application.objects.select_related("owner").get(pk=application_id)
+    return [Notification.notify(application, **spec) for spec in notifications]
+
+
+@shared_task(name="notices.deliver_notifications", bind=True)
+def deliver_notifications(
+    self, application_id, content_id, channels, payload, recipient_ids
+):
+    """
+    Deliver the notifications sharing ``content_id`` of the ``recipient_ids``
+    on ``channels``, the recipients already notified on a channel are skipped.
+    """
+    NotificationOutbox = get_model("notices", "NotificationOutbox")
+    return {
+        channel: NotificationOutbox(
+            channel=channel,
+            application_id=application_id,
+            content_id=content_id,
+            recipients=recipient_ids,
+            payload=payload,
+        ).deliver()
+        for channel in channels
+    }
+
+
+@shared_task(name="notices.reconcile_unread_counters")
+def reconcile_unread_counters(window=None):
+    """
+    Count the unread counters of the recently notified recipients again from
+    the database, scheduled by ``CELERY_BEAT_SCHEDULE``.
+    """
+    return reconcile_unread(window)
@@ -1,4 +1,22 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_api_key.models import APIKey
+from apps.models import Application, ApplicationKey
+from notices.models import Notification, NotificationOutbox, NotificationQuerySet
+from notices.signals import bulk_notify
+from notices.tasks import reconcile_unread_counters
+from server.celery import app as celery_app
+
+User = get_user_model()
 
 
 class TestSendNotification(TestCase):
@@ -10,3 +28,582 @@ class TestSendNotification(TestCase):
     #         registration_ids=["4"], data={"title": "hello test"}, cloud_type="FCM"
     #     )
     #     return res
+
+
+class TestNotificationEndpoints(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="testuser1", password="test123")
+        self.other_user = User.objects.create_user(
+            username="testuser2", password="test123"
+        )
+        self.application = Application.objects.create(
+            owner=self.user,
+            name="Application Test",
+            domain="http://localhost:8000",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.credentials(HTTP_X_APPLICATION=self.application.id)
+        return super().setUp()
+
+    def notify(self, recipients, **kwargs):
+        bulk_notify.send(
+            sender=self.application,
+            actor=self.user,
+            verb="broadcast",
+            recipients=recipients,
+            application=self.application,
+            **kwargs,
+        )
+
+    def test_list_joins_shared_content(self):
+        self.notify(
+            [self.user, self.other_user],
+            description="Hello",
+            target={"name": "Post", "description": "A post"},
+            title="Hello",
+        )
+        response = self.client.get("/api/v1/notifications/")
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["description"], "Hello")
+        self.assertEqual(results[0]["target"]["name"], "Post")
+        self.assertEqual(results[0]["data"], {"title": "Hello"})
+        self.assertNotIn("content", results[0])
+
+    def test_list_pages_with_cursor(self):
+        for i in range(5):
+            self.notify([self.user], description="Notification %s" % i)
+        # Same timestamp for every row, the id breaks the ties
+        Notification.objects.update(timestamp=timezone.now())
+        expected = list(
+            Notification.objects.order_by("-id").values_list("id", flat=True)
+        )
+
+        ids = []
+        url = "/api/v1/notifications/?page_size=2"
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(
+                any("COUNT(" in query["sql"] for query in queries.captured_queries)
+            )
+            data = response.json()
+            ids += [notification["id"] for notification in data["results"]]
+            url = data["next"]
+        self.assertEqual(ids, expected)
+
+    def test_list_since_cursor(self):
+        self.notify([self.user], description="First")
+        since = self.client.get("/api/v1/notifications/").json()["since"]
+
+        # The last seconds before the cursor are read again
+        response = self.client.get("/api/v1/notifications/", {"since": since})
+        self.assertEqual(
+            [
+                notification["description"]
+                for notification in response.json()["results"]
+            ],
+            ["First"],
+        )
+        self.assertEqual(response.json()["since"], since)
+        with mock.patch("notices.api.v1.pagination.SYNC_OVERLAP", 0):
+            since = self.client.get("/api/v1/notifications/").json()["since"]
+        response = self.client.get("/api/v1/notifications/", {"since": since})
+        self.assertEqual(response.json()["results"], [])
+
+        self.notify([self.user], description="Second")
+        self.notify([self.user], description="Third")
+        data = self.client.get("/api/v1/notifications/", {"since": since}).json()
+        self.assertEqual(
+            [notification["description"] for notification in data["results"]],
+            ["Second", "Third"],
+        )
+        self.assertIsNone(data["next"])
+        self.assertNotEqual(data["since"], since)
+
+    def test_list_since_cursor_overlap(self):
+        self.notify([self.user], description="First")
+        since = self.client.get("/api/v1/notifications/").json()["since"]
+
+        # Committed after the first one was synced, with an older timestamp
+        self.notify(
+            [self.user],
+            description="Late",
+            timestamp=timezone.now() - timedelta(seconds=5),
+        )
+        self.notify([self.user], description="Second")
+        descriptions = []
+        url = "/api/v1/notifications/?page_size=1&since=%s" % since
+        while url:
+            data = self.client.get(url).json()
+            descriptions += [item["description"] for item in data["results"]]
+            url = data["next"]
+        self.assertEqual(descriptions, ["Late", "First", "Second"])
+
+    def test_list_invalid_cursor(self):
+        response = self.client.get("/api/v1/notifications/", {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+    def get_unread_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/notifications/unread-count/")
+        self.assertEqual(response.status_code, 200)
+        self.counted = any(
+            "notices_notification" in query["sql"] for query in queries.captured_queries
+        )
+        return response.json()
+
+    def test_unread_count(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notify([self.user, self.other_user], description="Hello")
+            self.notify([self.user], description="Careful", level="warning")
+        data = self.get_unread_count()
+        self.assertTrue(self.counted)
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["levels"]["info"], 1)
+        self.assertEqual(data["levels"]["warning"], 1)
+
+        # Served from the counters, kept up to date by every change
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notify([self.user], description="Again")
+        self.assertEqual(self.get_unread_count()["count"], 3)
+        self.assertFalse(self.counted)
+
+        notification = Notification.objects.filter(
+            recipient=self.user, level="warning"
+        ).get()
+        with self.captureOnCommitCallbacks(execute=True):
+            notification.mark_as_read()
+        data = self.get_unread_count()
+        self.assertFalse(self.counted)
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["levels"]["warning"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            notification.mark_as_unread()
+        self.assertEqual(self.get_unread_count()["count"], 3)
+
+        # The owner check compares the primary keys as loaded from the database
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete("/api/v1/notifications/%s/" % notification.pk)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_unread_count()["count"], 2)
+        self.assertFalse(self.counted)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get("/api/v1/notifications/mark-all-as-read/")
+        self.assertEqual(self.get_unread_count()["count"], 0)
+        self.assertFalse(self.counted)
+
+    def test_unread_counters_reconcile(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notify([self.user], description="Hello")
+        self.assertEqual(self.get_unread_count()["count"], 1)
+
+        # Changed behind the counters
+        QuerySet.update(Notification.objects.filter(recipient=self.user), unread=False)
+        self.assertEqual(self.get_unread_count()["count"], 1)
+
+        reconcile_unread_counters()
+        self.assertEqual(self.get_unread_count()["count"], 0)
+
+    def test_mark_as_read(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notify([self.user, self.other_user], description="Hello")
+        notification = Notification.objects.get(recipient=self.user)
+        self.assertEqual(self.get_unread_count()["count"], 1)
+
+        url = "/api/v1/notifications/%s/mark-as-read/" % notification.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        notification.refresh_from_db()
+        self.assertFalse(notification.unread)
+        self.assertEqual(self.get_unread_count()["count"], 0)
+        # Already read
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(
+                "/api/v1/notifications/%s/mark-as-unread/" % notification.pk
+            )
+        self.assertEqual(self.get_unread_count()["count"], 1)
+
+        other = Notification.objects.get(recipient=self.other_user)
+        response = self.client.get("/api/v1/notifications/%s/mark-as-read/" % other.pk)
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Notification.objects.get(pk=other.pk).unread)
+
+    def test_bulk_status(self):
+        other_application = Application.objects.create(
+            owner=self.user, name="Other", domain="http://localhost:8001"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(4):
+                self.notify([self.user], description="Notification %s" % i)
+            self.notify([self.user], description="Careful", level="warning")
+            bulk_notify.send(
+                sender=other_application,
+                actor=self.user,
+                verb="broadcast",
+                recipients=[self.user],
+                application=other_application,
+            )
+        feed = Notification.objects.filter(application=self.application)
+        ids = list(feed.order_by("id").values_list("id", flat=True))
+        self.assertEqual(self.get_unread_count()["count"], 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/v1/notifications/bulk/read/", {"ids": ids[:2]}, format="json"
+            )
+        self.assertEqual(response.json(), {"count": 2})
+        self.assertEqual(self.get_unread_count()["count"], 3)
+        self.assertFalse(self.counted)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/v1/notifications/bulk/read/",
+                {"level": "warning"},
+                format="json",
+            )
+        self.assertEqual(response.json(), {"count": 1})
+        self.assertEqual(self.get_unread_count()["levels"]["warning"], 0)
+
+        # Everything up to the newest notification of the feed
+        since = self.client.get("/api/v1/notifications/").json()["since"]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/v1/notifications/bulk/read/", {"before": since}, format="json"
+            )
+        self.assertEqual(response.json(), {"count": 2})
+        self.assertEqual(self.get_unread_count()["count"], 0)
+        self.assertTrue(Notification.objects.get(application=other_application).unread)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/v1/notifications/bulk/unread/", {"ids": ids}, format="json"
+            )
+        self.assertEqual(response.json(), {"count": 5})
+        self.assertEqual(self.get_unread_count()["count"], 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/v1/notifications/bulk/delete/", {"ids": ids[:3]}, format="json"
+            )
+        self.assertEqual(response.json(), {"count": 3})
+        self.assertEqual(self.get_unread_count()["count"], 2)
+        self.assertFalse(self.counted)
+        self.assertEqual(feed.count(), 2)
+
+    def test_concurrent_status_updates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                self.notify([self.user], description="Notification %s" % i)
+        self.assertEqual(self.get_unread_count()["count"], 3)
+        ids = list(Notification.objects.order_by("id").values_list("id", flat=True)[:2])
+        count_unread_changes = NotificationQuerySet.count_unread_changes
+
+        def race(queryset, **values):
+            # Another request reads the same rows in between
+            result = count_unread_changes(queryset, **values)
+            with mock.patch.object(
+                NotificationQuerySet, "count_unread_changes", count_unread_changes
+            ):
+                Notification.objects.filter(id__in=ids).update(**values)
+            return result
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch.object(NotificationQuerySet, "count_unread_changes", race):
+                updated = Notification.objects.filter(id__in=ids).update(unread=False)
+        self.assertEqual(updated, 0)
+        self.assertEqual(self.get_unread_count()["count"], 1)
+
+    def test_bulk_status_requires_selection(self):
+        response = self.client.post(
+            "/api/v1/notifications/bulk/read/", {}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/api/v1/notifications/bulk/read/", {"before": "invalid"}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_mark_all_as_read_scoped_to_application(self):
+        other_application = Application.objects.create(
+            owner=self.user, name="Other", domain="http://localhost:8001"
+        )
+        self.notify([self.user], description="Hello")
+        bulk_notify.send(
+            sender=other_application,
+            actor=self.user,
+            verb="broadcast",
+            recipients=[self.user],
+            application=other_application,
+        )
+        response = self.client.get("/api/v1/notifications/mark-all-as-read/")
+        self.assertEqual(response.json()["count"], 1)
+        self.assertFalse(Notification.objects.get(application=self.application).unread)
+        self.assertTrue(Notification.objects.get(application=other_application).unread)
+
+
+class ServerNotificationTestCase(TestCase):
+    def setUp(self) -> None:
+        celery_app.conf.task_always_eager = True
+        self.owner = User.objects.create_user(username="owner", password="test123")
+        self.users = [
+            User.objects.create_user(username="testuser%s" % i, password="test123")
+            for i in range(3)
+        ]
+        self.application = Application.objects.create(
+            owner=self.owner,
+            name="Application Test",
+            domain="http://localhost:8000",
+        )
+        api_key, key = APIKey.objects.create_key(name="Test API Key")
+        ApplicationKey.objects.create(application=self.application, key=api_key)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_X_APPLICATION=self.application.id,
+            HTTP_X_API_KEY=key,
+        )
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        celery_app.conf.task_always_eager = False
+        return super().tearDown()
+
+
+class TestServerNotificationSend(ServerNotificationTestCase):
+    def send(self, data):
+        return self.client.post(
+            "/api/v1/server/notifications/send/", data, format="json"
+        )
+
+    def test_send_single_spec(self):
+        ids = [str(user.id) for user in self.users]
+        response = self.send(
+            {
+                "platform": "FCM",
+                "recipients": ids + ids[:1],
+                "data": {"title": "some_title", "message": "some message"},
+            }
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["recipients"], 3)
+        self.assertTrue(response.json()["job"])
+
+        notifications = Notification.objects.filter(application=self.application)
+        self.assertEqual(
+            sorted(notifications.values_list("recipient_id", flat=True)), sorted(ids)
+        )
+        self.assertEqual(notifications[0].get_payload()["data"]["title"], "some_title")
+
+    def test_send_delivers_only_its_recipients(self):
+        data = {"platform": "FCM", "data": {"title": "Hi", "message": "Hello"}}
+        with mock.patch("notices.models.DELIVERY_OUTBOX", True):
+            self.send(dict(data, recipients=[str(self.users[0].id)]))
+            self.send(dict(data, recipients=[str(self.users[1].id)]))
+
+        first, second = NotificationOutbox.objects.order_by("pk")
+        self.assertEqual(first.content_id, second.content_id)
+        for entry, user in ((first, self.users[0]), (second, self.users[1])):
+            self.assertEqual(
+                list(entry.get_recipients().values_list("id", flat=True)),
+                [str(user.id)],
+            )
+
+    def test_send_many_specs(self):
+        response = self.send(
+            {
+                "notifications": [
+                    {"recipients": [str(self.users[0].id)], "verb": "first"},
+                    {"recipients": [str(self.users[1].id)], "verb": "second"},
+                ]
+            }
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            sorted(Notification.objects.values_list("verb", flat=True)),
+            ["first", "second"],
+        )
+
+    def test_idempotency_key_replays_response(self):
+        data = {"recipients": [str(user.id) for user in self.users]}
+        with mock.patch("notices.tasks.send_notifications.delay") as delay:
+            delay.return_value.id = "job-1"
+            first = self.client.post(
+                "/api/v1/server/notifications/send/",
+                data,
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="retry-1",
+            )
+            retry = self.client.post(
+                "/api/v1/server/notifications/send/",
+                data,
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="retry-1",
+            )
+        self.assertEqual(delay.call_count, 1)
+        self.assertEqual(retry.status_code, 202)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+
+    def test_idempotency_key_bound_to_body(self):
+        ids = [str(user.id) for user in self.users]
+        with mock.patch("notices.tasks.send_notifications.delay") as delay:
+            delay.return_value.id = "job-1"
+            first = self.client.post(
+                "/api/v1/server/notifications/send/",
+                {"recipients": ids},
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="retry-1",
+            )
+            other = self.client.post(
+                "/api/v1/server/notifications/send/",
+                {"recipients": ids[:1]},
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="retry-1",
+            )
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(other.status_code, 422)
+        self.assertEqual(delay.call_count, 1)
+
+    def test_idempotency_key_with_empty_body(self):
+        response = self.client.post(
+            "/api/v1/server/notifications/send/",
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY="empty-1",
+        )
+        # Validated as empty data, not rejected as malformed JSON
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("recipients", str(response.json()))
+        self.assertNotIn("detail", response.json())
+
+    def test_dedupe_key(self):
+        ids = [str(user.id) for user in self.users]
+        self.send({"recipients": ids[:2], "dedupe_key": "order-1"})
+        self.send({"recipients": ids, "dedupe_key": "order-1"})
+        self.assertEqual(
+            sorted(Notification.objects.values_list("recipient_id", flat=True)),
+            sorted(ids),
+        )
+
+    def test_invalid_recipients(self):
+        response = self.send({"recipients": ["ok", 12, ""]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_requires_api_key(self):
+        self.client.credentials(HTTP_X_APPLICATION=self.application.id)
+        response = self.send({"recipients": [str(self.users[0].id)]})
+        self.assertEqual(response.status_code, 403)
+
+
+class TestServerNotificationStream(ServerNotificationTestCase):
+    def stream(self, *lines):
+        body = "\n".join(
+            line if isinstance(line, str) else json.dumps(line) for line in lines
+        )
+        return self.client.post(
+            "/api/v1/server/notifications/stream/",
+            body,
+            content_type="application/x-ndjson",
+        )
+
+    def test_stream_reports_line_errors(self):
+        ids = [str(user.id) for user in self.users]
+        target = {"name": "Post", "description": "A post"}
+        response = self.stream(
+            {"recipient": ids[0], "verb": "liked", "target": target},
+            {"recipient": ids[1], "verb": "liked", "target": target},
+            "{not json",
+            "",
+            {"recipient": "unknown", "verb": "liked"},
+            {"recipient": ids[2], "target": {"name": "Post"}},
+            {"recipient": ids[2], "level": "success", "data": {"title": "Hi"}},
+        )
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result["accepted"], 3)
+        self.assertEqual(result["rejected"], 3)
+        self.assertEqual(sorted(error["line"] for error in result["errors"]), [3, 5, 6])
+        errors = {error["line"]: error["errors"] for error in result["errors"]}
+        self.assertIn("recipient", errors[5])
+        self.assertIn("target", errors[6])
+
+        notifications = Notification.objects.filter(application=self.application)
+        self.assertEqual(notifications.count(), 3)
+        # Identical payloads share their content
+        self.assertEqual(notifications.values("content").distinct().count(), 2)
+        liked = notifications.filter(verb="liked").first()
+        self.assertEqual(liked.get_payload()["target"], target)
+        self.assertEqual(liked.actor_object_id, str(self.owner.id))
+
+    def test_stream_writes_in_batches(self):
+        ids = [str(user.id) for user in self.users]
+        with mock.patch("notices.ingest.INGEST_BATCH_SIZE", 2):
+            response = self.stream(*({"recipient": pk} for pk in ids * 3))
+        self.assertEqual(response.json()["accepted"], 9)
+        self.assertEqual(Notification.objects.count(), 9)
+
+    def test_stream_queues_deliveries(self):
+        with mock.patch("notices.ingest.DELIVERY_OUTBOX", True):
+            self.stream(
+                {"recipient": str(self.users[0].id), "platform": "FCM"},
+                {"recipient": str(self.users[1].id), "platforms": ["FCM", "email"]},
+            )
+        self.assertEqual(
+            sorted(NotificationOutbox.objects.values_list("channel", flat=True)),
+            ["FCM", "email"],
+        )
+
+    def test_stream_delivers_only_its_recipients(self):
+        self.stream({"recipient": str(self.users[0].id), "verb": "liked"})
+        with mock.patch("notices.ingest.DELIVERY_OUTBOX", True):
+            self.stream({"recipient": str(self.users[1].id), "verb": "liked"})
+            self.stream(
+                {"recipient": str(self.users[2].id), "verb": "liked", "platform": "FCM"}
+            )
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual(entry.recipients, [str(self.users[2].id)])
+        self.assertEqual(
+            list(entry.get_recipients().values_list("id", flat=True)),
+            [str(self.users[2].id)],
+        )
+
+    def test_stream_dedupe_key(self):
+        line = {"recipient": str(self.users[0].id), "dedupe_key": "order-1"}
+        other = {"recipient": str(self.users[1].id)}
+        self.assertEqual(self.stream(line, line, other).json()["accepted"], 2)
+        self.assertEqual(self.stream(line).json()["accepted"], 0)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_stream_idempotency_key(self):
+        line = {"recipient": str(self.users[0].id)}
+        for _ in range(2):
+            response = self.client.post(
+                "/api/v1/server/notifications/stream/",
+                json.dumps(line),
+                content_type="application/x-ndjson",
+                HTTP_IDEMPOTENCY_KEY="stream-1",
+            )
+            self.assertEqual(response.json()["accepted"], 1)
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_stream_without_actor(self):
+        self.application.owner = None
+        self.application.save()
+        response = self.stream({"recipient": str(self.users[0].id)})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_stream_requires_api_key(self):
+        self.client.credentials(HTTP_X_APPLICATION=self.application.id)
+        response = self.stream({"recipient": str(self.users[0].id)})
+        self.assertEqual(response.status_code, 403)
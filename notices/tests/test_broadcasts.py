@@ -0,0 +1,243 @@
+import time
+from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.models import Application
+from notices.helpers import CHANNEL_TIMEOUTS
+from notices.models import Broadcast, Notification
+from server.celery import app as celery_app
+
+User = get_user_model()
+
+
+class BroadcastFixturesMixin:
+    def setUp(self) -> None:
+        self.admin = User.objects.create_user(
+            username="test_admin_user",
+            password="test123",
+            is_superuser=True,
+        )
+        self.application = Application.objects.create(
+            owner=self.admin,
+            name="Application Test",
+            domain="http://localhost:8000",
+        )
+        self.group1 = Group.objects.create(name="Group 1")
+        self.group2 = Group.objects.create(name="Group 2")
+
+        self.users = [
+            User.objects.create_user(username="testuser%s" % i, password="test123")
+            for i in range(5)
+        ]
+        self.inactive_user = User.objects.create_user(
+            username="inactive", password="test123", is_active=False
+        )
+
+        # users[0] is a direct recipient and member of both groups
+        self.users[0].groups.add(self.group1, self.group2)
+        self.users[1].groups.add(self.group1)
+        self.users[2].groups.add(self.group2)
+        self.inactive_user.groups.add(self.group1)
+
+        self.broadcast = Broadcast.objects.create(
+            title="Hello",
+            message="Hello World",
+            action_url="http://localhost:8000",
+            action_title="Open",
+            application=self.application,
+        )
+        self.broadcast.users.add(self.users[0], self.users[3])
+        self.broadcast.groups.add(self.group1, self.group2)
+        return super().setUp()
+
+    def expected_ids(self):
+        return sorted(str(user.id) for user in self.users[:4])
+
+
+class BroadcastTestCase(BroadcastFixturesMixin, TestCase):
+    pass
+
+
+class TestBroadcastRecipients(BroadcastTestCase):
+    def test_get_recipients_is_deduplicated(self):
+        recipient_ids = list(
+            self.broadcast.get_recipients().values_list("id", flat=True)
+        )
+        self.assertEqual(sorted(recipient_ids), self.expected_ids())
+
+    def test_iter_recipient_ids_chunks(self):
+        chunks = list(self.broadcast.iter_recipient_ids(chunk_size=3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 1])
+        self.assertEqual(sorted(sum(chunks, [])), self.expected_ids())
+
+    def test_iter_shards(self):
+        shards = list(self.broadcast.iter_shards(shard_size=3))
+        ids = self.expected_ids()
+        self.assertEqual(shards, [(ids[0], ids[2]), (ids[3], ids[3])])
+
+
+class TestBroadcastSend(BroadcastTestCase):
+    def setUp(self) -> None:
+        celery_app.conf.task_always_eager = True
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        celery_app.conf.task_always_eager = False
+        return super().tearDown()
+
+    def test_send_notification(self):
+        self.broadcast.send()
+        notifications = Notification.objects.filter(application=self.application)
+        self.assertEqual(
+            sorted(notifications.values_list("recipient_id", flat=True)),
+            self.expected_ids(),
+        )
+        self.broadcast.refresh_from_db()
+        self.assertEqual(self.broadcast.sent_counter, 1)
+        self.assertEqual(self.broadcast.last_recipients, 4)
+
+    def test_failing_shard_still_finishes(self):
+        with mock.patch.object(
+            Broadcast, "send_shard", side_effect=RuntimeError("db down")
+        ):
+            self.broadcast.send()
+
+        self.broadcast.refresh_from_db()
+        self.assertEqual(self.broadcast.sent_counter, 1)
+        self.assertEqual(self.broadcast.last_recipients, 0)
+        shard = self.broadcast.last_channels["shard"]
+        self.assertEqual(shard["shards"], {"failed": 1})
+        self.assertIn("db down", shard["errors"][0])
+
+    def test_send_shard(self):
+        ids = self.expected_ids()
+        sent = self.broadcast.send_shard(ids[0], ids[1])
+        self.assertEqual(sent["recipients"], 2)
+        self.assertEqual(sent["channels"]["notification"]["result"], 2)
+        self.assertEqual(
+            Notification.objects.filter(application=self.application).count(), 2
+        )
+
+
+class TestBroadcastChannels(BroadcastFixturesMixin, TransactionTestCase):
+    """The channels run in their own threads, so the data must be committed."""
+
+    def setUp(self) -> None:
+        celery_app.conf.task_always_eager = True
+        super().setUp()
+        self.broadcast.media = Broadcast.ALL_MEDIA
+        self.broadcast.save()
+
+    def tearDown(self) -> None:
+        celery_app.conf.task_always_eager = False
+        return super().tearDown()
+
+    def test_failing_channel_is_isolated(self):
+        with mock.patch.object(
+            Broadcast, "_send_email", side_effect=SMTPException("down")
+        ):
+            self.broadcast.send()
+
+        self.assertEqual(
+            Notification.objects.filter(application=self.application).count(), 4
+        )
+        self.broadcast.refresh_from_db()
+        channels = self.broadcast.last_channels
+        self.assertEqual(self.broadcast.last_recipients, 4)
+        self.assertEqual(channels["notification"]["shards"], {"done": 1})
+        self.assertEqual(channels["notification"]["result"], 4)
+        self.assertEqual(channels["push"]["shards"], {"done": 1})
+        self.assertEqual(channels["email"]["shards"], {"failed": 1})
+        self.assertIn("down", channels["email"]["errors"][0])
+
+    def test_slow_channel_times_out(self):
+        def slow_email(*args):
+            time.sleep(1)
+
+        with mock.patch.object(Broadcast, "_send_email", slow_email):
+            with mock.patch.dict(CHANNEL_TIMEOUTS, {"email": 0.1}):
+                result = self.broadcast.send_shard(*self.expected_ids()[::3])
+        self.assertEqual(result["channels"]["email"], {"status": "timeout"})
+        self.assertEqual(result["channels"]["notification"]["status"], "done")
+
+
+class TestBroadcastOnRead(BroadcastTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.broadcast.delivery = Broadcast.FANOUT_ON_READ
+        self.broadcast.save()
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_APPLICATION=self.application.id)
+
+    def get_feed(self, user):
+        # reload the user, primary keys are strings once read from the database
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+        response = self.client.get("/api/v1/notifications/")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_send_does_not_fan_out(self):
+        self.assertIsNone(self.broadcast.send(actor=self.admin))
+        self.assertFalse(Notification.objects.exists())
+        self.broadcast.refresh_from_db()
+        self.assertEqual(self.broadcast.sent_counter, 1)
+        self.assertIsNotNone(self.broadcast.content)
+
+    def test_feed_materializes_once(self):
+        self.broadcast.send(actor=self.admin)
+
+        feed = self.get_feed(self.users[1])
+        self.assertEqual(len(feed), 1)
+        self.assertEqual(feed[0]["verb"], "broadcast")
+        self.assertEqual(feed[0]["data"]["title"], "Hello")
+
+        self.get_feed(self.users[1])
+        self.assertEqual(Notification.objects.count(), 1)
+
+        # Only users of the audience get it
+        self.assertEqual(self.get_feed(self.users[4]), [])
+        self.assertEqual(self.get_feed(self.admin), [])
+
+    def test_deleted_stays_deleted(self):
+        self.broadcast.send(actor=self.admin)
+        feed = self.get_feed(self.users[0])
+        response = self.client.delete("/api/v1/notifications/%s/" % feed[0]["id"])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_feed(self.users[0]), [])
+        self.assertTrue(Notification.objects.get().deleted)
+
+    def test_late_recipient_reaches_since_poll(self):
+        self.broadcast.send(actor=self.admin)
+        Broadcast.objects.filter(pk=self.broadcast.pk).update(
+            last_sent_at=timezone.now() - timedelta(hours=1)
+        )
+        user = User.objects.get(pk=self.users[4].pk)
+        Notification.objects.create(
+            recipient=user, actor=self.admin, verb="hello", application=self.application
+        )
+        self.client.force_authenticate(user)
+        since = self.client.get("/api/v1/notifications/").json()["since"]
+
+        # Targeted after the publication, the row is newer than the cursor
+        user.groups.add(self.group1)
+        response = self.client.get("/api/v1/notifications/", {"since": since})
+        self.assertIn(
+            "broadcast",
+            [notification["verb"] for notification in response.json()["results"]],
+        )
+
+    def test_republish_reaches_feed_again(self):
+        self.broadcast.send(actor=self.admin)
+        self.assertEqual(len(self.get_feed(self.users[1])), 1)
+
+        self.broadcast.refresh_from_db()
+        self.broadcast.send(actor=self.admin)
+        self.assertEqual(len(self.get_feed(self.users[1])), 2)
+        self.assertEqual(len(self.get_feed(self.users[1])), 2)
+        self.assertEqual(Notification.objects.count(), 2)
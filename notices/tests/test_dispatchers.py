@@ -0,0 +1,395 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from smtplib import SMTPServerDisconnected
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.test import TestCase
+from push_notifications.conf import AppConfig
+from push_notifications.models import (
+    APNSDevice,
+    GCMDevice,
+    WebPushDevice,
+    WNSDevice,
+)
+from apps.models import Application
+from notices.dispatchers import (
+    APNSDispatcher,
+    EmailDispatcher,
+    FCMDispatcher,
+    WebPushDispatcher,
+    WNSDispatcher,
+)
+from notices.fields import DeliveryField
+from notices.models import Notification, NotificationPreference
+from notices.signals import apns_push_notify, bulk_notify
+
+User = get_user_model()
+
+
+class FakePushHandler(BaseHTTPRequestHandler):
+    """
+    Answer like the FCM legacy and WNS endpoints, tokens starting with bad
+    are unknown.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.end_headers()
+            return
+        if self.path == "/wns/token":
+            return self.send_json({"access_token": "wns-token"})
+        if self.path.startswith("/wns/"):
+            self.server.requests.append(self.path)
+            assert self.headers["Authorization"] == "Bearer wns-token"
+            self.send_response(410 if self.path.startswith("/wns/bad") else 200)
+            self.end_headers()
+            return
+
+        body = json.loads(body)
+        self.server.requests.append(body)
+        results = [
+            (
+                {"error": "NotRegistered"}
+                if token.startswith("bad")
+                else {"message_id": "0:%s" % token}
+            )
+            for token in body["registration_ids"]
+        ]
+        self.send_json({"results": results})
+
+    def send_json(self, data):
+        response = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PushDispatcherTestCase(TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakePushHandler)
+        self.server.requests = []
+        self.server.status = 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.admin = User.objects.create_user(
+            username="test_admin_user", password="test123", is_superuser=True
+        )
+        self.application = Application.objects.create(
+            owner=self.admin, name="Application Test", domain="http://localhost:8000"
+        )
+        self.users = [
+            User.objects.create_user(username="testuser%s" % i, password="test123")
+            for i in range(5)
+        ]
+        self.url = "http://127.0.0.1:%s" % self.server.server_port
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        return super().tearDown()
+
+    def get_manager(self, **config):
+        return AppConfig({"APPLICATIONS": {str(self.application.id): config}})
+
+
+class TestFCMDispatcher(PushDispatcherTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for i, user in enumerate(self.users):
+            GCMDevice.objects.create(
+                user=user,
+                registration_id=("bad-%s" if i == 0 else "token-%s") % i,
+                cloud_message_type="FCM",
+                application_id=self.application.id,
+            )
+        self.manager = self.get_manager(
+            PLATFORM="FCM",
+            API_KEY="test-key",
+            POST_URL=self.url + "/fcm/send",
+            MAX_RECIPIENTS=2,
+        )
+
+    def dispatch(self, content=None):
+        dispatcher = FCMDispatcher(self.application.id, manager=self.manager)
+        return dispatcher.dispatch(
+            User.objects.filter(is_superuser=False),
+            title="Hello",
+            message="Hello World",
+            data={"type": "broadcast"},
+            content=content,
+        )
+
+    def test_dispatch_batches(self):
+        bulk_notify.send(
+            self.admin,
+            actor=self.admin,
+            verb="broadcast",
+            recipients=self.users,
+            application=self.application,
+        )
+        content = Notification.objects.first().content
+
+        result = self.dispatch(content)
+        self.assertEqual(result, {"sent": 4, "failed": 0, "invalid": 1})
+        self.assertEqual(
+            sorted(len(body["registration_ids"]) for body in self.server.requests),
+            [1, 2, 2],
+        )
+        self.assertEqual(self.server.requests[0]["notification"]["title"], "Hello")
+
+        # Unknown tokens are deactivated, delivered notifications are flagged
+        self.assertFalse(GCMDevice.objects.get(registration_id="bad-0").active)
+        self.assertEqual(GCMDevice.objects.filter(active=True).count(), 4)
+        notified = Notification.objects.filter(delivered__has=DeliveryField.GCM)
+        self.assertEqual(
+            sorted(notified.values_list("recipient_id", flat=True)),
+            sorted(str(user.id) for user in self.users[1:]),
+        )
+
+    def test_dispatch_targets_gcm_devices(self):
+        GCMDevice.objects.create(
+            user=self.users[1],
+            registration_id="token-gcm",
+            cloud_message_type="GCM",
+            application_id=self.application.id,
+        )
+        result = self.dispatch()
+        self.assertEqual(result, {"sent": 5, "failed": 0, "invalid": 1})
+        tokens = sum((body["registration_ids"] for body in self.server.requests), [])
+        self.assertEqual(
+            sorted(tokens),
+            ["bad-0", "token-1", "token-2", "token-3", "token-4", "token-gcm"],
+        )
+
+    def test_dispatch_failure(self):
+        self.server.status = 500
+        result = self.dispatch()
+        self.assertEqual(result, {"sent": 0, "failed": 5, "invalid": 0})
+        self.assertEqual(GCMDevice.objects.filter(active=True).count(), 5)
+
+
+class TestWNSDispatcher(PushDispatcherTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for i, user in enumerate(self.users[:3]):
+            WNSDevice.objects.create(
+                user=user,
+                registration_id="%s/wns/%s-%s"
+                % (self.url, "bad" if i == 0 else "token", i),
+                application_id=self.application.id,
+            )
+        self.manager = self.get_manager(
+            PLATFORM="WNS", PACKAGE_SECURITY_ID="package", SECRET_KEY="secret"
+        )
+
+    def test_dispatch(self):
+        dispatcher = WNSDispatcher(self.application.id, manager=self.manager)
+        dispatcher.access_url = self.url + "/wns/token"
+        result = dispatcher.dispatch(self.users, title="Hello", message="World")
+        self.assertEqual(result, {"sent": 2, "failed": 0, "invalid": 1})
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(WNSDevice.objects.filter(active=True).count(), 2)
+
+    def test_authentication_failure(self):
+        self.server.status = 500
+        dispatcher = WNSDispatcher(self.application.id, manager=self.manager)
+        dispatcher.access_url = self.url + "/wns/token"
+        result = dispatcher.dispatch(self.users, title="Hello", message="World")
+        self.assertEqual(result, {"sent": 0, "failed": 3, "invalid": 0})
+
+
+class TestAPNSDispatcher(PushDispatcherTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for i, user in enumerate(self.users[:3]):
+            APNSDevice.objects.create(
+                user=user,
+                registration_id=("bad-%s" if i == 0 else "token-%s") % i,
+                application_id=self.application.id,
+            )
+        # Answers like apns2 through push_notifications.apns
+        self.apns = mock.Mock()
+        self.apns._apns_send.side_effect = lambda tokens, alert, **kwargs: {
+            token: "Unregistered" if token.startswith("bad") else "Success"
+            for token in tokens
+        }
+
+    def test_dispatch(self):
+        bulk_notify.send(
+            self.admin,
+            actor=self.admin,
+            verb="broadcast",
+            recipients=self.users,
+            application=self.application,
+        )
+        content = Notification.objects.first().content
+        with mock.patch.dict(sys.modules, {"push_notifications.apns": self.apns}):
+            dispatcher = APNSDispatcher(self.application.id, manager=mock.Mock())
+        result = dispatcher.dispatch(
+            self.users, title="Hello", message="World", content=content
+        )
+        self.assertEqual(result, {"sent": 2, "failed": 0, "invalid": 1})
+        _, kwargs = self.apns._apns_send.call_args
+        self.assertEqual(kwargs["application_id"], str(self.application.id))
+        self.assertFalse(APNSDevice.objects.get(registration_id="bad-0").active)
+        notified = Notification.objects.filter(delivered__has=DeliveryField.APNS)
+        self.assertEqual(
+            sorted(notified.values_list("recipient_id", flat=True)),
+            sorted(str(user.id) for user in self.users[1:3]),
+        )
+
+    def test_dispatch_failure(self):
+        self.apns._apns_send.side_effect = ConnectionError("down")
+        with mock.patch.dict(sys.modules, {"push_notifications.apns": self.apns}):
+            dispatcher = APNSDispatcher(self.application.id, manager=mock.Mock())
+        result = dispatcher.dispatch(self.users, title="Hello", message="World")
+        self.assertEqual(result, {"sent": 0, "failed": 3, "invalid": 0})
+
+
+class FakeWebPushException(Exception):
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+class TestWebPushDispatcher(PushDispatcherTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for i, user in enumerate(self.users[:3]):
+            WebPushDevice.objects.create(
+                user=user,
+                registration_id=("bad-%s" if i == 0 else "token-%s") % i,
+                browser="CHROME",
+                auth="auth",
+                p256dh="p256dh",
+                application_id=self.application.id,
+            )
+        self.manager = mock.Mock()
+        self.manager.get_wp_post_url.return_value = "https://push.example.com"
+        self.manager.get_wp_claims.return_value = {"sub": "mailto:admin@example.com"}
+        # Answers like pywebpush, unknown subscriptions are gone
+        self.pywebpush = mock.Mock(WebPushException=FakeWebPushException)
+        self.pywebpush.webpush.side_effect = self.webpush
+
+    def webpush(self, subscription_info, **kwargs):
+        if "/bad-" in subscription_info["endpoint"]:
+            raise FakeWebPushException("Gone", response=mock.Mock(status_code=410))
+        if "/token-2" in subscription_info["endpoint"]:
+            raise FakeWebPushException("Server error")
+
+    def test_dispatch(self):
+        with mock.patch.dict(sys.modules, {"pywebpush": self.pywebpush}):
+            dispatcher = WebPushDispatcher(self.application.id, manager=self.manager)
+        result = dispatcher.dispatch(self.users, title="Hello", message="World")
+        self.assertEqual(result, {"sent": 1, "failed": 1, "invalid": 1})
+        _, kwargs = self.pywebpush.webpush.call_args
+        self.assertEqual(json.loads(kwargs["data"])["title"], "Hello")
+        self.assertEqual(
+            kwargs["subscription_info"]["keys"], {"auth": "auth", "p256dh": "p256dh"}
+        )
+        self.assertFalse(WebPushDevice.objects.get(registration_id="bad-0").active)
+        self.assertEqual(WebPushDevice.objects.filter(active=True).count(), 2)
+
+    def test_unexpected_error_fails_the_device(self):
+        def webpush(subscription_info, **kwargs):
+            if "/token-1" in subscription_info["endpoint"]:
+                raise ValueError("Could not deserialize key data")
+            return self.webpush(subscription_info, **kwargs)
+
+        self.pywebpush.webpush.side_effect = webpush
+        with mock.patch.dict(sys.modules, {"pywebpush": self.pywebpush}):
+            dispatcher = WebPushDispatcher(self.application.id, manager=self.manager)
+        result = dispatcher.dispatch(self.users, title="Hello", message="World")
+        self.assertEqual(result, {"sent": 0, "failed": 2, "invalid": 1})
+        self.assertFalse(WebPushDevice.objects.get(registration_id="bad-0").active)
+
+
+class TestPushNotificationHandler(PushDispatcherTestCase):
+    def test_unconfigured_platform_is_skipped(self):
+        # The application is only configured for Firebase in the settings
+        result = apns_push_notify.send(
+            self.admin,
+            recipients=self.users,
+            title="Hello",
+            message="World",
+            application=self.application,
+        )
+        self.assertEqual(result[0][1], {})
+
+
+class TestEmailDispatcher(TestCase):
+    def setUp(self) -> None:
+        self.admin = User.objects.create_user(
+            username="test_admin_user", password="test123", is_superuser=True
+        )
+        self.application = Application.objects.create(
+            owner=self.admin, name="Application Test", domain="http://localhost:8000"
+        )
+        self.users = [
+            User.objects.create_user(
+                username="testuser%s" % i,
+                password="test123",
+                email="testuser%s@example.com" % i,
+                first_name="User%s" % i,
+            )
+            for i in range(5)
+        ]
+        NotificationPreference.objects.create(user=self.users[4], email=False)
+        return super().setUp()
+
+    def get_dispatcher(self):
+        return EmailDispatcher(
+            subject="Hello",
+            template_name="notices/email_broadcast.txt",
+            context={"title": "Hello", "message": "Hello World"},
+            application_id=self.application.id,
+            max_workers=2,
+            batch_size=2,
+        )
+
+    def test_dispatch(self):
+        bulk_notify.send(
+            self.admin,
+            actor=self.admin,
+            verb="broadcast",
+            recipients=self.users,
+            application=self.application,
+        )
+        content = Notification.objects.first().content
+
+        result = self.get_dispatcher().dispatch(self.users, content=content)
+        self.assertEqual(result, {"sent": 4, "failed": 0, "invalid": 0})
+
+        # One personalized message per recipient, opted out users are skipped
+        self.assertEqual(
+            sorted(message.to for message in mail.outbox),
+            [["testuser%s@example.com" % i] for i in range(4)],
+        )
+        message = next(m for m in mail.outbox if m.to == ["testuser1@example.com"])
+        self.assertTrue(message.body.startswith("Hi User1,"))
+
+        notified = Notification.objects.filter(delivered__has=DeliveryField.EMAIL)
+        self.assertEqual(
+            sorted(notified.values_list("recipient_id", flat=True)),
+            sorted(str(user.id) for user in self.users[:4]),
+        )
+
+    def test_dispatch_failure(self):
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=SMTPServerDisconnected("down"),
+        ):
+            result = self.get_dispatcher().dispatch(self.users)
+        self.assertEqual(result, {"sent": 0, "failed": 4, "invalid": 0})
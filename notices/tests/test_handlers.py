@@ -0,0 +1,165 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from apps.models import Application
+from notices.fields import DeliveryField
+from notices.helpers import _copy_prefix, _fanout_columns
+from notices.models import (
+    Notification,
+    NotificationContent,
+    NotificationPreference,
+)
+from notices.signals import bulk_notify
+
+User = get_user_model()
+
+NOTIFICATION_INSERT = 'INSERT INTO "notices_notification"'
+USER_SELECT = 'SELECT "auths_user"'
+
+
+class TestBulkNotificationHandler(TestCase):
+    def setUp(self) -> None:
+        self.actor = User.objects.create_user(username="actor", password="test123")
+        self.users = [
+            User.objects.create_user(username="testuser%s" % i, password="test123")
+            for i in range(5)
+        ]
+        self.application = Application.objects.create(
+            owner=self.actor,
+            name="Application Test",
+            domain="http://localhost:8000",
+        )
+        return super().setUp()
+
+    def test_bulk_notify_in_batches(self):
+        responses = bulk_notify.send(
+            sender=self.application,
+            actor=self.actor,
+            verb="mentioned",
+            recipients=self.users,
+            application=self.application,
+            description="Hello",
+            target={"name": "Post", "description": "A post"},
+            batch_size=2,
+            title="Hello",
+        )
+        self.assertEqual(responses[0][1], 5)
+
+        notifications = Notification.objects.filter(application=self.application)
+        self.assertEqual(
+            sorted(notifications.values_list("recipient_id", flat=True)),
+            sorted(str(user.id) for user in self.users),
+        )
+        notification = notifications.first()
+        self.assertEqual(notification.verb, "mentioned")
+        self.assertEqual(notification.level, Notification.INFO)
+        self.assertEqual(
+            notification.actor_content_type, ContentType.objects.get_for_model(User)
+        )
+        self.assertEqual(notification.actor_object_id, str(self.actor.pk))
+        self.assertIsNone(notification.data)
+        payload = notification.get_payload()
+        self.assertEqual(payload["target"]["name"], "Post")
+        self.assertEqual(payload["data"], {"title": "Hello"})
+        self.assertEqual(
+            NotificationContent.objects.count(), 1, "payload is stored only once"
+        )
+        self.assertTrue(notification.unread)
+        self.assertFalse(notification.deleted)
+
+    def test_level_and_delivery_status(self):
+        bulk_notify.send(
+            sender=self.application,
+            actor=self.actor,
+            verb="mentioned",
+            recipients=self.users[:2],
+            application=self.application,
+            level=Notification.WARNING,
+        )
+        notifications = Notification.objects.filter(application=self.application)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT DISTINCT "level" FROM "notices_notification"')
+            self.assertEqual(cursor.fetchall(), [(3,)])
+        self.assertEqual(notifications.filter(level=Notification.WARNING).count(), 2)
+        self.assertEqual(notifications.first().level, Notification.WARNING)
+
+        notifications.filter(recipient=self.users[0]).update(
+            delivered=F("delivered").bitor(DeliveryField.GCM)
+        )
+        notifications.update(delivered=F("delivered").bitor(DeliveryField.EMAIL))
+        delivered = notifications.get(recipient=self.users[0])
+        self.assertTrue(delivered.notified_gcm)
+        self.assertTrue(delivered.notified_email)
+        self.assertFalse(delivered.notified_apns)
+        self.assertEqual(
+            notifications.filter(delivered__has=DeliveryField.GCM).count(), 1
+        )
+        self.assertEqual(
+            notifications.filter(delivered__lacks=DeliveryField.GCM).count(), 1
+        )
+
+    def test_copy_prefix_prepares_values(self):
+        # COPY only runs on PostgreSQL, its rendering is checked on its own
+        key_field, fields, constants = _fanout_columns(
+            Notification,
+            {"application": self.application, "level": Notification.WARNING},
+            "recipient",
+        )
+        columns = dict(zip(fields, _copy_prefix(fields, constants).split("\t")))
+        self.assertEqual(columns[Notification._meta.get_field("level")], "3")
+        self.assertEqual(
+            columns[Notification._meta.get_field("application")],
+            str(self.application.pk),
+        )
+
+    def test_bulk_notify_single_recipient(self):
+        bulk_notify.send(
+            sender=self.application,
+            actor=self.actor,
+            verb="mentioned",
+            recipients=self.users[0],
+            application=self.application,
+        )
+        notification = Notification.objects.get(application=self.application)
+        self.assertEqual(notification.recipient_id, str(self.users[0].pk))
+        self.assertIsNone(notification.get_payload()["data"])
+
+    def test_bulk_notify_group_insert_select(self):
+        group = Group.objects.create(name="Group")
+        for user in self.users:
+            user.groups.add(group)
+        self.users[0].is_active = False
+        self.users[0].save()
+        NotificationPreference.objects.create(
+            user=self.users[1], push_notification=False
+        )
+        NotificationPreference.objects.create(user=self.users[2])
+
+        with CaptureQueriesContext(connection) as queries:
+            responses = bulk_notify.send(
+                sender=self.application,
+                actor=self.actor,
+                verb="mentioned",
+                recipients=group,
+                application=self.application,
+                title="Hello",
+            )
+        self.assertEqual(responses[0][1], 3)
+        statements = [query["sql"] for query in queries.captured_queries]
+        self.assertEqual(
+            len([sql for sql in statements if sql.startswith(NOTIFICATION_INSERT)]),
+            1,
+        )
+        self.assertFalse([sql for sql in statements if sql.startswith(USER_SELECT)])
+        notifications = Notification.objects.filter(application=self.application)
+        self.assertEqual(
+            sorted(notifications.values_list("recipient_id", flat=True)),
+            sorted(str(user.id) for user in self.users[2:]),
+        )
+        self.assertEqual(
+            notifications.first().get_payload()["data"], {"title": "Hello"}
+        )
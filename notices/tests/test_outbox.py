@@ -0,0 +1,132 @@
+from smtplib import SMTPException
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
+from notices.fields import DeliveryField
+from notices.helpers import OUTBOX_MAX_ATTEMPTS
+from notices.models import Broadcast, Notification, NotificationOutbox
+from notices.tests.test_broadcasts import BroadcastFixturesMixin
+
+
+@mock.patch("notices.models.DELIVERY_OUTBOX", True)
+class TestNotificationOutbox(BroadcastFixturesMixin, TransactionTestCase):
+    """The worker delivers from its own threads, so the data must be committed."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        for i, user in enumerate(self.users):
+            user.email = "testuser%s@example.com" % i
+            user.save()
+        self.broadcast.media = Broadcast.ALL_MEDIA
+        self.broadcast.save()
+
+    def run_worker(self):
+        # SQLite does not handle concurrent writers, deliver one at a time
+        call_command(
+            "notices_outbox_worker", once=True, concurrency=1, stdout=mock.Mock()
+        )
+
+    def send_shard(self):
+        ids = self.expected_ids()
+        return self.broadcast.send_shard(ids[0], ids[-1])
+
+    def test_send_shard_queues_deliveries(self):
+        result = self.send_shard()
+        self.assertEqual(result["recipients"], 4)
+        self.assertEqual(result["channels"]["notification"]["result"], 4)
+        self.assertEqual(result["channels"]["push"], {"status": "queued"})
+        self.assertEqual(result["channels"]["email"], {"status": "queued"})
+
+        self.assertEqual(Notification.objects.count(), 4)
+        self.assertEqual(
+            sorted(NotificationOutbox.objects.values_list("channel", flat=True)),
+            ["APNS", "FCM", "WNS", "WP", "email"],
+        )
+        self.assertEqual(mail.outbox, [])
+
+    def test_worker_drains_outbox(self):
+        self.send_shard()
+        self.run_worker()
+
+        statuses = NotificationOutbox.objects.values_list("status", flat=True)
+        self.assertEqual(set(statuses), {NotificationOutbox.DONE})
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(
+            Notification.objects.filter(delivered__has=DeliveryField.EMAIL).count(), 4
+        )
+
+        # A retried entry only delivers to the recipients not notified yet
+        entry = NotificationOutbox.objects.get(channel=NotificationOutbox.EMAIL)
+        self.assertFalse(entry.get_recipients().exists())
+
+    def test_failed_delivery_is_retried(self):
+        self.send_shard()
+        with mock.patch.object(
+            NotificationOutbox, "deliver", side_effect=RuntimeError("down")
+        ):
+            self.run_worker()
+
+        for entry in NotificationOutbox.objects.all():
+            self.assertEqual(entry.status, NotificationOutbox.PENDING)
+            self.assertEqual(entry.attempts, 1)
+            self.assertIn("down", entry.last_error)
+        # Not available again before the retry delay
+        self.assertEqual(NotificationOutbox.claim(10), [])
+
+    def test_failed_deliveries_are_retried(self):
+        self.send_shard()
+        with mock.patch.object(
+            NotificationOutbox, "deliver", return_value={"sent": 3, "failed": 1}
+        ):
+            self.run_worker()
+
+        for entry in NotificationOutbox.objects.all():
+            self.assertEqual(entry.status, NotificationOutbox.PENDING)
+            self.assertEqual(entry.result, {"sent": 3, "failed": 1})
+            self.assertIn("1 deliveries failed", entry.last_error)
+
+        entry = NotificationOutbox.objects.first()
+        entry.attempts = OUTBOX_MAX_ATTEMPTS
+        with mock.patch.object(
+            NotificationOutbox, "deliver", return_value={"sent": 0, "failed": 1}
+        ):
+            self.assertEqual(entry.process(), NotificationOutbox.FAILED)
+
+    def test_failed_email_retries_only_its_recipient(self):
+        self.broadcast.media = Broadcast.EMAIL
+        self.broadcast.save()
+        failing = self.users[1].email
+        send_messages = locmem.EmailBackend.send_messages
+
+        def flaky_send_messages(backend, messages):
+            if messages[0].to == [failing]:
+                raise SMTPException("busy")
+            return send_messages(backend, messages)
+
+        self.send_shard()
+        with mock.patch.object(
+            locmem.EmailBackend, "send_messages", flaky_send_messages
+        ):
+            self.run_worker()
+
+        entry = NotificationOutbox.objects.get()
+        self.assertIsNone(entry.content_id)
+        self.assertEqual(entry.status, NotificationOutbox.PENDING)
+        self.assertEqual(entry.result["failed"], 1)
+        self.assertEqual(len(entry.delivered_ids), 3)
+        self.assertEqual(len(mail.outbox), 3)
+
+        entry.available_at = timezone.now()
+        entry.save(update_fields=["available_at"])
+        self.run_worker()
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, NotificationOutbox.DONE)
+        self.assertEqual(len(entry.delivered_ids), 4)
+        # Only the recipient that failed is emailed again
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(mail.outbox[-1].to, [failing])
@@ -0,0 +1,78 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from apps.models import Application
+from notices.fields import DeliveryField
+from notices.models import Broadcast, Notification, NotificationContent
+from notices.signals import bulk_notify
+
+User = get_user_model()
+
+
+@skipUnless(connection.vendor == "sqlite", "Plans are checked on SQLite")
+class TestNotificationQueryPlans(TestCase):
+    """The hot notification queries must be answered by their indexes."""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="testuser1", password="test123")
+        self.application = Application.objects.create(
+            owner=self.user,
+            name="Application Test",
+            domain="http://localhost:8000",
+        )
+        bulk_notify.send(
+            sender=self.application,
+            actor=self.user,
+            verb="broadcast",
+            recipients=[self.user],
+            application=self.application,
+            description="Hello",
+        )
+        return super().setUp()
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn("USE TEMP B-TREE", plan)
+
+    def test_feed_query(self):
+        queryset = Notification.objects.filter(
+            recipient=self.user, application=self.application, deleted=False
+        ).order_by("-timestamp", "-id")[:51]
+        self.assertUsesIndex(queryset, "notices_feed_idx")
+
+    def test_unread_query(self):
+        queryset = Notification.objects.filter(
+            recipient=self.user, application=self.application, unread=True
+        ).order_by()
+        self.assertUsesIndex(queryset, "notices_unread_idx")
+
+    def test_pending_delivery_query(self):
+        content = NotificationContent.objects.get()
+        queryset = (
+            Notification.objects.filter(
+                content=content,
+                application=self.application,
+                delivered__lacks=DeliveryField.EMAIL,
+            )
+            .values("recipient_id")
+            .order_by()
+        )
+        self.assertUsesIndex(queryset, "notices_delivery_idx")
+
+    def test_delivered_broadcasts_query(self):
+        broadcast = Broadcast.objects.create(
+            application=self.application, action_url="http://localhost:8000"
+        )
+        queryset = Notification.objects.filter(
+            recipient=self.user,
+            broadcast=broadcast,
+            broadcast_sent_at=broadcast.last_sent_at,
+        ).order_by()
+        self.assertUsesIndex(queryset, "unique_broadcast_delivery")
+
+    def test_recipient_cascade_query(self):
+        queryset = Notification.objects.filter(recipient__in=[self.user]).order_by()
+        self.assertUsesIndex(queryset, "notices_notification_recipient_id")
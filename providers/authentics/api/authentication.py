@@ -1,30 +1,83 @@
-# from pprint import pprint
+import hashlib
+import time
+
+import jwt
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.utils.translation import gettext_lazy as _
-from requests.exceptions import JSONDecodeError
-from rest_framework.authentication import BaseAuthentication
+from requests.exceptions import JSONDecodeError, RequestException
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
 
 from ..clients import authentics, TOKEN_PREFIX
-from .exceptions import AuthenticationFailed
+from .exceptions import AuthenticationFailed, AuthenticsUnavailable
+
+TOKEN_CACHE_TTL = getattr(settings, "AUTHENTICS_TOKEN_CACHE_TTL", 300)
+
+PROFILE_FIELDS = ("username", "email", "first_name", "last_name")
+
+
+def get_token_cache_key(access_token):
+    digest = hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+    return "authentics:token:%s" % digest
+
+
+def get_token_ttl(access_token):
+    """
+    Return how long the identity of ``access_token`` may be cached, never
+    past the ``exp`` claim when the token is a JWT.
+    """
+    try:
+        claims = jwt.decode(access_token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        return TOKEN_CACHE_TTL
+    if "exp" not in claims:
+        return TOKEN_CACHE_TTL
+    return min(TOKEN_CACHE_TTL, int(claims["exp"] - time.time()))
 
 
 class AuthenticsOauth(BaseAuthentication):
-    keyword = "Bearer"
+    keyword = TOKEN_PREFIX
 
     def authenticate(self, request):
-        # check authorization header and extract auth token
-        auth_header = request.META.get("HTTP_AUTHORIZATION")
-
-        if not auth_header:
-            msg = _("No authorization header provided.")
+        # Only the tokens of our scheme are sent to Authentics
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
             return None
 
-        access_token = auth_header.split(sep=" ").pop()
-        if access_token in ["", None]:
+        if len(auth) != 2:
             msg = _("Authorization token is not provided.")
-            return None
+            raise AuthenticationFailed(msg)
 
-        resp_identity = authentics.get_user_profile(access_token)
+        try:
+            access_token = auth[1].decode()
+        except UnicodeError:
+            msg = _("Invalid token header.")
+            raise AuthenticationFailed(msg)
+
+        user = self.get_user(self.get_identity(access_token))
+        if not user.is_active:
+            msg = _("Your user is not activated or blocked.")
+            raise AuthenticationFailed(msg)
+        return (user, None)
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+    def get_identity(self, access_token):
+        """
+        Return the profile fields of the owner of ``access_token``, from the
+        cache when the token was seen recently.
+        """
+        cache_key = get_token_cache_key(access_token)
+        identity = cache.get(cache_key)
+        if identity is not None:
+            return identity
+
+        try:
+            resp_identity = authentics.get_user_profile(access_token)
+        except RequestException:
+            raise AuthenticsUnavailable()
         if resp_identity.status_code not in [200, 201]:
             try:
                 resp_json = resp_identity.json()
@@ -35,28 +88,28 @@ class AuthenticsOauth(BaseAuthentication):
                 raise AuthenticationFailed(msg)
 
         resp_json = resp_identity.json()
-        user_data = {
-            "id": resp_json["id"],
-            "username": resp_json["username"],
-            "email": resp_json["email"],
-            "first_name": resp_json["first_name"],
-            "last_name": resp_json["last_name"],
-        }
-
-        # Get or create user
+        identity = {"id": resp_json["id"]}
+        identity.update({field: resp_json[field] for field in PROFILE_FIELDS})
+
+        ttl = get_token_ttl(access_token)
+        if ttl > 0:
+            cache.set(cache_key, identity, ttl)
+        return identity
+
+    def get_user(self, identity):
+        """Return the user of ``identity``, only writing the changed fields."""
+        user_data = dict(identity)
         user, created = get_user_model().objects.get_or_create(
-            id=resp_json["id"], defaults=user_data
+            id=user_data.pop("id"), defaults=user_data
         )
-
         if not created:
-            user_data.pop("id")
-            for k, v in user_data.items():
-                setattr(user, k, v)
-            user.save()
-            return (user, None)
-        else:
-            if user.is_active:
-                return (user, None)
-            else:
-                msg = _("Your user is not activated or blocked.")
-                raise AuthenticationFailed(msg)
+            changed = [
+                field
+                for field, value in user_data.items()
+                if getattr(user, field) != value
+            ]
+            if changed:
+                for field in changed:
+                    setattr(user, field, user_data[field])
+                user.save(update_fields=changed)
+        return user
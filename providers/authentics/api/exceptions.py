@@ -18,3 +18,9 @@ class InvalidBearerToken(APIException):
     status_code = status.HTTP_401_UNAUTHORIZED
     default_detail = "Invalid authentication token provided"
     default_code = "invalid_token"
+
+
+class AuthenticsUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Authentication service is unavailable, try again later"
+    default_code = "authentics_unavailable"
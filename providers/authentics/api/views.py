@@ -1,11 +1,11 @@
 from django.contrib.auth import get_user_model
 from drf_spectacular.utils import extend_schema
-from requests.exceptions import JSONDecodeError
+from requests.exceptions import JSONDecodeError, RequestException
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from ..clients import authentics
-from .exceptions import AuthenticationFailed
+from .exceptions import AuthenticationFailed, AuthenticsUnavailable
 from .serializers import (
     LoginSerializer,
     ObtainTokenSerializer,
@@ -58,9 +58,12 @@ class TokenObtainView(APIView):
         )
         serializer.is_valid(raise_exception=True)
 
-        resp = authentics.obtain_access_token(
-            authorization_code=serializer.data["authorization_code"]
-        )
+        try:
+            resp = authentics.obtain_access_token(
+                authorization_code=serializer.data["authorization_code"]
+            )
+        except RequestException:
+            raise AuthenticsUnavailable()
         if resp.status_code not in [200, 201]:
             try:
                 resp_json = resp.json()
@@ -105,9 +108,12 @@ class TokenRefreshView(APIView):
             context={"context": self.get_serializer_context()},
         )
         serializer.is_valid(raise_exception=True)
-        resp = authentics.refresh_access_token(
-            refresh_token=serializer.data["refresh_token"]
-        )
+        try:
+            resp = authentics.refresh_access_token(
+                refresh_token=serializer.data["refresh_token"]
+            )
+        except RequestException:
+            raise AuthenticsUnavailable()
         if resp.status_code not in [200, 201]:
             try:
                 resp_json = resp.json()
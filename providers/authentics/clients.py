@@ -3,10 +3,15 @@ import hashlib
 import logging
 import random
 import string
+import threading
+import time
 from urllib import parse
 
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 code_verifier = "".join(
     random.choice(string.ascii_uppercase + string.digits)
@@ -25,11 +30,118 @@ CLIENT_SECRET = settings.AUTHENTICS_CLIENT_SECRET
 REDIRECT_URL = settings.AUTHENTICS_REDIRECT_URL
 API_KEY = settings.AUTHENTICS_API_KEY
 
+# (connect, read) timeouts of every call to Authentics, in seconds
+TIMEOUT = getattr(settings, "AUTHENTICS_TIMEOUT", (3.05, 10))
+POOL_SIZE = getattr(settings, "AUTHENTICS_POOL_SIZE", 20)
+RETRIES = getattr(settings, "AUTHENTICS_RETRIES", 2)
+RETRY_BACKOFF = getattr(settings, "AUTHENTICS_RETRY_BACKOFF", 0.2)
+BREAKER_THRESHOLD = getattr(settings, "AUTHENTICS_BREAKER_THRESHOLD", 5)
+BREAKER_RESET = getattr(settings, "AUTHENTICS_BREAKER_RESET", 30)
+
 GRANT_REFRESH_TOKEN = "refresh_token"
 GRANT_AUTHORIZATION_CODE = "authorization_code"
 
 
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """Authentics is failing, the circuit breaker rejects the calls."""
+
+
+class CircuitBreaker:
+    """
+    Open after ``threshold`` consecutive failures, the calls are then
+    rejected without reaching the server for ``reset`` seconds. One trial
+    call is let through afterwards, its success closes the breaker again.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset:
+                raise CircuitOpen("Authentics is unavailable.")
+            # Half open, let this call probe the server
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning("Authentics circuit breaker opened")
+                self.opened_at = time.monotonic()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the process wide session, its pool keeps the connections to
+    Authentics alive. Connection errors are retried, the reads and 5xx
+    answers only for idempotent methods.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
 class AuthenticClient:
+    def __init__(self, session=None, breaker=None, timeout=None):
+        self.session = session
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout or TIMEOUT
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request to Authentics through the pooled session. Connection
+        errors, timeouts and 5xx answers count as failures of the breaker.
+        """
+        self.breaker.before_call()
+        kwargs.setdefault("timeout", self.timeout)
+        session = self.session or get_session()
+        try:
+            resp = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
+
     def get_login_url(self, next=None):
         params = {
             "response_type": "code",
@@ -64,7 +176,7 @@ class AuthenticClient:
                     "refresh_token": refresh_token,
                 }
             )
-        resp = requests.post(BASE_URL + "/api/oauth/token/", data=payload)
+        resp = self.request("POST", BASE_URL + "/api/oauth/token/", data=payload)
         return resp
 
     def obtain_access_token(self, authorization_code=None):
@@ -86,8 +198,39 @@ class AuthenticClient:
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json",
         }
-        resp = requests.request("GET", url, headers=headers, data={})
+        resp = self.request("GET", url, headers=headers)
         return resp
 
 
+class AsyncAuthenticClient:
+    """
+    Awaitable calls for the ASGI views. The calls run in worker threads on
+    the pooled session of ``client``, sharing its circuit breaker.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def request(self, method, url, **kwargs):
+        return await sync_to_async(self.client.request, thread_sensitive=False)(
+            method, url, **kwargs
+        )
+
+    async def obtain_access_token(self, authorization_code=None):
+        return await sync_to_async(
+            self.client.obtain_access_token, thread_sensitive=False
+        )(authorization_code=authorization_code)
+
+    async def refresh_access_token(self, refresh_token=None):
+        return await sync_to_async(
+            self.client.refresh_access_token, thread_sensitive=False
+        )(refresh_token=refresh_token)
+
+    async def get_user_profile(self, access_token):
+        return await sync_to_async(
+            self.client.get_user_profile, thread_sensitive=False
+        )(access_token)
+
+
 authentics = AuthenticClient()
+async_authentics = AsyncAuthenticClient(authentics)
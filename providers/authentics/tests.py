@@ -1 +1,149 @@
+import time
+from unittest import mock
 
+import jwt
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from rest_framework.exceptions import AuthenticationFailed
+
+from .api.authentication import AuthenticsOauth, get_token_ttl
+from .api.exceptions import AuthenticsUnavailable
+from .clients import (
+    AsyncAuthenticClient,
+    AuthenticClient,
+    CircuitBreaker,
+    CircuitOpen,
+    get_session,
+)
+
+User = get_user_model()
+
+PROFILE = {
+    "id": "b6c3b1f4-1111-4c3a-9b1e-6c1f0f4c0001",
+    "username": "authentics_user",
+    "email": "user@example.com",
+    "first_name": "Authentics",
+    "last_name": "User",
+}
+
+
+def profile_response(status_code=200, data=None):
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = PROFILE if data is None else data
+    return response
+
+
+@mock.patch("providers.authentics.api.authentication.authentics.get_user_profile")
+class TestAuthenticsOauth(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.factory = RequestFactory()
+        self.authentication = AuthenticsOauth()
+        return super().setUp()
+
+    def authenticate(self, authorization):
+        request = self.factory.get("/", HTTP_AUTHORIZATION=authorization)
+        return self.authentication.authenticate(request)
+
+    def test_identity_is_cached(self, get_user_profile):
+        get_user_profile.return_value = profile_response()
+        user, _ = self.authenticate("Bearer token-1")
+        self.assertEqual(user.username, "authentics_user")
+
+        # Known token, unchanged profile: no remote call and no write
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate("Bearer token-1")
+        self.assertEqual(get_user_profile.call_count, 1)
+
+        self.authenticate("Bearer token-2")
+        self.assertEqual(get_user_profile.call_count, 2)
+
+    def test_changed_fields_are_saved(self, get_user_profile):
+        get_user_profile.return_value = profile_response()
+        self.authenticate("Bearer token-1")
+
+        get_user_profile.return_value = profile_response(
+            data=dict(PROFILE, email="new@example.com")
+        )
+        with mock.patch.object(User, "save", autospec=True) as save:
+            self.authenticate("Bearer token-2")
+        save.assert_called_once_with(mock.ANY, update_fields=["email"])
+
+    def test_inactive_user(self, get_user_profile):
+        get_user_profile.return_value = profile_response()
+        User.objects.create(is_active=False, **PROFILE)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate("Bearer token-1")
+
+    def test_rejected_token(self, get_user_profile):
+        get_user_profile.return_value = profile_response(401, {"detail": "Expired"})
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate("Bearer token-1")
+
+    def test_other_schemes_are_ignored(self, get_user_profile):
+        self.assertIsNone(self.authenticate("JWT token-1"))
+        self.assertIsNone(self.authenticate("Basic dXNlcjpwYXNz"))
+        get_user_profile.assert_not_called()
+
+    def test_token_ttl_bounded_by_expiry(self, get_user_profile):
+        token = jwt.encode({"exp": int(time.time()) + 30}, "x" * 32)
+        self.assertLessEqual(get_token_ttl(token), 30)
+        self.assertLessEqual(get_token_ttl("opaque-token"), 300)
+
+
+class TestAuthenticClient(TestCase):
+    def setUp(self) -> None:
+        self.session = mock.Mock()
+        self.client = AuthenticClient(
+            session=self.session, breaker=CircuitBreaker(threshold=2, reset=30)
+        )
+        return super().setUp()
+
+    def test_pooled_session(self):
+        self.assertIs(get_session(), get_session())
+        adapter = get_session().get_adapter("https://authentics.example.com")
+        self.assertEqual(adapter.max_retries.total, 2)
+
+    def test_timeout(self):
+        self.session.request.return_value = mock.Mock(status_code=200)
+        self.client.get_user_profile("token-1")
+        self.assertEqual(self.session.request.call_args[1]["timeout"], (3.05, 10))
+
+    def test_circuit_breaker(self):
+        self.session.request.side_effect = requests.exceptions.ConnectTimeout()
+        with self.assertLogs("providers.authentics.clients", "WARNING"):
+            for _ in range(2):
+                with self.assertRaises(requests.exceptions.ConnectTimeout):
+                    self.client.get_user_profile("token-1")
+
+        # Open, the server is not called anymore
+        with self.assertRaises(CircuitOpen):
+            self.client.get_user_profile("token-1")
+        self.assertEqual(self.session.request.call_count, 2)
+
+        # Once reset, a successful trial call closes it
+        self.session.request.side_effect = None
+        self.session.request.return_value = mock.Mock(status_code=200)
+        with mock.patch(
+            "providers.authentics.clients.time.monotonic",
+            return_value=time.monotonic() + 31,
+        ):
+            self.client.get_user_profile("token-1")
+        self.assertFalse(self.client.breaker.is_open)
+
+    def test_async_client(self):
+        self.session.request.return_value = mock.Mock(status_code=200)
+        resp = async_to_sync(AsyncAuthenticClient(self.client).get_user_profile)(
+            "token-1"
+        )
+        self.assertEqual(resp.status_code, 200)
+
+    @mock.patch("providers.authentics.api.authentication.authentics.get_user_profile")
+    def test_unavailable(self, get_user_profile):
+        get_user_profile.side_effect = CircuitOpen()
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION="Bearer token-1")
+        with self.assertRaises(AuthenticsUnavailable):
+            AuthenticsOauth().authenticate(request)
@@ -8,6 +8,7 @@ from allauth.socialaccount.providers.oauth2.views import (
 )
 from django.conf import settings
 
+from .clients import authentics
 from .provider import AuthenticsProvider
 
 
@@ -39,7 +40,8 @@ class AuthenticsOauth2Client(OAuth2Client):
         self._strip_empty_keys(data)
         url = self.access_token_url
 
-        resp = requests.post(
+        resp = authentics.request(
+            "POST",
             url,
             data=data,
             headers=self.headers,
@@ -74,7 +76,7 @@ class AuthenticsAdapter(OAuth2Adapter):
 
     def complete_login(self, request, app, token, **kwargs):
         headers = {"Authorization": "Bearer {0}".format(token.token)}
-        resp = requests.get(self.profile_url, headers=headers)
+        resp = authentics.request("GET", self.profile_url, headers=headers)
         extra_data = resp.json()
         login = self.get_provider().sociallogin_from_response(request, extra_data)
         return login
@@ -0,0 +1 @@
+from .extensions import JWTAuthenticationScheme, SchemeAuthenticationExtension  # NOQA
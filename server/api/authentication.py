@@ -0,0 +1,121 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+# Short, a rejected token is not expected to become valid
+NEGATIVE_CACHE_TTL = getattr(settings, "API_AUTHENTICATION_NEGATIVE_CACHE_TTL", 60)
+
+SESSION_AUTHENTICATION = "rest_framework.authentication.SessionAuthentication"
+
+JWT_HEADER_TYPES = getattr(settings, "SIMPLE_JWT", {}).get(
+    "AUTH_HEADER_TYPES", ("Bearer",)
+)
+
+
+def get_default_schemes():
+    schemes = {"Basic": "rest_framework.authentication.BasicAuthentication"}
+    for header_type in JWT_HEADER_TYPES:
+        schemes[header_type] = "auths.authentication.JWTAuthentication"
+    # Authentics takes over its prefix, Bearer unless configured otherwise
+    token_prefix = getattr(settings, "AUTHENTICS_TOKEN_PREFIX", "Bearer")
+    schemes[token_prefix] = "providers.authentics.api.authentication.AuthenticsOauth"
+    return schemes
+
+
+AUTHENTICATION_SCHEMES = getattr(
+    settings, "API_AUTHENTICATION_SCHEMES", get_default_schemes()
+)
+# Used instead on the views opting in with ``stateless_authentication``
+STATELESS_AUTHENTICATION_SCHEMES = getattr(
+    settings,
+    "API_STATELESS_AUTHENTICATION_SCHEMES",
+    {
+        header_type: "auths.authentication.StatelessJWTAuthentication"
+        for header_type in JWT_HEADER_TYPES
+    },
+)
+
+
+class SchemeAuthentication(BaseAuthentication):
+    """
+    Hand the request to the single backend of its ``Authorization`` scheme,
+    see ``API_AUTHENTICATION_SCHEMES``, or to the session authentication
+    when there is no such header. Unknown schemes are left unauthenticated.
+
+    Credentials rejected by a backend are remembered by their sha256 digest
+    for ``API_AUTHENTICATION_NEGATIVE_CACHE_TTL`` seconds and rejected again
+    without running the backend.
+
+    A view sets ``stateless_authentication`` to ``True``, or to the names of
+    its actions, to be authenticated by the backends of
+    ``API_STATELESS_AUTHENTICATION_SCHEMES`` which do not load the user.
+    """
+
+    schemes = {
+        scheme.lower(): import_string(path)
+        for scheme, path in AUTHENTICATION_SCHEMES.items()
+    }
+    stateless_schemes = {
+        scheme.lower(): import_string(path)
+        for scheme, path in STATELESS_AUTHENTICATION_SCHEMES.items()
+    }
+    session_class = import_string(SESSION_AUTHENTICATION)
+
+    def is_stateless(self, request):
+        view = getattr(request, "parser_context", {}).get("view")
+        stateless = getattr(view, "stateless_authentication", False)
+        if isinstance(stateless, bool):
+            return stateless
+        return getattr(view, "action", None) in stateless
+
+    def get_backends(self):
+        """Return an instance of every backend, the session one last."""
+        backends = {}
+        for backend_class in [*self.schemes.values(), self.session_class]:
+            backends.setdefault(backend_class, backend_class())
+        return list(backends.values())
+
+    def get_backend(self, request):
+        header = get_authorization_header(request)
+        auth = header.split()
+        if not auth:
+            return self.session_class(), None
+        scheme = auth[0].decode("latin-1").lower()
+        backend_class = self.schemes.get(scheme)
+        if scheme in self.stateless_schemes and self.is_stateless(request):
+            backend_class = self.stateless_schemes[scheme]
+        if backend_class is None:
+            return None, None
+        return backend_class(), header
+
+    def get_cache_key(self, credentials):
+        return (
+            "api:authentication:rejected:%s" % hashlib.sha256(credentials).hexdigest()
+        )
+
+    def authenticate(self, request):
+        backend, credentials = self.get_backend(request)
+        if backend is None:
+            return None
+        if credentials is None:
+            return backend.authenticate(request)
+
+        cache_key = self.get_cache_key(credentials)
+        rejected = cache.get(cache_key)
+        if rejected is not None:
+            raise exceptions.AuthenticationFailed(rejected)
+        try:
+            return backend.authenticate(request)
+        except exceptions.AuthenticationFailed as err:
+            cache.set(cache_key, err.detail, NEGATIVE_CACHE_TTL)
+            raise
+
+    def authenticate_header(self, request):
+        backend, _ = self.get_backend(request)
+        if backend is None or isinstance(backend, self.session_class):
+            backend = self.get_backends()[0]
+        return backend.authenticate_header(request)
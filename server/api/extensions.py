@@ -0,0 +1,49 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+
+
+class JWTAuthenticationScheme(SimpleJWTScheme):
+    target_class = "auths.authentication.JWTAuthentication"
+    match_subclasses = True
+
+
+class SchemeAuthenticationExtension(OpenApiAuthenticationExtension):
+    """Document every backend the scheme authentication dispatches to."""
+
+    target_class = "server.api.authentication.SchemeAuthentication"
+    name = "SchemeAuthentication"
+
+    def __init__(self, target):
+        super().__init__(target)
+        self.extensions = []
+        for backend in target.get_backends():
+            extension = OpenApiAuthenticationExtension.get_match(backend)
+            if extension is not None:
+                self.extensions.append(extension)
+        self.name = [
+            name for extension in self.extensions for name in self.names(extension)
+        ]
+
+    def names(self, extension):
+        return [extension.name] if isinstance(extension.name, str) else extension.name
+
+    def get_security_requirement(self, auto_schema):
+        # Any of the backends, not all of them
+        requirements = []
+        for extension in self.extensions:
+            requirement = extension.get_security_requirement(auto_schema)
+            if isinstance(requirement, dict):
+                requirements.append(requirement)
+            elif requirement is not None:
+                requirements.extend(requirement)
+        return requirements
+
+    def get_security_definition(self, auto_schema):
+        definitions = []
+        for extension in self.extensions:
+            definition = extension.get_security_definition(auto_schema)
+            if isinstance(extension.name, str):
+                definitions.append(definition)
+            else:
+                definitions.extend(definition)
+        return definitions
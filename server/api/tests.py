@@ -0,0 +1,83 @@
+import base64
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import SchemeAuthentication
+
+User = get_user_model()
+
+
+class TestSchemeAuthentication(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser1", password="test123")
+        self.authentication = SchemeAuthentication()
+        self.factory = RequestFactory()
+        return super().setUp()
+
+    def authenticate(self, authorization=None):
+        headers = {}
+        if authorization is not None:
+            headers["HTTP_AUTHORIZATION"] = authorization
+        request = self.factory.get("/", **headers)
+        request._request = request
+        return self.authentication.authenticate(request)
+
+    def test_jwt(self):
+        token = AccessToken.for_user(self.user)
+        with mock.patch(
+            "providers.authentics.api.authentication.AuthenticsOauth.authenticate"
+        ) as authentics:
+            user, _ = self.authenticate("JWT %s" % token)
+        self.assertEqual(user.pk, str(self.user.pk))
+        authentics.assert_not_called()
+
+    def test_basic(self):
+        credentials = base64.b64encode(b"testuser1:test123").decode()
+        user, _ = self.authenticate("Basic %s" % credentials)
+        self.assertEqual(user.pk, str(self.user.pk))
+
+    def test_bearer(self):
+        with mock.patch(
+            "providers.authentics.api.authentication.AuthenticsOauth.authenticate",
+            return_value=(self.user, None),
+        ) as authentics:
+            self.assertEqual(self.authenticate("Bearer token-1"), (self.user, None))
+        authentics.assert_called_once()
+
+    def test_unknown_scheme(self):
+        self.assertIsNone(self.authenticate("Token token-1"))
+
+    def test_rejected_credentials_are_cached(self):
+        with mock.patch(
+            "providers.authentics.api.authentication.AuthenticsOauth.authenticate",
+            side_effect=AuthenticationFailed("Invalid token"),
+        ) as authentics:
+            for _ in range(2):
+                with self.assertRaisesMessage(AuthenticationFailed, "Invalid token"):
+                    self.authenticate("Bearer bad-token")
+        authentics.assert_called_once()
+
+    def test_session(self):
+        with mock.patch(
+            "rest_framework.authentication.SessionAuthentication.authenticate",
+            return_value=None,
+        ) as session:
+            self.assertIsNone(self.authenticate())
+        session.assert_called_once()
+
+    def test_schema_extension(self):
+        extension = OpenApiAuthenticationExtension.get_match(self.authentication)
+        definitions = extension.get_security_definition(mock.Mock())
+        self.assertEqual(len(extension.name), len(definitions))
+        self.assertIn("AuthenticsOauth", extension.name)
+        self.assertIn("jwtAuth", extension.name)
+        self.assertEqual(
+            len(extension.get_security_requirement(mock.Mock())), len(extension.name)
+        )
@@ -98,6 +98,26 @@ DATABASES = {
     }
 }
 
+##############################################################################
+# CACHES
+##############################################################################
+
+# Shared by the web and Celery workers, the unread counters, idempotency keys
+# and API key generations must be seen by every process.
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": env("REDIS_URL"),
+        "OPTIONS": {
+            "PASSWORD": env("REDIS_PASSWORD") or None,
+        },
+    }
+}
+
+# Another backend, e.g. CACHE_URL=locmemcache:// for the tests (see Makefile)
+if env("CACHE_URL"):
+    CACHES = {"default": env.cache("CACHE_URL")}
+
 ##############################################################################
 # QUEUES
 ##############################################################################
@@ -117,6 +137,14 @@ CELERY_RESULT_EXTENDED = True
 # this allows you to schedule items in the Django admin.
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers.DatabaseScheduler"
 
+CELERY_BEAT_SCHEDULE = {
+    # Shorter than NOTICES_UNREAD_RECONCILE_WINDOW, so no change is missed
+    "notices.reconcile_unread_counters": {
+        "task": "notices.reconcile_unread_counters",
+        "schedule": 600,
+    },
+}
+
 
 ##############################################################################
 # AUTHENTICATIONS
@@ -36,6 +36,7 @@ env = environ.Env(
     POSTGRES_PASSWORD=(str, "postgres"),
     REDIS_PASSWORD=(str, ""),
     REDIS_URL=(str, "redis://127.0.0.1:6379/0"),
+    CACHE_URL=(str, ""),
     # Mail Server
     EMAIL_SUBJECT_PREFIX=(str, ""),
     SMTP_SENDER=(str, ""),
@@ -58,11 +58,9 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "server.api.schemas.CustomAutoSchema",
     "DEFAULT_VERSIONING_CLASS": "rest_framework.versioning.NamespaceVersioning",
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
+    # Basic, session, JWT and Authentics, picked by the Authorization scheme
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.BasicAuthentication",
-        "rest_framework.authentication.SessionAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-        "providers.authentics.api.authentication.AuthenticsOauth",
+        "server.api.authentication.SchemeAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework_api_key.permissions.HasAPIKey",